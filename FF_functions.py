@@ -7,7 +7,7 @@ from cut_etau_functions  import make_etau_region,  make_etau_cut
 from cut_dimuon_functions  import make_dimuon_region, make_dimuon_cut
 from cut_emu_functions  import make_emu_region, make_emu_cut
 from FF_dictionary import FF_fit_values, FF_mvis_weights
-from calculate_functions import user_exp, user_line, user_line_p_const
+from calculate_functions import user_exp, user_line, user_line_p_const, gather_from_jagged
 from plotting_functions import set_vars_to_plot
 
 def FF_control_flow(final_state_mode, semilep_mode, region, event_dictionary, DeepTau_version):
@@ -342,7 +342,130 @@ def make_emu_DRar_aiso_cut(event_dictionary):
 # Calculation Functions
 #########################################################################################
 
-def add_FF_weights(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure=False, bypass=[]):
+def add_FF_weights(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure=False, bypass=[], use_loop=False,
+                   FF_json=None):
+  '''
+  Add the fake factor of every event as "FF_weight", the QCD (and for mutau/etau WJ) fit value
+  of the fake tau pt times the fraction of that process in the m_vis bin of the event.
+  The vectorized version is used unless 'use_loop' is True, or unless a correctionlib json
+  of the FF tables is given as 'FF_json' (see correctionlib_FF.py), which is then evaluated instead.
+  '''
+  if use_loop:
+    return add_FF_weights_loop(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure, bypass)
+  if (FF_json != None) and (bypass == []):
+    return add_FF_weights_correctionlib(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure, FF_json)
+  return add_FF_weights_vectorized(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure, bypass)
+
+
+FF_correction_sets = {} # FF_json : correctionlib CorrectionSet, loaded once per process
+
+def load_FF_corrections(FF_json):
+  '''
+  Load the FF corrections from 'FF_json', writing it from FF_dictionary.py first if it doesn't exist.
+  '''
+  if FF_json not in FF_correction_sets:
+    import os
+    import correctionlib # the high level CorrectionSet evaluates numpy arrays in one call
+    if not os.path.exists(FF_json):
+      from correctionlib_FF import write_FF_corrections
+      write_FF_corrections(FF_json)
+    FF_correction_sets[FF_json] = correctionlib.CorrectionSet.from_file(FF_json)
+  return FF_correction_sets[FF_json]
+
+
+def add_FF_weights_correctionlib(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure=False,
+                                 FF_json="FF_corrections.json"):
+  '''
+  Version of 'add_FF_weights_vectorized' evaluating the "FF_fit" and "FF_mvis_fraction" corrections
+  of 'FF_json' on the arrays of fake tau pt and m_vis in one call per process.
+  The corrections are evaluated in double precision, so the weights agree with the other versions
+  to float precision, and are returned with the dtype of the tau pt branch.
+  Fits that user_line_p_const can't use are not in the json, so they raise here like in the other versions.
+  '''
+  if (jet_mode == "2j") or (jet_mode == "3j") or (jet_mode == "4j"): jet_mode = "GTE2j"
+  FF_corrections = load_FF_corrections(FF_json)
+
+  # mutau/etau fake is always l2, ditau fake is always l1
+  fakeleg_idx = event_dictionary["l1_indices"] if final_state_mode == "ditau" else event_dictionary["l2_indices"]
+  tau_pt = gather_from_jagged(event_dictionary["Lepton_pt"], fakeleg_idx)
+  m_vis_max = 180.0 if (final_state_mode == "etau") else 300.0
+  m_vis = np.where(event_dictionary["HTT_m_vis"] < m_vis_max, event_dictionary["HTT_m_vis"], m_vis_max - 1)
+  tau_pt_input, m_vis_input = tau_pt.astype(np.float64), m_vis.astype(np.float64)
+
+  processes = {"Full" : ["QCD"] if (final_state_mode == "ditau") else ["QCD", "WJ"], "QCD" : ["QCD"], "WJ" : ["WJ"]}
+  if semilep_mode not in processes: print("add_FF_weights function error")
+  FF_weight = np.zeros(len(tau_pt))
+  for process in processes.get(semilep_mode, []):
+    FF_process = FF_corrections["FF_fit"].evaluate(final_state_mode, jet_mode, process, tau_pt_input, m_vis_input)
+    if not closure:
+      FF_process = FF_process * FF_corrections["FF_mvis_fraction"].evaluate(final_state_mode, jet_mode, process, m_vis_input)
+    FF_weight += FF_process
+  FF_weight = FF_weight.astype(tau_pt.dtype)
+
+  for i in np.flatnonzero(FF_weight <= 0):
+    print("non-positive FF weights!")
+    print("FF_weight: ", FF_weight[i])
+    print("tau_pt: ", tau_pt[i])
+    print("m_vis: ", m_vis[i])
+  event_dictionary["FF_weight"] = FF_weight
+  return event_dictionary
+
+
+def add_FF_weights_vectorized(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure=False, bypass=[]):
+  '''
+  Array version of 'add_FF_weights_loop' giving the same "FF_weight" values and dtype.
+  The fit functions are evaluated once on the array of fake tau pt, and the fractions are read
+  from FF_mvis_weights with the array of m_vis bin indices.
+  Arithmetic follows the per-event version: a clamped m_vis is a python float there, so its
+  SS --> OS correction is computed in double precision before being used with the (float32) fit value.
+  '''
+  if (jet_mode == "2j") or (jet_mode == "3j") or (jet_mode == "4j"): jet_mode = "GTE2j"
+  QCD_fitvals   = FF_fit_values[final_state_mode][jet_mode]["QCD"]
+  if (final_state_mode != "ditau"):
+    WJ_fitvals   = FF_fit_values[final_state_mode][jet_mode]["WJ"]
+  if bypass != []:  QCD_fitvals, WJ_fitvals = bypass, bypass
+
+  # mutau/etau fake is always l2, ditau fake is always l1
+  fakeleg_idx = event_dictionary["l1_indices"] if final_state_mode == "ditau" else event_dictionary["l2_indices"]
+  tau_pt = gather_from_jagged(event_dictionary["Lepton_pt"], fakeleg_idx)
+
+  m_vis_max = 180.0 if (final_state_mode == "etau") else 300.0 # exactly 300 breaks index hack below
+  clamped   = ~(event_dictionary["HTT_m_vis"] < m_vis_max)
+  m_vis     = np.where(clamped, m_vis_max - 1, event_dictionary["HTT_m_vis"])
+  if (final_state_mode == "etau"):
+    m_vis_idx = np.where(m_vis <= 40, 1, m_vis // 20).astype(int)
+  else:
+    m_vis_idx = (m_vis // 10).astype(int) # hard-coding mvis bins of 10 GeV, starting at 0 and ending at 300
+
+  user_func_QCD = user_line_p_const
+  user_func_WJ  = user_line_p_const
+  SS_to_OS = -0.0016*m_vis + 1.5008 # SS --> OS bias # new method
+  SS_to_OS[clamped] = -0.0016*(m_vis_max - 1) + 1.5008
+  FF_QCD = user_func_QCD(tau_pt, *QCD_fitvals) * SS_to_OS
+  f_QCD  = np.asarray(FF_mvis_weights[final_state_mode][jet_mode]["QCD"], dtype=FF_QCD.dtype)[m_vis_idx] if not closure else 1
+  if (final_state_mode != "ditau"):
+    FF_WJ = user_func_WJ(tau_pt, *WJ_fitvals)
+    f_WJ  = np.asarray(FF_mvis_weights[final_state_mode][jet_mode]["WJ"], dtype=FF_WJ.dtype)[m_vis_idx] if not closure else 1
+  if (semilep_mode == "Full"):
+    FF_weight = f_QCD * FF_QCD
+    if (final_state_mode != "ditau"):
+      FF_weight += f_WJ * FF_WJ
+  else: 
+    if   (semilep_mode == "QCD"):  FF_weight = f_QCD * FF_QCD
+    elif (semilep_mode == "WJ"):   FF_weight = f_WJ  * FF_WJ
+    else: print("add_FF_weights function error")
+
+  for i in np.flatnonzero(FF_weight <= 0):
+    print("non-positive FF weights!")
+    print("FF_weight: ", FF_weight[i])
+    print("tau_pt: ", tau_pt[i])
+    print("value from fit: ", user_func_QCD(event_dictionary["Lepton_pt"][i][event_dictionary["l1_indices"][i]], *QCD_fitvals))
+    print("m_vis, m_vis_idx: ", m_vis[i], m_vis_idx[i])
+  event_dictionary["FF_weight"] = FF_weight
+  return event_dictionary
+
+
+def add_FF_weights_loop(event_dictionary, final_state_mode, jet_mode, semilep_mode, closure=False, bypass=[]):
   # interface to read FF_dictionary
   unpack_FF_vars = ["Lepton_pt", "HTT_m_vis", "l1_indices", "l2_indices", "Lepton_iso"]
   unpack_FF_vars = (event_dictionary.get(key) for key in unpack_FF_vars)
@@ -419,7 +542,7 @@ def add_FF_weight_from_branch(event_dictionary, final_state_mode, process):
     event_dictionary["FF_weight"] = np.array(FF_weights)
   return event_dictionary  
 
-from producers import produce_FF_weight
+from producers import produce_FF_weight, produce_FF_weights
 def set_JetFakes_process(setup, fakesLabel, semilep_mode):
   # TODO could be improved by reducing variable name size and simplifying below operations
   JetFakes_dictionary = {}
@@ -430,13 +553,13 @@ def set_JetFakes_process(setup, fakesLabel, semilep_mode):
     JetFakes_dictionary = produce_FF_weight(setup, fakesLabel, jet_mode, semilep_mode)
     return JetFakes_dictionary
   elif (jet_mode == "Inclusive") and (do_JetFakes==True):
-    temp_JetFakes_dictionary = {}
     JetFakes_dictionary[fakesLabel] = {}
     JetFakes_dictionary[fakesLabel]["PlotEvents"] = {}
     JetFakes_dictionary[fakesLabel]["FF_weight"]  = {} 
     jetCategories = ["0j", "1j", "GTE2j"] if final_state_mode == "ditau" else ["0j", "GTE1j"]
+    # AR Data is loaded and cut once, then split in the jet categories
+    temp_JetFakes_dictionary = produce_FF_weights(setup, fakesLabel, jetCategories, semilep_mode)
     for internal_jet_mode in jetCategories:
-      temp_JetFakes_dictionary[internal_jet_mode] = produce_FF_weight(setup, fakesLabel, internal_jet_mode, semilep_mode)
       # note, this will fail and crash if only VBF data is used, because there aren't 0j or 1j modes
       if ("0j" in internal_jet_mode):
         JetFakes_dictionary[fakesLabel]["FF_weight"]  = temp_JetFakes_dictionary[internal_jet_mode][fakesLabel]["FF_weight"]
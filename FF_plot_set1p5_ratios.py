@@ -19,7 +19,7 @@ from file_map_dictionary import set_dataset_info
 from file_functions        import load_process_from_file, append_to_combined_processes, sort_combined_processes
 from FF_functions        import set_JetFakes_process
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, apply_jet_cut, set_protected_branches
+from cut_and_study_functions import apply_cut, apply_jet_cut
 
 # plotting
 from luminosity_dictionary import luminosities_with_normtag as luminosities
@@ -176,7 +176,6 @@ if __name__ == "__main__":
       event_dictionary = new_process_dictionary[process]["info"]
       if (event_dictionary == None): continue
 
-      protected_branches = ["None"]
       from cut_and_study_functions import append_lepton_indices, append_flavor_indices
       event_dictionary = append_lepton_indices(event_dictionary)
       if ("Data" not in process):
@@ -186,7 +185,7 @@ if __name__ == "__main__":
 
       from FF_functions import FF_control_flow
       event_dictionary = FF_control_flow(final_state_mode, semilep_mode, region, event_dictionary, DeepTau_version)
-      event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts", protected_branches)
+      event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts")
 
       if (event_dictionary==None or len(event_dictionary["run"])==0): continue
       event_dictionary   = apply_jet_cut(event_dictionary, jet_mode)
@@ -200,8 +199,7 @@ if __name__ == "__main__":
         event_dictionary   = make_mutau_cut(era, event_dictionary, DeepTau_version)
         if (event_dictionary==None or len(event_dictionary["run"])==0): continue
 
-      protected_branches = set_protected_branches(final_state_mode=final_state_mode, jet_mode="none")
-      event_dictionary   = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+      event_dictionary   = apply_cut(event_dictionary, "pass_cuts")
       if (event_dictionary==None or len(event_dictionary["run"])==0): continue
 
 
@@ -218,21 +216,20 @@ if __name__ == "__main__":
           if event_flavor == "J":
             pass_jet_flav.append(i)
       
-        from cut_and_study_functions import apply_cut, set_protected_branches
-        protected_branches = set_protected_branches(final_state_mode="none", jet_mode="Inclusive")
+        from cut_and_study_functions import apply_cut
         background_gen_deepcopy = copy.deepcopy(event_dictionary)
         background_gen_deepcopy["pass_flavor_cut"] = np.array(pass_gen_flav)
-        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut", protected_branches)
+        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut")
         if background_gen_deepcopy == None: continue
 
         background_lep_deepcopy = copy.deepcopy(event_dictionary)
         background_lep_deepcopy["pass_flavor_cut"] = np.array(pass_lep_flav)
-        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut", protected_branches)
+        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut")
         if background_lep_deepcopy == None: continue
 
         background_jet_deepcopy = copy.deepcopy(event_dictionary)
         background_jet_deepcopy["pass_flavor_cut"] = np.array(pass_jet_flav)
-        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut", protected_branches)
+        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut")
         if background_jet_deepcopy == None: continue
 
         combined_process_dictionary = append_to_combined_processes("DYGen", background_gen_deepcopy, vars_to_plot, 
@@ -302,9 +299,9 @@ if __name__ == "__main__":
     h_numerator_data                 = get_binned_data(final_state_mode, testing, numerator_data, var, xbins, lumi)
     h_denominator_data               = get_binned_data(final_state_mode, testing, denominator_data, var, xbins, lumi)
     h_numerator_backgrounds          = get_binned_backgrounds(final_state_mode, testing, numerator_bkgd, var, xbins, lumi)
-    h_numerator_summed_backgrounds   = get_summed_backgrounds(h_numerator_backgrounds)
+    h_numerator_summed_backgrounds   = get_summed_backgrounds(h_numerator_backgrounds, xbins)
     h_denominator_backgrounds        = get_binned_backgrounds(final_state_mode, testing, denominator_bkgd, var, xbins, lumi)
-    h_denominator_summed_backgrounds = get_summed_backgrounds(h_denominator_backgrounds)
+    h_denominator_summed_backgrounds = get_summed_backgrounds(h_denominator_backgrounds, xbins)
 
     h_num_data_m_MC, h_den_data_m_MC = subtract_data_MC(semilep_mode, 
                      h_numerator_data,   h_numerator_backgrounds,   h_numerator_summed_backgrounds, 
@@ -363,9 +360,9 @@ if __name__ == "__main__":
       h_den_data_tail = get_binned_data(final_state_mode, testing, denominator_data, var, tail_bins, lumi)
 
       h_num_bkgd_tail        = get_binned_backgrounds(final_state_mode, testing, numerator_bkgd, var, tail_bins, lumi)
-      h_num_summed_bkgd_tail = get_summed_backgrounds(h_numerator_backgrounds)
+      h_num_summed_bkgd_tail = get_summed_backgrounds(h_numerator_backgrounds, xbins)
       h_den_bkgd_tail        = get_binned_backgrounds(final_state_mode, testing, denominator_bkgd, var, tail_bins, lumi)
-      h_den_summed_bkgd_tail = get_summed_backgrounds(h_denominator_backgrounds)
+      h_den_summed_bkgd_tail = get_summed_backgrounds(h_denominator_backgrounds, xbins)
 
       h_num_data_m_MC_tail, h_den_data_m_MC_tail = subtract_data_MC(semilep_mode, 
                                      h_num_data_tail, h_num_bkgd_tail, h_num_summed_bkgd_tail,
@@ -21,7 +21,7 @@ from file_functions        import load_process_from_file, append_to_combined_pro
 #from FF_functions          import * # will lead to recursive import
 from FF_functions          import set_JetFakes_process
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, apply_jet_cut, set_protected_branches
+from cut_and_study_functions import apply_cut, apply_jet_cut
 
 # plotting
 from luminosity_dictionary import luminosities_with_normtag as luminosities
@@ -92,7 +92,6 @@ if __name__ == "__main__":
       event_dictionary = new_process_dictionary[process]["info"]
       if (event_dictionary == None): continue
 
-      protected_branches = ["None"]
       from cut_and_study_functions import append_lepton_indices, append_flavor_indices
       event_dictionary = append_lepton_indices(event_dictionary)
       if ("Data" not in process):
@@ -102,7 +101,7 @@ if __name__ == "__main__":
 
       from FF_functions import FF_control_flow
       event_dictionary = FF_control_flow(final_state_mode, semilep_mode, region, event_dictionary, DeepTau_version)
-      event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts", protected_branches)
+      event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts")
 
       if (event_dictionary==None or len(event_dictionary["run"])==0): continue
       event_dictionary   = apply_jet_cut(event_dictionary, jet_mode)
@@ -116,8 +115,7 @@ if __name__ == "__main__":
         event_dictionary   = make_mutau_cut(era, event_dictionary, DeepTau_version) # no DeepTau or Charge requirements
         if (event_dictionary==None or len(event_dictionary["run"])==0): continue
 
-      protected_branches = set_protected_branches(final_state_mode=final_state_mode, jet_mode="none")
-      event_dictionary   = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+      event_dictionary   = apply_cut(event_dictionary, "pass_cuts")
       if (event_dictionary==None or len(event_dictionary["run"])==0): continue
 
       from FF_functions import add_FF_weights
@@ -137,21 +135,20 @@ if __name__ == "__main__":
           if event_flavor == "J":
             pass_jet_flav.append(i)
       
-        from cut_and_study_functions import apply_cut, set_protected_branches
-        protected_branches = set_protected_branches(final_state_mode="none", jet_mode="Inclusive")
+        from cut_and_study_functions import apply_cut
         background_gen_deepcopy = copy.deepcopy(event_dictionary)
         background_gen_deepcopy["pass_flavor_cut"] = np.array(pass_gen_flav)
-        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut", protected_branches)
+        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut")
         if background_gen_deepcopy == None: continue
 
         background_lep_deepcopy = copy.deepcopy(event_dictionary)
         background_lep_deepcopy["pass_flavor_cut"] = np.array(pass_lep_flav)
-        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut", protected_branches)
+        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut")
         if background_lep_deepcopy == None: continue
 
         background_jet_deepcopy = copy.deepcopy(event_dictionary)
         background_jet_deepcopy["pass_flavor_cut"] = np.array(pass_jet_flav)
-        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut", protected_branches)
+        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut")
         if background_jet_deepcopy == None: continue
 
         combined_process_dictionary = append_to_combined_processes("DYGen", background_gen_deepcopy, vars_to_plot, 
@@ -218,12 +215,12 @@ if __name__ == "__main__":
     h_pseudo_SR_data = get_binned_data(final_state_mode, testing, pseudo_SR_data, var, xbins, lumi)
     h_pseudo_AR_data = get_binned_data(final_state_mode, testing, pseudo_AR_data, var, xbins, lumi)
     h_pseudo_SR_backgrounds        = get_binned_backgrounds(final_state_mode, testing, pseudo_SR_bkgd, var, xbins, lumi)
-    h_pseudo_SR_summed_backgrounds = get_summed_backgrounds(h_pseudo_SR_backgrounds)
+    h_pseudo_SR_summed_backgrounds = get_summed_backgrounds(h_pseudo_SR_backgrounds, xbins)
     h_pseudo_AR_backgrounds        = get_binned_backgrounds(final_state_mode, testing, pseudo_AR_bkgd, var, xbins, lumi)
-    h_pseudo_AR_summed_backgrounds = get_summed_backgrounds(h_pseudo_AR_backgrounds)
+    h_pseudo_AR_summed_backgrounds = get_summed_backgrounds(h_pseudo_AR_backgrounds, xbins)
 
     h_QCD           = get_binned_backgrounds(final_state_mode, testing, QCD_dictionary, var, xbins, 1)
-    h_QCD_for_ratio = get_summed_backgrounds(h_QCD)
+    h_QCD_for_ratio = get_summed_backgrounds(h_QCD, xbins)
 
     h_pseudo_SR_data_m_MC = {}
     h_pseudo_SR_data_m_MC["Data"] = {}
@@ -65,13 +65,13 @@ def add_final_state_branches(branches_, final_state_mode):
   return branches_
 
 
-from triggers_dictionary import triggers_dictionary
+from triggers_dictionary import triggers_dictionary, get_trigger_era
 
 def add_trigger_branches(branches_, era, final_state_mode):
   '''
   Helper function to add HLT branches used by a given final state
   '''
-  era_year = "2022" if "2022" in era else "2023"
+  era_year = get_trigger_era(era)
   for trigger in triggers_dictionary[era_year][final_state_mode]:
     branches_.append(trigger)
 
@@ -1,5 +1,6 @@
 import numpy as np
 #import ROOT
+from event_table import JaggedBranch
 
 ### README
 # this file contains functions to perform simple calculations and return or print the result
@@ -23,10 +24,44 @@ def calculate_underoverflow(events, xbins, weights, variable=""):
   return underflow_value, overflow_value, underflow_error, overflow_error
 
 
+def fill_histogram(events, xbins, weights, variable=""):
+  '''
+  Fused version of 'np.histogram' for the weights and squared weights with 'calculate_underoverflow'.
+  The bin of every event is found once with np.searchsorted and the sums of weights and squared weights
+  per bin come from np.bincount, instead of four np.histogram calls (which sort the events each time).
+  Returns the binned weights and squared weights with the underflow and overflow added to the first
+  and last bins, equal to the separate calls to float precision (the sums are accumulated in a different
+  order and in double precision, so float32 weights can differ by ~1e-5 relative). Like the separate calls,
+  events beyond +-999999 (and NaN) are not counted, events equal to the last bin edge are counted
+  in the last bin and in the overflow, and the overflow added to the squared weights is the sum of weights.
+  '''
+  events, weights = np.asarray(events), np.asarray(weights)
+  xbins  = np.asarray(xbins, dtype=float)
+  nBins  = len(xbins) - 1
+  # bin 0: below -999999, 1: underflow, 2 to nBins+1: xbins, nBins+2: overflow, nBins+3: above 999999 or NaN
+  edges  = np.concatenate(([-999999.], xbins, [np.nextafter(999999., np.inf)]))
+  bin_idx = np.searchsorted(edges, events, side="right")
+  sumw   = np.bincount(bin_idx, weights=weights, minlength=nBins+4)
+  sumw2  = np.bincount(bin_idx, weights=weights*weights, minlength=nBins+4)
+  underflow_value, overflow_value = sumw[1], sumw[nBins+2]
+  if (underflow_value > 1000) or (overflow_value > 100000):
+    print(f"large under/over flow values for variable '{variable}': {underflow_value}, {overflow_value}")
+
+  at_last_edge = weights[events == xbins[-1]]
+  binned_values   = sumw[2:nBins+2]
+  binned_values[0]   += underflow_value
+  binned_values[-1]  += overflow_value + np.sum(at_last_edge)
+  binned_weight_2 = sumw2[2:nBins+2]
+  binned_weight_2[0]  += sumw2[1]
+  binned_weight_2[-1] += overflow_value + np.sum(at_last_edge*at_last_edge)
+  dtype = np.result_type(weights.dtype, np.float32)
+  return binned_values.astype(dtype), binned_weight_2.astype(dtype)
+
+
 def check_nEvents(combined_process_dict):
   # for checking nEvents in samples and entering SR
   for key in combined_process_dict.keys():
-    nEvents = len(combined_process_dict[key]["Cuts"]["pass_cuts"])
+    nEvents = len(next(iter(combined_process_dict[key]["PlotEvents"].values())))
     print(f"{key}, {nEvents}")
 
 
@@ -152,6 +187,9 @@ def calculate_dR(eta1, phi1, eta2, phi2):
 
 def phi_mpi_pi(delta_phi):
   '''return phi between a range of negative pi and pi'''
+  if (np.ndim(delta_phi) > 0): # same thing for an array of values
+    return np.where(delta_phi > np.pi, delta_phi - 2*np.pi,
+                    np.where(delta_phi < -np.pi, delta_phi + 2*np.pi, delta_phi))
   if (delta_phi > np.pi):
     return delta_phi - 2*np.pi
   elif (delta_phi < -np.pi):
@@ -227,6 +265,120 @@ def return_TLorentz_Jets(passingJetsPt, passingJetsEta, passingJetsPhi, passingJ
           special_tag = True
   return TLorentzVector_Jets, j1_idx, j2_idx, mjj, special_tag
 
+def flatten_jagged(jagged_branch):
+  '''
+  Return the flat content and the offsets of a jagged branch loaded with library="np",
+  which is an object array holding one array per event. The values of event i are
+  content[offsets[i]:offsets[i+1]], so per-event indexing can be done with numpy gathers.
+  A JaggedBranch is already stored this way and is returned without copying.
+  '''
+  if isinstance(jagged_branch, JaggedBranch): return jagged_branch.content, jagged_branch.offsets
+  counts  = np.fromiter((len(values) for values in jagged_branch), dtype=np.int64, count=len(jagged_branch))
+  offsets = np.zeros(len(jagged_branch)+1, dtype=np.int64)
+  np.cumsum(counts, out=offsets[1:])
+  content = np.concatenate(jagged_branch) if len(jagged_branch) > 0 else np.array([])
+  return content, offsets
+
+
+def take_from_jagged(content, offsets, index, events=None):
+  '''
+  Return the value at 'index' of every event from a flattened jagged branch (see 'flatten_jagged'),
+  i.e. the array version of [values[idx] for values, idx in zip(jagged_branch, index)].
+  Negative indices count from the end of each event like in python.
+  If the event numbers 'events' are given, 'index' only refers to those events.
+  '''
+  starts, stops = offsets[:-1], offsets[1:]
+  if events is not None: starts, stops = starts[events], stops[events]
+  index = np.where(index < 0, index + (stops - starts), index)
+  return content[starts + index]
+
+
+def gather_from_jagged(jagged_branch, index, events=None):
+  '''
+  Array version of [values[idx] for values, idx in zip(jagged_branch, index)] for a jagged branch
+  (object array or JaggedBranch), e.g. the pt of the first lepton of every event with
+  gather_from_jagged(event_dictionary["Lepton_pt"], l1_idx). See 'take_from_jagged' for 'events'.
+  '''
+  content, offsets = flatten_jagged(jagged_branch)
+  return take_from_jagged(content, offsets, index, events)
+
+
+def count_in_jagged(passing_content, offsets):
+  '''
+  Segmented sum of a flattened jagged boolean (see 'flatten_jagged'), i.e. the number of
+  passing entries in every event, like [sum(values) for values in jagged_branch].
+  '''
+  running_count = np.zeros(len(passing_content)+1, dtype=np.int64)
+  np.cumsum(passing_content, out=running_count[1:])
+  return running_count[offsets[1:]] - running_count[offsets[:-1]]
+
+
+def select_in_jagged(passing_content, offsets):
+  '''
+  Return the offsets of a flattened jagged branch after keeping only the entries in 'passing_content',
+  to be used with content[passing_content] of any branch with the same structure.
+  '''
+  new_offsets = np.zeros(len(offsets), dtype=np.int64)
+  np.cumsum(count_in_jagged(passing_content, offsets), out=new_offsets[1:])
+  return new_offsets
+
+
+def find_dijet_pairs(pt_content, eta_content, phi_content, mass_content, offsets):
+  '''
+  ROOT-free version of 'return_TLorentz_Jets' for all events at once, taking flattened jet branches
+  (see 'flatten_jagged'). Jets are padded to the largest jet multiplicity in the sample and the
+  invariant mass of every jet pair is computed from pt, eta, phi, and mass the same way as
+  TLorentzVector. The first pair with the largest mass is kept, like 'highest_mjj_pair' does.
+  Each pair position is evaluated for all events in one step, so memory does not grow with the number of pairs.
+  Returns per event
+    j1_idx, j2_idx : the jet indices of the pair, -1 for events with < 2 jets
+    mjj, detajj    : the pair mass and |delta eta|, -999 for events with < 2 jets
+    special_tag    : the Run2 VBF trigger tag (>= 3 jets, mjj > 700, and any jet with pt > 120)
+  '''
+  nEvents, counts = len(offsets)-1, np.diff(offsets)
+  j1_idx, j2_idx  = np.full(nEvents, -1), np.full(nEvents, -1)
+  mjj, detajj     = np.full(nEvents, -999.), np.full(nEvents, -999.)
+  special_tag     = np.zeros(nEvents, dtype=bool)
+  max_jets = counts.max() if nEvents > 0 else 0
+  if max_jets < 2: return j1_idx, j2_idx, mjj, detajj, special_tag
+
+  is_jet = np.arange(max_jets) < counts[:, np.newaxis]
+  def pad(content):
+    padded = np.zeros((nEvents, max_jets))
+    padded[is_jet] = content
+    return padded
+  pt, eta, phi, mass = pad(pt_content), pad(eta_content), pad(phi_content), pad(mass_content)
+  px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+  E = np.sqrt(px*px + py*py + pz*pz + mass*mass)
+
+  for j_jet in range(max_jets):
+    for k_jet in range(j_jet+1, max_jets):
+      has_pair = (counts > k_jet)
+      mm = (E[:, j_jet] + E[:, k_jet])**2 - (px[:, j_jet] + px[:, k_jet])**2 \
+           - (py[:, j_jet] + py[:, k_jet])**2 - (pz[:, j_jet] + pz[:, k_jet])**2
+      temp_mjj = np.where(mm < 0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm))) # same as TLorentzVector.M()
+      is_higher = has_pair & (temp_mjj > mjj)
+      mjj[is_higher], j1_idx[is_higher], j2_idx[is_higher] = temp_mjj[is_higher], j_jet, k_jet
+
+  has_pair = (counts >= 2)
+  events = np.flatnonzero(has_pair)
+  detajj[has_pair] = np.abs(eta[events, j1_idx[has_pair]] - eta[events, j2_idx[has_pair]])
+  # add special tag for Run2 VBF trigger, HARDCODED VALUES FOR RUN2 VBF TRIGGER
+  special_tag = (counts >= 3) & (mjj > 700) & np.any(is_jet & (pt > 120), axis=1)
+  return j1_idx, j2_idx, mjj, detajj, special_tag
+
+
+def highest_mjj_pair_vectorized(jet_pt, jet_eta, jet_phi, jet_mass):
+  '''
+  Same as 'find_dijet_pairs' but taking jagged jet branches as loaded with library="np".
+  '''
+  pt_content,   offsets = flatten_jagged(jet_pt)
+  eta_content,  _       = flatten_jagged(jet_eta)
+  phi_content,  _       = flatten_jagged(jet_phi)
+  mass_content, _       = flatten_jagged(jet_mass)
+  return find_dijet_pairs(pt_content, eta_content, phi_content, mass_content, offsets)
+
+
 def user_exp(x, a, b, c, d):
     return a*np.exp(-b*(x-c)) + d
 
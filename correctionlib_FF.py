@@ -0,0 +1,140 @@
+import correctionlib.schemav2 as cs
+from FF_dictionary import FF_fit_values, FF_mvis_weights
+
+### README
+# this file exports the fake factor tables of FF_dictionary.py to a correctionlib json,
+# which 'add_FF_weights' evaluates when it is given the json (see --FF_json in setup.py).
+# Run it directly to (re)write the json after changing FF_dictionary.py:
+#   python3 correctionlib_FF.py [output file]
+# Two corrections are written, both with inputs final state, jet mode, and process (QCD or WJ):
+# (fits without the 3 parameters of user_line_p_const are left out, as 'add_FF_weights' can't use them either)
+#   "FF_fit"           : the fit value of the fake tau pt (times the SS --> OS correction of m_vis for QCD)
+#   "FF_mvis_fraction" : the fraction of the process in the m_vis bin
+# and the FF weight is the sum over processes of their product, like in 'add_FF_weights_vectorized'.
+# m_vis is expected to be clamped the same way as there (299 for mutau/ditau, 179 for etau).
+
+FF_correction_version = 2 # increase when the meaning of the inputs or outputs changes
+FF_json_default = "FF_corrections.json"
+
+# SS --> OS bias of QCD as a line in m_vis # new method
+SS_to_OS_slope, SS_to_OS_offset = -0.0016, 1.5008
+
+# user_line_p_const of calculate_functions.py, the fit function 'add_FF_weights' uses for QCD and WJ:
+# line + const, y = a*x + b below c and y = a*c + b above
+fit_expression = "[0]*min(x,[2])+[1]"
+
+
+def make_fit_formula(fitvals, process):
+  '''
+  Formula node of the fit with parameters 'fitvals' in tau pt (x), multiplied by
+  the SS --> OS correction in m_vis (y) for QCD.
+  '''
+  if (len(fitvals) != 3):
+    raise ValueError(f"{process} fit has {len(fitvals)} parameters, user_line_p_const takes 3")
+  expression = fit_expression
+  parameters = [float(value) for value in fitvals]
+  if (process == "QCD"):
+    n = len(parameters)
+    expression = f"({expression})*([{n}]*y+[{n+1}])"
+    parameters = parameters + [SS_to_OS_slope, SS_to_OS_offset]
+  return cs.Formula(
+    nodetype="formula",
+    expression=expression,
+    parser="TFormula",
+    variables=["tau_pt", "m_vis"],
+    parameters=parameters,
+  )
+
+
+def make_fraction_binning(final_state_mode, fractions):
+  '''
+  Binning node of the m_vis fractions, using the bins of 'add_FF_weights':
+  10 GeV bins from 0 to 300, or for etau a first bin up to 40 (index 1) and 20 GeV bins up to 180.
+  '''
+  if (final_state_mode == "etau"):
+    edges   = [0.0] + [float(edge) for edge in range(40, 200, 20)]
+    content = fractions[1:len(edges)]
+  else:
+    edges   = [float(edge) for edge in range(0, 310, 10)]
+    content = fractions[:len(edges)-1]
+  return cs.Binning(
+    nodetype="binning",
+    input="m_vis",
+    edges=edges,
+    content=[float(value) for value in content],
+    flow="clamp",
+  )
+
+
+def make_category(input_name, items):
+  return cs.Category(
+    nodetype="category",
+    input=input_name,
+    content=[cs.CategoryItem(key=key, value=value) for key, value in items],
+  )
+
+
+def make_FF_corrections():
+  '''
+  Return the "FF_fit" and "FF_mvis_fraction" corrections made from FF_fit_values and FF_mvis_weights.
+  '''
+  category_inputs = [
+    cs.Variable(name="final_state", type="string", description="final state: ditau, mutau, etau"),
+    cs.Variable(name="jet_mode", type="string", description="jet mode: 0j, 1j, GTE1j, GTE2j"),
+    cs.Variable(name="process", type="string", description="process of the fake: QCD, WJ"),
+  ]
+  fit_formulas = {}
+  for final_state_mode in FF_fit_values:
+    for jet_mode in FF_fit_values[final_state_mode]:
+      for process, fitvals in FF_fit_values[final_state_mode][jet_mode].items():
+        try:
+          formula = make_fit_formula(fitvals, process)
+        except ValueError as error:
+          print(f"Leaving out {final_state_mode} {jet_mode} {process}: {error}")
+          continue
+        fit_formulas.setdefault(final_state_mode, {}).setdefault(jet_mode, {})[process] = formula
+
+  FF_fit = cs.Correction(
+    name="FF_fit",
+    version=FF_correction_version,
+    description="Fake factor fit value of the fake tau pt (times the SS --> OS correction for QCD)",
+    inputs=category_inputs + [
+      cs.Variable(name="tau_pt", type="real", description="pt of the fake tau"),
+      cs.Variable(name="m_vis", type="real", description="visible mass, clamped below 300 (180 for etau)"),
+    ],
+    output=cs.Variable(name="FF", type="real", description="fake factor"),
+    data=make_category("final_state", [
+      (final_state_mode, make_category("jet_mode", [
+        (jet_mode, make_category("process", list(fit_formulas[final_state_mode][jet_mode].items())))
+        for jet_mode in fit_formulas[final_state_mode]]))
+      for final_state_mode in fit_formulas]),
+  )
+  FF_mvis_fraction = cs.Correction(
+    name="FF_mvis_fraction",
+    version=FF_correction_version,
+    description="Fraction of the fake process in the m_vis bin",
+    inputs=category_inputs + [
+      cs.Variable(name="m_vis", type="real", description="visible mass, clamped below 300 (180 for etau)"),
+    ],
+    output=cs.Variable(name="fraction", type="real", description="fraction of the process"),
+    data=make_category("final_state", [
+      (final_state_mode, make_category("jet_mode", [
+        (jet_mode, make_category("process", [
+          (process, make_fraction_binning(final_state_mode, fractions))
+          for process, fractions in FF_mvis_weights[final_state_mode][jet_mode].items()]))
+        for jet_mode in FF_mvis_weights[final_state_mode]]))
+      for final_state_mode in FF_mvis_weights]),
+  )
+  return [FF_fit, FF_mvis_fraction]
+
+
+def write_FF_corrections(FF_json=FF_json_default):
+  FF_correction_set = cs.CorrectionSet(schema_version=2, corrections=make_FF_corrections())
+  with open(FF_json, "w") as fout:
+    fout.write(FF_correction_set.json(exclude_unset=True))
+  print(f"FF corrections (version {FF_correction_version}) written to {FF_json}")
+
+
+if __name__ == "__main__":
+  import sys
+  write_FF_corrections(sys.argv[1] if len(sys.argv) > 1 else FF_json_default)
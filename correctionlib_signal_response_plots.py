@@ -6,7 +6,6 @@ import numpy as np
 import sys
 import matplotlib.pyplot as plt
 import gc
-import copy
 
 # explicitly import used functions from user files, grouped roughly by call order and relatedness
 # import statements for setup
@@ -19,7 +18,7 @@ from file_map_dictionary import set_dataset_info
 from file_functions          import load_process_from_file, append_to_combined_processes, sort_combined_processes
 from FF_functions            import set_JetFakes_process, FF_control_flow
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, set_protected_branches
+from cut_and_study_functions import partition_by_flavor, DY_flavor_suffixes
 
 # plotting
 from luminosity_dictionary import luminosities_with_normtag as luminosities
@@ -110,37 +109,13 @@ if __name__ == "__main__":
       if cut_events == None: continue
 
       if ("DY" in process) and (final_state_mode != "dimuon"):
-        # def split_DY_by_gen, return combined_process_dictionary
-        event_flavor_arr = cut_events["event_flavor"]
-        pass_gen_flav, pass_lep_flav, pass_jet_flav = [], [], []
-        for i, event_flavor in enumerate(event_flavor_arr):
-          if event_flavor == "G": pass_gen_flav.append(i)
-          if event_flavor == "L": pass_lep_flav.append(i)
-          if event_flavor == "J": pass_jet_flav.append(i)
-    
-        protected_branches = set_protected_branches(final_state_mode="none", jet_mode="Inclusive")
-        background_gen_deepcopy = copy.deepcopy(cut_events)
-        background_gen_deepcopy["pass_flavor_cut"] = np.array(pass_gen_flav)
-        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_gen_deepcopy == None: continue
-
-        background_lep_deepcopy = copy.deepcopy(cut_events)
-        background_lep_deepcopy["pass_flavor_cut"] = np.array(pass_lep_flav)
-        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_lep_deepcopy == None: continue
-
-        background_jet_deepcopy = copy.deepcopy(cut_events)
-        background_jet_deepcopy["pass_flavor_cut"] = np.array(pass_jet_flav)
-        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_jet_deepcopy == None: continue
+        split_events = partition_by_flavor(cut_events)
+        if split_events == None: continue
 
         if ("NLO" in process): process += "temp"
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYGen"), background_gen_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYLep"), background_lep_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYJet"), background_jet_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
+        for flavor, events in split_events.items():
+          combined_process_dictionary = append_to_combined_processes(process.replace("temp",DY_flavor_suffixes[flavor]), events,
+                                               vars_to_plot, combined_process_dictionary, one_file_at_a_time)
       else:
         combined_process_dictionary = append_to_combined_processes(process, cut_events, vars_to_plot, 
                                                                    combined_process_dictionary, one_file_at_a_time)
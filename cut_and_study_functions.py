@@ -4,7 +4,9 @@ import numpy as np
 # this file contains functions to perform cuts and self-contained studies
 
 from calculate_functions  import highest_mjj_pair, return_TLorentz_Jets
+from calculate_functions  import flatten_jagged, take_from_jagged, select_in_jagged, find_dijet_pairs
 from utility_functions    import text_options, log_print
+from event_table          import EventTable
 
 from cut_ditau_functions  import make_ditau_cut 
 from cut_mutau_functions  import make_mutau_cut
@@ -14,10 +16,13 @@ from cut_emu_functions    import make_emu_cut
  
 from FF_functions         import make_ditau_SR_cut, make_mutau_SR_cut, make_etau_SR_cut, make_emu_SR_cut
 from FF_functions         import make_ditau_AR_cut, make_ditau_AR_star_cut, make_mutau_AR_cut, make_etau_AR_cut, make_emu_AR_cut
-from FF_functions         import add_FF_weights, add_FF_weight_from_branch
+from FF_functions         import add_FF_weights, add_FF_weight_from_branch, FF_control_flow
 
 from file_functions       import load_and_store_NWEvents 
-from plotting_functions   import final_state_vars, clean_jet_vars
+
+# gen-level flavor of an event as stored in "event_flavor" by 'append_flavor_indices'
+# genuine taus (G), leptons faking taus (L), and jets faking taus (J). Unclassified events are 0.
+event_flavor_codes = {"G" : 1, "L" : 2, "J" : 3}
 
 def append_lepton_indices(event_dictionary):
   '''
@@ -26,79 +31,66 @@ def append_lepton_indices(event_dictionary):
   that it is needed. 
   '''
   FSLeptons = event_dictionary["FSLeptons"]
-  l1_indices, l2_indices = [], []
-  for event in FSLeptons:
-    if len(event)>2: print(f"More than one FS pair: {event}")
-    l1_indices.append(event[0])
-    l2_indices.append(event[1])
-  event_dictionary["l1_indices"] = np.array(l1_indices)
-  event_dictionary["l2_indices"] = np.array(l2_indices)
+  FS_content, FS_offsets = flatten_jagged(FSLeptons)
+  for event in FSLeptons[np.flatnonzero(np.diff(FS_offsets) > 2)]: print(f"More than one FS pair: {event}")
+  event_dictionary["l1_indices"] = take_from_jagged(FS_content, FS_offsets, 0)
+  event_dictionary["l2_indices"] = take_from_jagged(FS_content, FS_offsets, 1)
   return event_dictionary
 
 
 def append_flavor_indices(event_dictionary, final_state_mode, keep_fakes=False):
-  unpack_flav = ["l1_indices", "l2_indices", "Lepton_tauIdx", "Tau_genPartFlav"]
-  unpack_flav = (event_dictionary.get(key) for key in unpack_flav)
-  to_check = [range(len(event_dictionary["Lepton_pt"])), *unpack_flav]
-  FS_t1_flav, FS_t2_flav = [], []
-  pass_gen_cuts, event_flavor = [], []
-  for i, l1_idx, l2_idx, tau_idx, tau_flav in zip(*to_check):
-    genuine, lep_fake, jet_fake = False, False, False
-    t1_flav = -1
-    t2_flav = -1
-    if final_state_mode == "ditau":
-      t1_flav = tau_flav[tau_idx[l1_idx]]
-      t2_flav = tau_flav[tau_idx[l2_idx]]
-      if (t1_flav == 5) and (t2_flav == 5):
-        # genuine tau --> both taus are taus at gen level
-        genuine = True
-        event_flavor.append("G")
-      elif (t1_flav == 0) or (t2_flav == 0):
-        # jet fake --> one tau is faked by jet
-        jet_fake = True
-        event_flavor.append("J")
-      elif (t1_flav < 5 and t1_flav > 0) or (t2_flav < 5 and t1_flav > 0):
-        # lep fake --> both taus are faked by lepton
-        # event with one tau faking jet enters category above first due to ordering
-        # implies also the case where both are faked but one is faked by lepton 
-        # is added to jet fakes, which i think is fine
-        lep_fake = True
-        event_flavor.append("L")
-    elif ((final_state_mode == "mutau") or (final_state_mode == "etau")):
-      t1_flav = tau_flav[tau_idx[l1_idx] + tau_idx[l2_idx] + 1] # update with NanoAODv12 samples
-      if (t1_flav == 5):
-        genuine = True
-        event_flavor.append("G")
-      elif (t1_flav == 0):
-        jet_fake = True
-        event_flavor.append("J")
-      elif (t1_flav < 5 and t1_flav > 0):
-        lep_fake = True
-        event_flavor.append("L")
-
+  '''
+  Classify MC events by the gen-level flavor of their taus ("Tau_genPartFlav", 5 is a genuine tau,
+  1-4 are leptons, 0 is a jet) and store it in "event_flavor" (see 'event_flavor_codes').
+  "pass_gen_cuts" holds the genuine and lepton fake events, and also the jet fakes if 'keep_fakes' is True,
+  and "FS_t1_flav" and "FS_t2_flav" the tau flavors of those events (-1 for no tau).
+  '''
+  if final_state_mode not in ["ditau", "mutau", "etau"]:
     # TODO: Braden I don't think this is gen-matching
-    else:
-      print(f"No gen matching for that final state ({final_state_mode}), no branches appended")
-      return event_dictionary
-  
-    if (keep_fakes==False) and ((genuine) or (lep_fake)):
-      # save genuine background events and lep_fakes, remove jet fakes with gen matching
-      # used in all categories because fakes are estimated with FF method
-      FS_t1_flav.append(t1_flav)
-      FS_t2_flav.append(t2_flav)
-      pass_gen_cuts.append(i)
-
-    if (keep_fakes==True) and ((genuine) or (lep_fake) or (jet_fake)):
-      # save all events and their flavors, even if they are jet fakes
-      # used to split DY to genuine, lep fakes, and jet fakes in all categories
-      FS_t1_flav.append(t1_flav)
-      FS_t2_flav.append(t2_flav)
-      pass_gen_cuts.append(i)
-      
-  event_dictionary["FS_t1_flav"] = np.array(FS_t1_flav)
-  event_dictionary["FS_t2_flav"] = np.array(FS_t2_flav)
-  event_dictionary["pass_gen_cuts"] = np.array(pass_gen_cuts)
-  event_dictionary["event_flavor"]  = np.array(event_flavor)
+    print(f"No gen matching for that final state ({final_state_mode}), no branches appended")
+    return event_dictionary
+
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+  tau_idx, tau_offsets   = flatten_jagged(event_dictionary["Lepton_tauIdx"])
+  tau_flav, flav_offsets = flatten_jagged(event_dictionary["Tau_genPartFlav"])
+  t1_tau_idx = take_from_jagged(tau_idx, tau_offsets, l1_idx)
+  t2_tau_idx = take_from_jagged(tau_idx, tau_offsets, l2_idx)
+  if final_state_mode == "ditau":
+    t1_flav = take_from_jagged(tau_flav, flav_offsets, t1_tau_idx)
+    t2_flav = take_from_jagged(tau_flav, flav_offsets, t2_tau_idx)
+    # genuine tau --> both taus are taus at gen level
+    genuine  = (t1_flav == 5) & (t2_flav == 5)
+    # jet fake --> one tau is faked by jet
+    jet_fake = ~genuine & ((t1_flav == 0) | (t2_flav == 0))
+    # lep fake --> both taus are faked by lepton
+    # event with one tau faking jet enters category above first due to ordering
+    # implies also the case where both are faked but one is faked by lepton 
+    # is added to jet fakes, which i think is fine
+    lep_fake = ~genuine & ~jet_fake & (((t1_flav < 5) & (t1_flav > 0)) | ((t2_flav < 5) & (t1_flav > 0)))
+  else:
+    # the light lepton has no tau index (-1), so this is the tau index of l2
+    t1_flav = take_from_jagged(tau_flav, flav_offsets, t1_tau_idx + t2_tau_idx + 1) # update with NanoAODv12 samples
+    t2_flav = np.full(len(t1_flav), -1)
+    genuine  = (t1_flav == 5)
+    jet_fake = (t1_flav == 0)
+    lep_fake = (t1_flav < 5) & (t1_flav > 0)
+
+  event_flavor = np.zeros(len(t1_flav), dtype=np.uint8)
+  event_flavor[genuine]  = event_flavor_codes["G"]
+  event_flavor[lep_fake] = event_flavor_codes["L"]
+  event_flavor[jet_fake] = event_flavor_codes["J"]
+
+  # save genuine background events and lep_fakes, remove jet fakes with gen matching
+  # used in all categories because fakes are estimated with FF method
+  # with keep_fakes, save all events and their flavors, even if they are jet fakes
+  # used to split DY to genuine, lep fakes, and jet fakes in all categories
+  pass_gen = genuine | lep_fake
+  if keep_fakes: pass_gen = pass_gen | jet_fake
+
+  event_dictionary["FS_t1_flav"] = t1_flav[pass_gen]
+  event_dictionary["FS_t2_flav"] = t2_flav[pass_gen]
+  event_dictionary["pass_gen_cuts"] = np.flatnonzero(pass_gen)
+  event_dictionary["event_flavor"]  = event_flavor
   return event_dictionary
 
 #def make_jet_cut(event_dictionary, jet_mode):
@@ -118,8 +110,93 @@ def make_temp_jet_cut(event_dictionary, jet_mode):
 
   return event_dictionary
 
+def make_jet_cut(event_dictionary, jet_mode, use_loop=False):
+  '''
+  Count the passing jets in each event, store "nCleanJetGT30" and the cut branch and
+  dijet variables of the given jet_mode. By default this is done with array operations
+  over all events ('make_jet_cut_vectorized'), which does not need ROOT.
+  Setting 'use_loop' to True runs the original event loop ('make_jet_cut_loop') instead.
+  '''
+  if use_loop:
+    return make_jet_cut_loop(event_dictionary, jet_mode)
+  return make_jet_cut_vectorized(event_dictionary, jet_mode)
+
+
+def pass_jet_mode(nCleanJetGT30, jet_mode):
+  '''
+  Boolean mask of the events with the number of jets of 'jet_mode' (all events for "Inclusive").
+  '''
+  if (jet_mode == "Inclusive") or (jet_mode == "pass"): return np.ones(len(nCleanJetGT30), dtype=bool)
+  return {
+    "0j"    : nCleanJetGT30 == 0,
+    "1j"    : nCleanJetGT30 == 1,
+    "2j"    : nCleanJetGT30 == 2,
+    "3j"    : nCleanJetGT30 >= 3,
+    "GTE2j" : nCleanJetGT30 >= 2,
+    "GTE1j" : nCleanJetGT30 >= 1,
+  }[jet_mode]
+
+
+def make_jet_cut_vectorized(event_dictionary, jet_mode):
+  '''
+  Array version of 'make_jet_cut_loop' producing the same branches.
+  The passing jets of all events are selected on the flattened jet branches and the
+  highest mjj pair of each event is found with 'find_dijet_pairs' instead of TLorentzVectors.
+  '''
+  nJet = event_dictionary["nCleanJet"]
+  jet_pt,   jet_offsets = flatten_jagged(event_dictionary["CleanJet_pt"])
+  jet_eta,  _           = flatten_jagged(event_dictionary["CleanJet_eta"])
+  jet_phi,  _           = flatten_jagged(event_dictionary["CleanJet_phi"])
+  jet_mass, _           = flatten_jagged(event_dictionary["CleanJet_mass"])
+  position = np.arange(len(jet_pt)) - np.repeat(jet_offsets[:-1], np.diff(jet_offsets))
+  passing  = (position < np.repeat(nJet, np.diff(jet_offsets))) & (jet_pt > 0.0) & (np.abs(jet_eta) < 4.7)
+  #passing  = (position < np.repeat(nJet, np.diff(jet_offsets))) & (jet_pt > 30.0) & (np.abs(jet_eta) < 4.7)
+  pass_offsets = select_in_jagged(passing, jet_offsets)
+  pass_pt, pass_eta, pass_phi, pass_mass = jet_pt[passing], jet_eta[passing], jet_phi[passing], jet_mass[passing]
+  nCleanJetGT30 = np.diff(pass_offsets)
+  event_dictionary["nCleanJetGT30"] = nCleanJetGT30
+
+  if jet_mode == "pass":
+    print("debug jet mode, only filling nCleanJetGT30")
+    return event_dictionary
+  elif jet_mode == "Inclusive":
+    return event_dictionary
+  elif jet_mode == "0j":
+    event_dictionary["pass_0j_cuts"] = np.flatnonzero(pass_jet_mode(nCleanJetGT30, jet_mode))
+    return event_dictionary
+  elif jet_mode == "1j":
+    pass_1j_cuts = np.flatnonzero(pass_jet_mode(nCleanJetGT30, jet_mode))
+    event_dictionary["pass_1j_cuts"]       = pass_1j_cuts
+    event_dictionary["CleanJetGT30_pt_1"]  = pass_pt[pass_offsets[pass_1j_cuts]]
+    event_dictionary["CleanJetGT30_eta_1"] = pass_eta[pass_offsets[pass_1j_cuts]]
+    event_dictionary["CleanJetGT30_phi_1"] = pass_phi[pass_offsets[pass_1j_cuts]]
+    return event_dictionary
+
+  cut_events = np.flatnonzero(pass_jet_mode(nCleanJetGT30, jet_mode))
+  j1_idx, j2_idx, mjj, detajj, _ = find_dijet_pairs(pass_pt, pass_eta, pass_phi, pass_mass, pass_offsets)
+  j1_idx, j2_idx, mjj, detajj = j1_idx[cut_events], j2_idx[cut_events], mjj[cut_events], detajj[cut_events]
+  # with one jet (GTE1j only), the jet is stored as the first jet and the second jet values are -1
+  one_jet = (j1_idx == -1)
+  j1_flat_idx = pass_offsets[cut_events] + np.where(one_jet, 0, j1_idx)
+  j2_flat_idx = pass_offsets[cut_events] + np.where(one_jet, 0, j2_idx)
+  def take_jet_pair(content):
+    return content[j1_flat_idx], np.where(one_jet, -1, content[j2_flat_idx])
+
+  event_dictionary["pass_" + jet_mode + "_cuts"] = cut_events
+  event_dictionary["CleanJetGT30_pt_1"],  event_dictionary["CleanJetGT30_pt_2"]  = take_jet_pair(pass_pt)
+  event_dictionary["CleanJetGT30_eta_1"], event_dictionary["CleanJetGT30_eta_2"] = take_jet_pair(pass_eta)
+  event_dictionary["CleanJetGT30_phi_1"], event_dictionary["CleanJetGT30_phi_2"] = take_jet_pair(pass_phi)
+  event_dictionary["FS_mjj"]    = np.where(one_jet, -1, mjj)
+  event_dictionary["FS_detajj"] = np.where(one_jet, -1, detajj)
+  if jet_mode == "3j" or jet_mode == "GTE2j":
+    event_dictionary["FS_j1index"] = j1_idx
+    event_dictionary["FS_j2index"] = j2_idx
+
+  return event_dictionary
+
+
 #def make_old_jet_cut(event_dictionary, jet_mode):
-def make_jet_cut(event_dictionary, jet_mode):
+def make_jet_cut_loop(event_dictionary, jet_mode):
   nEvents_precut = len(event_dictionary["Lepton_pt"])
   unpack_jetVars = ["nCleanJet", "CleanJet_pt", "CleanJet_eta", "CleanJet_phi", "CleanJet_mass", 
                     #"HTT_DiJet_j1index", "HTT_DiJet_j2index",]
@@ -275,58 +352,25 @@ def make_jet_cut(event_dictionary, jet_mode):
   return event_dictionary
 
 
-def apply_cut(event_dictionary, cut_branch, protected_branches=[]):
-  DEBUG = False # set this to true to show print output from this function
+def apply_cut(event_dictionary, cut_branch):
   '''
-  Remove all entries in 'event_dictionary' not in 'cut_branch' using the numpy 'take' method.
-  Branches that are added during previous cut steps are added here because their entries
-  already pass cuts by construction.
+  Remove all entries in 'event_dictionary' not in 'cut_branch'.
+  The cut is applied lazily through 'EventTable.select' (plain dictionaries are converted to an EventTable),
+  and each branch is only reduced when it is read afterwards.
+  Branches that are added during previous cut steps with one entry per passing event are reduced by later cuts,
+  and index branches like "pass_cuts" are left as they are (see 'EventTable').
   The returned event_dictionary now only contains events passing all cuts.
 
   If all events are removed by cut, print a message to alert the user.
   The deletion is actually handled in the main body when the size of the dictionary is checked.
   '''
-  delete_sample = False
   if len(event_dictionary[cut_branch]) == 0:
     print(text_options["red"] + "ALL EVENTS REMOVED! SAMPLE WILL BE DELETED! " + text_options["reset"])
-    delete_sample = True
     return None
- 
-  #if ("cut" in cut_branch):
-  #  nEvents_precut  = len(event_dictionary["Lepton_pt"])
-  #  nEvents_postcut = len(event_dictionary[cut_branch])
-  #  log_print(f"nEvents before and after selection cut = {nEvents_precut}, {nEvents_postcut}", open('outputfile.log', 'w'))
-
-  if DEBUG: print(f"cut branch: {cut_branch}")
-  if DEBUG: print(f"protected branches: {protected_branches}")
-  for branch in event_dictionary:
-    if delete_sample:
-      pass
-
-    # TODO: fix this
-    # special handling, will need to be adjusted by hand for exactly 2j or 3j studies
-    # this only works for GTE2j, not Inclusive because the "apply_cut" method for jets is never called there
-    #if (("pass_GTE2j_cuts" in event_dictionary) and ("dijet" in branch.lower())):
-    if (("pass_GTE2j_cuts" in event_dictionary) and ("dijet" in branch.lower()) and (branch != "FS_dijet_pair_calc")):
-    #if (("pass_GTE2j_cuts" in event_dictionary) and ("dijet" in branch.lower()) and (branch not in protected_branches)):
-      print("very special GTE2j handling underway") # DEBUG
-      print(branch)
-      cut_len    = len(event_dictionary["pass_GTE2j_cuts"])
-      branch_len = len(event_dictionary[branch])
-      print(f" pass_GTE2j_cuts len : {cut_len}")
-      print(f" branch len          : {branch_len}")
-      if ( cut_len == branch_len):
-        pass
-      else:
-        event_dictionary[branch] = np.take(event_dictionary[branch], event_dictionary["pass_GTE2j_cuts"])
-      #if (branch == "CleanJetGT30_pt_3" or branch == "CleanJetGT30_eta_3"):
-      #  event_dictionary[branch] = np.take(event_dictionary[branch], event_dictionary["pass_3j_cuts"])
-
-    elif ((branch != cut_branch) and (branch not in protected_branches)):
-      if DEBUG: print(f"{len(event_dictionary[branch])} \t\t = pre cut len({branch})")
-      event_dictionary[branch] = np.take(event_dictionary[branch], event_dictionary[cut_branch])
-      if DEBUG: print(f"{len(event_dictionary[branch])} \t\t = post cut len({branch})")
 
+  if not isinstance(event_dictionary, EventTable):
+    event_dictionary = EventTable(event_dictionary)
+  event_dictionary.select(event_dictionary[cut_branch])
   return event_dictionary
 
 
@@ -355,34 +399,31 @@ def apply_final_state_cut(era, event_dictionary, final_state_mode, DeepTau_versi
   final cut. Importantly, the function that rejects events, 'apply_cut',
   is called elsewhere
   '''
-  # setting inclusive in the jet_mode includes all jet branches in protected branches
-  # this is okay because in the current ordering (FS cut then jet cut), no jet branches are ever created yet.
-  protected_branches = set_protected_branches(final_state_mode=final_state_mode, jet_mode="Inclusive")
   skip_DeepTau = False
   if final_state_mode == "ditau":
     event_dictionary = make_ditau_SR_cut(event_dictionary, DeepTau_version)
-    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts")
     if (event_dictionary == None): return event_dictionary
     event_dictionary = make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
-    event_dictionary = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_cuts")
   elif final_state_mode == "mutau":
     event_dictionary = make_mutau_SR_cut(event_dictionary, DeepTau_version)
-    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts")
     if (event_dictionary == None): return event_dictionary
     event_dictionary = make_mutau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
-    event_dictionary = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_cuts")
   elif final_state_mode == "etau":
     event_dictionary = make_etau_SR_cut(event_dictionary, DeepTau_version)
-    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts")
     if (event_dictionary == None): return event_dictionary
     event_dictionary = make_etau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
-    event_dictionary = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_cuts")
   elif final_state_mode == "emu":
     event_dictionary = make_emu_SR_cut(event_dictionary)
-    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_SR_cuts")
     if (event_dictionary == None): return event_dictionary
     event_dictionary = make_emu_cut(era, event_dictionary)
-    event_dictionary = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+    event_dictionary = apply_cut(event_dictionary, "pass_cuts")
   else:
     print(f"No cuts to apply for {final_state_mode} final state.")
   return event_dictionary
@@ -392,10 +433,49 @@ def apply_flavor_cut(event_dictionary):
   # get list of event indices with events matching flavor key
   event_flavor_array = event_dictionary["Cuts"]["event_flavor"]
   # cut out other events
-  event_dictionary = apply_cut(event_dictionary, "pass_flav_cut") # no protected branches
+  event_dictionary = apply_cut(event_dictionary, "pass_flav_cut")
   return event_dictionary
 
 
+def partition_by_flavor(event_dictionary):
+  '''
+  Split events by their gen-level "event_flavor" into genuine taus ("G"), leptons faking taus ("L"),
+  and jets faking taus ("J") with one pass over the flavor codes (see 'event_flavor_codes').
+  Each subset is an EventTable sharing the loaded values of 'event_dictionary' (see 'EventTable.subset'),
+  so nothing is copied until a branch of a subset is read.
+  Returns a dictionary of the three subsets keyed by flavor, or None if any of the subsets is empty
+  (in which case none of them are kept).
+  '''
+  if not isinstance(event_dictionary, EventTable):
+    event_dictionary = EventTable(event_dictionary)
+  event_flavor = event_dictionary["event_flavor"]
+  # counting sort by flavor code, events of the same flavor stay in their original order
+  order  = np.argsort(event_flavor, kind="stable")
+  counts = np.bincount(event_flavor, minlength=max(event_flavor_codes.values())+1)
+  starts = np.cumsum(counts) - counts
+  partitions = {}
+  for flavor, code in event_flavor_codes.items():
+    if counts[code] == 0:
+      print(text_options["red"] + "ALL EVENTS REMOVED! SAMPLE WILL BE DELETED! " + text_options["reset"])
+      return None
+    partitions[flavor] = event_dictionary.subset(order[starts[code]:starts[code]+counts[code]])
+  return partitions
+
+
+DY_flavor_suffixes = {"G" : "DYGen", "L" : "DYLep", "J" : "DYJet"}
+
+def split_DY_by_flavor(process, cut_events):
+  '''
+  Split DY events by their gen-level "event_flavor" into genuine taus (DYGen),
+  leptons faking taus (DYLep), and jets faking taus (DYJet), see 'partition_by_flavor'.
+  Returns a dictionary of the three subsets keyed by their process names,
+  or None if any of the subsets is empty (in which case none of them are kept).
+  '''
+  split_events = partition_by_flavor(cut_events)
+  if split_events == None: return None
+  return {process+DY_flavor_suffixes[flavor] : events for flavor, events in split_events.items()}
+
+
 def apply_jet_cut(event_dictionary, jet_mode):
   '''
   Organizational function to reduce event_dictionary to contain only
@@ -413,11 +493,10 @@ def apply_jet_cut(event_dictionary, jet_mode):
     "GTE2j" : "pass_GTE2j_cuts",
   }
   event_dictionary   = make_jet_cut(event_dictionary, jet_mode)
-  protected_branches = set_protected_branches(final_state_mode="none", jet_mode=jet_mode)
   if jet_mode == "Inclusive" or jet_mode == "pass":
     print("jet mode is Inclusive, no jet cut performed")
   else:
-    event_dictionary = apply_cut(event_dictionary, jet_cut_branch[jet_mode], protected_branches)
+    event_dictionary = apply_cut(event_dictionary, jet_cut_branch[jet_mode])
   return event_dictionary
 
 
@@ -437,7 +516,6 @@ def apply_HTT_FS_cuts_to_process(era, process, process_dictionary, log_file,
     return None
 
   process_events = append_lepton_indices(process_events)
-  protected_branches = ["FS_t1_flav", "FS_t2_flav", "pass_gen_cuts", "event_flavor"]
 
   if ("Data" not in process) and (final_state_mode != "dimuon"):
     if ("TTToSemiLeptonic" in process): process = "TTToSemiLeptonic"
@@ -456,7 +534,7 @@ def apply_HTT_FS_cuts_to_process(era, process, process_dictionary, log_file,
     #print("KEEPING ALL FAKES!") #DEBUG
     if (final_state_mode != "emu"):
       process_events = append_flavor_indices(process_events, final_state_mode, keep_fakes=keep_fakes)
-      process_events = apply_cut(process_events, "pass_gen_cuts", protected_branches=protected_branches)
+      process_events = apply_cut(process_events, "pass_gen_cuts")
     if (process_events==None or len(process_events["run"])==0): return None
 
   FS_cut_events = apply_final_state_cut(era, process_events, final_state_mode, DeepTau_version, tau_pt_cut, useMiniIso=useMiniIso)
@@ -473,73 +551,110 @@ def apply_HTT_FS_cuts_to_process(era, process, process_dictionary, log_file,
 
   return FS_cut_events
 
-# TODO fix this function and make it more straightforward
-# way too easy to get confused with it currently
-def set_protected_branches(final_state_mode, jet_mode, DeepTau_version="none"):
-  '''
-  Set branches to be protected (i.e. not cut on) when using "apply_cut."
-  Generally, you should protect any branches introduced by a cut.
-
-  protect all "FS" branches for FS cuts
-  protect all "pass_xj_cuts" and "JetGT30_" branches for jet cuts
-  '''
-
-  if final_state_mode != "none": # not cutting FS branches
-    protected_branches = final_state_vars[final_state_mode]
-    # all "HTT_" branches automatically handled, just protecting "FS_" branches which were introduced by a cut
-  
-  elif final_state_mode == "none":
-    if jet_mode == "Inclusive" or jet_mode=="pass": # cutting FS branches, but not the jet branches
-      jet_mode = "Inclusive"
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts", "pass_3j_cuts", "pass_GTE2j_cuts"]
-      # should fromHighestMjj branches be protected? it seems not
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "0j": # cutting FS branches, protecting just one jet branch
-      protected_branches = ["pass_0j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "1j":
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "2j":
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "3j":
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts", "pass_3j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "GTE1j":
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts", "pass_3j_cuts", "pass_GTE2j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
-
-    elif jet_mode == "GTE2j":
-      protected_branches = ["pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts", "pass_3j_cuts", "pass_GTE2j_cuts"]
-      protected_branches += clean_jet_vars[jet_mode]
-      protected_branches = [var for var in protected_branches if var != "nCleanJetGT30"] # unprotect one branch
+def select_SR_events(event_dictionary):
+  '''
+  Return the events in 'event_dictionary' flagged by "HTT_SRevent" as a new EventTable
+  sharing the loaded values with 'event_dictionary' (see 'EventTable.subset').
+  Used when events are loaded once with the looser preselection of the FF regions
+  (set_good_events with non_SR_region=True), which only differs from the SR preselection
+  by the "HTT_SRevent" requirement.
+  '''
+  if not isinstance(event_dictionary, EventTable):
+    event_dictionary = EventTable(event_dictionary)
+  return event_dictionary.subset(np.flatnonzero(event_dictionary["HTT_SRevent"]))
 
-  else:
-    print("final state mode must be specified as 'none' or a valid final state to properly protect your branches")
 
-  return protected_branches
+def apply_FF_region_cuts_to_process(era, process, event_dictionary, final_state_mode, jet_mode,
+                                    semilep_mode, region, DeepTau_version, tau_pt_cut):
+  '''
+  Organizational function holding the cuts applied to the events of a process in the region
+  used for the JetFakes estimate in standard_plot (AR_star for ditau, AR for mutau and etau).
+  Gen matching is applied to MC before the region cut, and the jet and final state cuts after.
+  Returns the cut events, or None if no events survive.
+  '''
+  event_dictionary = append_lepton_indices(event_dictionary)
+  if ("Data" not in process):
+    load_and_store_NWEvents(process, event_dictionary)
+    # Remove fakes from MC if they come from TT or WJ samples.
+    # We do this because we assume their jetFakes are not well-modeled
+    # and so we replace them with the JetFakes estimate from Data.
+    # For other MC, we use the fakes from MC, meaning those should be subtracted from Data
+    # during the estimate.
+    keep_fakes = False if (("TT" in process) or ("WJ" in process)) else True
+    event_dictionary = append_flavor_indices(event_dictionary, final_state_mode, keep_fakes=keep_fakes)
+    event_dictionary = apply_cut(event_dictionary, "pass_gen_cuts")
+    if (event_dictionary==None or len(event_dictionary["run"])==0): return None
+
+  event_dictionary = FF_control_flow(final_state_mode, semilep_mode, region, event_dictionary, DeepTau_version)
+  event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts")
+  if (event_dictionary==None or len(event_dictionary["run"])==0): return None
+
+  event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
+  if (event_dictionary==None or len(event_dictionary["run"])==0): return None
+
+  skip_DeepTau = True
+  if (final_state_mode == "ditau"):
+    event_dictionary = make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+  if (final_state_mode == "mutau"):
+    event_dictionary = make_mutau_cut(era, event_dictionary, DeepTau_version)
+  if (final_state_mode == "etau"):
+    event_dictionary = make_etau_cut(era, event_dictionary, DeepTau_version)
+  if (event_dictionary==None or len(event_dictionary["run"])==0): return None
+
+  event_dictionary   = apply_cut(event_dictionary, "pass_cuts")
+  if (event_dictionary==None or len(event_dictionary["run"])==0): return None
+  # DY splitting is skipped because MC is subtracted from Data later, where the MC is all combined anyways
+  return event_dictionary
 
 
-def apply_AR_cut(era, process, event_dictionary, final_state_mode, jet_mode, semilep_mode, DeepTau_version, tau_pt_cut):
+def apply_AR_cut(era, process, event_dictionary, final_state_mode, jet_mode, semilep_mode, DeepTau_version, tau_pt_cut,
+                 FF_json=None):
   '''
   Organizational function
   added 'skip_DeepTau' to apply a partial selection (all but leading tau deeptau reqs)
   The block below for gen matching normally is not executed since this function is only called with Data
   in standard plot
+  Split in the jet_mode independent 'apply_AR_region_cut' and 'apply_AR_jet_and_FS_cuts',
+  see 'apply_AR_cut_by_jet_mode' to do several jet modes with one AR region cut.
+  '''
+  event_dictionary = apply_AR_region_cut(era, process, event_dictionary, final_state_mode, DeepTau_version)
+  return apply_AR_jet_and_FS_cuts(era, process, event_dictionary, final_state_mode, jet_mode, semilep_mode,
+                                  DeepTau_version, tau_pt_cut, FF_json=FF_json)
+
+
+def apply_AR_cut_by_jet_mode(era, process, event_dictionary, final_state_mode, jet_modes, semilep_mode, DeepTau_version, tau_pt_cut,
+                             FF_json=None):
+  '''
+  Same as 'apply_AR_cut' for each of 'jet_modes', but the AR region cut is only applied once.
+  The events are then partitioned by the number of jets from a single 'make_jet_cut' pass (see 'pass_jet_mode'),
+  and the jet cut, final state cut, and FF weights of each jet mode are applied to its partition.
+  The partitions share the loaded values (see 'EventTable.subset').
+  Returns a dictionary of the cut events keyed by jet mode.
+  '''
+  event_dictionary = apply_AR_region_cut(era, process, event_dictionary, final_state_mode, DeepTau_version)
+  if (event_dictionary == None): return {jet_mode : None for jet_mode in jet_modes}
+  if (final_state_mode == "dimuon"):
+    return {jet_mode : apply_AR_jet_and_FS_cuts(era, process, event_dictionary, final_state_mode, jet_mode, semilep_mode,
+                                                DeepTau_version, tau_pt_cut, FF_json=FF_json) for jet_mode in jet_modes}
+  event_dictionary = make_jet_cut(event_dictionary, "Inclusive")
+  nCleanJetGT30    = event_dictionary["nCleanJetGT30"]
+  cut_events = {}
+  for jet_mode in jet_modes:
+    jet_mode_events = np.flatnonzero(pass_jet_mode(nCleanJetGT30, jet_mode))
+    if len(jet_mode_events) == 0:
+      print(text_options["red"] + f"ALL EVENTS REMOVED FROM {jet_mode}! " + text_options["reset"])
+      cut_events[jet_mode] = None
+      continue
+    jet_mode_events = event_dictionary.subset(jet_mode_events)
+    cut_events[jet_mode] = apply_AR_jet_and_FS_cuts(era, process, jet_mode_events, final_state_mode, jet_mode, semilep_mode,
+                                                    DeepTau_version, tau_pt_cut, FF_json=FF_json)
+  return cut_events
+
+
+def apply_AR_region_cut(era, process, event_dictionary, final_state_mode, DeepTau_version):
+  '''
+  First part of 'apply_AR_cut', the AR region selection which doesn't depend on the jet mode.
   '''
-  protected_branches = ["None"]
   event_dictionary = append_lepton_indices(event_dictionary)
   if ("Data" not in process) and (final_state_mode != "dimuon"):
     load_and_store_NWEvents(process, event_dictionary)
@@ -554,46 +669,55 @@ def apply_AR_cut(era, process, event_dictionary, final_state_mode, jet_mode, sem
     if ((("TT" in process) or ("WJ" in process) or ("DY" in process)) and (final_state_mode=="emu")):
       keep_fakes = True
     process_events = append_flavor_indices(process_events, final_state_mode, keep_fakes=keep_fakes)
-    process_events = apply_cut(process_events, "pass_gen_cuts", protected_branches=protected_branches)
+    process_events = apply_cut(process_events, "pass_gen_cuts")
     if (process_events==None or len(process_events["run"])==0): return None
+  if (final_state_mode == "ditau"):
+    method = "NEW"
+    print("WHICH METHOD DO YOU WANT TO BE USING?????")
+    print(f"CURRENTLY USING: {method} METHOD")
+    if (method == "OLD"):
+      event_dictionary = make_ditau_AR_cut(event_dictionary, DeepTau_version)
+      cut_string = "pass_AR_cuts"
+    elif (method == "NEW"):
+      event_dictionary = make_ditau_AR_star_cut(event_dictionary, DeepTau_version)
+      cut_string = "pass_AR_star_cuts"
+    else: print(f"METHOD NOT SET! METHOD IS: {method}     CRASHING!!!")
+    event_dictionary = apply_cut(event_dictionary, cut_string)
+  if (final_state_mode == "mutau"):
+    event_dictionary = make_mutau_AR_cut(event_dictionary, DeepTau_version)
+    event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts")
+  if (final_state_mode == "etau"):
+    event_dictionary = make_etau_AR_cut(event_dictionary, DeepTau_version)
+    event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts")
+  if (final_state_mode == "emu"):
+    event_dictionary = make_emu_AR_cut(event_dictionary, iso_region_el=True, iso_region_mu=True)
+    event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts")
+  return event_dictionary
+
+
+def apply_AR_jet_and_FS_cuts(era, process, event_dictionary, final_state_mode, jet_mode, semilep_mode, DeepTau_version, tau_pt_cut,
+                             FF_json=None):
+  '''
+  Second part of 'apply_AR_cut', the jet cut, final state cut, and FF weights of 'jet_mode'.
+  The FF weights are evaluated from the correctionlib json 'FF_json' if it is given (see 'add_FF_weights').
+  '''
   if (final_state_mode != "dimuon"):
     skip_DeepTau = True
+    event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
     if (final_state_mode == "ditau"):
-      method = "NEW"
-      print("WHICH METHOD DO YOU WANT TO BE USING?????")
-      print(f"CURRENTLY USING: {method} METHOD")
-      if (method == "OLD"):
-        event_dictionary = make_ditau_AR_cut(event_dictionary, DeepTau_version)
-        cut_string = "pass_AR_cuts"
-      elif (method == "NEW"):
-        event_dictionary = make_ditau_AR_star_cut(event_dictionary, DeepTau_version)
-        cut_string = "pass_AR_star_cuts"
-      else: print(f"METHOD NOT SET! METHOD IS: {method}     CRASHING!!!")
-      event_dictionary = apply_cut(event_dictionary, cut_string, protected_branches)
-      event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
       event_dictionary = make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
     if (final_state_mode == "mutau"):
-      event_dictionary = make_mutau_AR_cut(event_dictionary, DeepTau_version)
-      event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts", protected_branches)
-      event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
       event_dictionary = make_mutau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
     if (final_state_mode == "etau"):
-      event_dictionary = make_etau_AR_cut(event_dictionary, DeepTau_version)
-      event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts", protected_branches)
-      event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
       event_dictionary = make_etau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
     if (final_state_mode == "emu"):
-      event_dictionary = make_emu_AR_cut(event_dictionary, iso_region_el=True, iso_region_mu=True)
-      event_dictionary = apply_cut(event_dictionary, "pass_AR_cuts", protected_branches)
-      event_dictionary = apply_jet_cut(event_dictionary, jet_mode)
       event_dictionary = make_emu_cut(era, event_dictionary)
-    protected_branches = set_protected_branches(final_state_mode=final_state_mode, jet_mode="none")
-    event_dictionary   = apply_cut(event_dictionary, "pass_cuts", protected_branches)
+    event_dictionary   = apply_cut(event_dictionary, "pass_cuts")
     # weights associated with jet_mode key (testing suffix automatically removed)
     if (final_state_mode in ["etau", "emu"]):
       event_dictionary = add_FF_weight_from_branch(event_dictionary, final_state_mode, process)
     else:
-      event_dictionary = add_FF_weights(event_dictionary, final_state_mode, jet_mode, semilep_mode)
+      event_dictionary = add_FF_weights(event_dictionary, final_state_mode, jet_mode, semilep_mode, FF_json=FF_json)
   else:
     print(f"{final_state_mode} : {jet_mode} not possible. Continuing without AR or FF method applied.")
   return event_dictionary
@@ -1,8 +1,59 @@
 import numpy as np
 
-def make_dimuon_cut(event_dictionary, useMiniIso=False):
+from calculate_functions import flatten_jagged, gather_from_jagged, count_in_jagged
+
+def make_dimuon_cut(event_dictionary, useMiniIso=False, use_loop=False):
+  '''
+  Works similarly to 'make_ditau_cut', the vectorized version is used unless 'use_loop' is True.
+  '''
+  if use_loop:
+    return make_dimuon_cut_loop(event_dictionary, useMiniIso)
+  return make_dimuon_cut_vectorized(event_dictionary, useMiniIso)
+
+
+def make_dimuon_cut_vectorized(event_dictionary, useMiniIso=False):
   '''
-  Works similarly to 'make_ditau_cut'. 
+  Array version of 'make_dimuon_cut_loop' producing the same branches, see 'make_ditau_cut_vectorized'.
+  '''
+  nEvents_precut = len(event_dictionary["Lepton_pt"])
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+  def take(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index)
+
+  m1_pt, m2_pt   = take("Lepton_pt", l1_idx), take("Lepton_pt", l2_idx)
+  m1_iso, m2_iso = take("Lepton_iso", l1_idx), take("Lepton_iso", l2_idx)
+  mvis = event_dictionary["HTT_m_vis"]
+  # removed (dR > 0.5) and changed (mvis > 20) cut. Our minimum dR is 0.3 from skim level
+  passKinematics = (m1_pt > 26) & (m2_pt > 20) & (70 < mvis) & (mvis < 130)
+  iso_value = 0.40 if useMiniIso else 0.25 # for PFRelIso, Loose 25, Medium 20, Tight 15. For MiniIso, Loose 40, Medium 20, Tight 10
+  passIso = (m1_iso < iso_value) & (m2_iso < iso_value)
+
+  pass_cuts = np.flatnonzero(passKinematics & passIso)
+  l1_idx, l2_idx = l1_idx[pass_cuts], l2_idx[pass_cuts]
+  def take_passing(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index, pass_cuts)
+  m1_muIdx, m2_muIdx = take_passing("Lepton_muIdx", l1_idx), take_passing("Lepton_muIdx", l2_idx)
+
+  event_dictionary["pass_cuts"] = pass_cuts
+  event_dictionary["FS_m1_pt"]  = m1_pt[pass_cuts]
+  event_dictionary["FS_m1_eta"] = take_passing("Lepton_eta", l1_idx)
+  event_dictionary["FS_m1_phi"] = take_passing("Lepton_phi", l1_idx)
+  event_dictionary["FS_m1_iso"] = m1_iso[pass_cuts]
+  event_dictionary["FS_m1_dxy"] = np.abs(take_passing("Muon_dxy", m1_muIdx))
+  event_dictionary["FS_m1_dz"]  = take_passing("Muon_dz", m1_muIdx)
+  event_dictionary["FS_m2_pt"]  = m2_pt[pass_cuts]
+  event_dictionary["FS_m2_eta"] = take_passing("Lepton_eta", l2_idx)
+  event_dictionary["FS_m2_phi"] = take_passing("Lepton_phi", l2_idx)
+  event_dictionary["FS_m2_iso"] = m2_iso[pass_cuts]
+  event_dictionary["FS_m2_dxy"] = np.abs(take_passing("Muon_dxy", m2_muIdx))
+  event_dictionary["FS_m2_dz"]  = take_passing("Muon_dz", m2_muIdx)
+  print(f"events before and after dimuon cuts = {nEvents_precut}, {len(pass_cuts)}")
+  return event_dictionary
+
+
+def make_dimuon_cut_loop(event_dictionary, useMiniIso=False):
+  '''
+  Works similarly to 'make_ditau_cut_loop'. 
   '''
   nEvents_precut = len(event_dictionary["Lepton_pt"])
   unpack_dimuon = ["Lepton_pt", "Lepton_eta", "Lepton_phi", "Lepton_iso", 
@@ -73,33 +124,16 @@ def manual_dimuon_lepton_veto(event_dictionary):
   due to the way events are selected in step2 of the NanoTauFramework
   '''
   nEvents_precut = len(event_dictionary["Lepton_pt"])
-  unpack_veto = ["Lepton_pdgId", "Lepton_iso"]
-  unpack_veto = (event_dictionary.get(key) for key in unpack_veto)
-  to_check    = [range(len(event_dictionary["Lepton_pt"])), *unpack_veto]
-  pass_manual_lepton_veto = []
-  for i, lep_pdgId_array, lep_iso_array in zip(*to_check):
-    event_passes_manual_lepton_veto = False
-    nIsoEle, nIsoMu = 0, 0 # there are many pdgId=15 particles, but we assume those are fake taus
-    for pdgId, iso in zip(lep_pdgId_array, lep_iso_array):
-      if (abs(pdgId) == 11) and (iso < 0.3):
-        nIsoEle += 1
-      elif (abs(pdgId) == 13) and (iso < 0.3):
-        nIsoMu  += 1
-      else:
-        pass
-
-      if nIsoEle > 0:
-        event_passes_manual_lepton_veto = False
-      elif nIsoMu > 2:
-        event_passes_manual_lepton_veto = False
-      else:
-        event_passes_manual_lepton_veto = True
-
-    if event_passes_manual_lepton_veto:
-      pass_manual_lepton_veto.append(i)
-
-  event_dictionary["pass_manual_lepton_veto"] = np.array(pass_manual_lepton_veto)
-  print(f"events before and after manual dimuon lepton veto = {nEvents_precut}, {len(np.array(pass_manual_lepton_veto))}")
+  # there are many pdgId=15 particles, but we assume those are fake taus
+  lep_pdgId, lep_offsets = flatten_jagged(event_dictionary["Lepton_pdgId"])
+  lep_iso, _             = flatten_jagged(event_dictionary["Lepton_iso"])
+  nIsoEle = count_in_jagged((np.abs(lep_pdgId) == 11) & (lep_iso < 0.3), lep_offsets)
+  nIsoMu  = count_in_jagged((np.abs(lep_pdgId) == 13) & (lep_iso < 0.3), lep_offsets)
+  has_leptons = (np.diff(lep_offsets) > 0)
+  pass_manual_lepton_veto = np.flatnonzero(has_leptons & (nIsoEle == 0) & (nIsoMu <= 2))
+
+  event_dictionary["pass_manual_lepton_veto"] = pass_manual_lepton_veto
+  print(f"events before and after manual dimuon lepton veto = {nEvents_precut}, {len(pass_manual_lepton_veto)}")
   return event_dictionary
 
 
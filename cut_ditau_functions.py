@@ -1,9 +1,166 @@
 import numpy as np
 
 from calculate_functions import calculate_acoplan, return_TLorentz_Jets, calculate_mt, phi_mpi_pi
+from calculate_functions import flatten_jagged, take_from_jagged, gather_from_jagged, highest_mjj_pair_vectorized
 from branch_functions import add_trigger_branches, add_DeepTau_branches
+from triggers_dictionary import pass_kinems_by_trigger_table
+from event_table import add_derived_branch
 
-def make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=True, tau_pt_cut="None"):
+def make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=True, tau_pt_cut="None", use_loop=False):
+  '''
+  Apply the ditau final state cuts and store the "FS_*" branches and "pass_cuts".
+  By default this is done with array operations over all events ('make_ditau_cut_vectorized').
+  Setting 'use_loop' to True runs the original event loop ('make_ditau_cut_loop') instead,
+  which gives the same output and can be used to check the vectorized version, e.g. with
+  'compare_event_dictionaries' on the outputs of both run on copies of the same events.
+  '''
+  if use_loop:
+    return make_ditau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+  return make_ditau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+
+
+def make_ditau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau=True, tau_pt_cut="None"):
+  '''
+  Array version of 'make_ditau_cut_loop' producing the same branches.
+  Jagged branches are flattened once (see 'flatten_jagged') and the l1/l2 and tau index
+  lookups are done with numpy gathers. Trigger and jet requirements are boolean masks
+  over all events (see 'pass_kinems_by_trigger_table' and 'trigger_kinems_dictionary').
+  The leading dijet pair is found with 'highest_mjj_pair_vectorized', whose jet pt and eta
+  are the stored values rather than the ones recomputed from TLorentzVectors.
+  '''
+  nEvents_precut = len(event_dictionary["Lepton_pt"])
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+
+  t1_br_idx = gather_from_jagged(event_dictionary["Lepton_tauIdx"], l1_idx)
+  t2_br_idx = gather_from_jagged(event_dictionary["Lepton_tauIdx"], l2_idx)
+  def take_pair(branch, t1_index, t2_index):
+    content, offsets = flatten_jagged(event_dictionary[branch])
+    return take_from_jagged(content, offsets, t1_index), take_from_jagged(content, offsets, t2_index)
+
+  t1_pt,  t2_pt   = take_pair("Lepton_pt",   l1_idx, l2_idx)
+  t1_eta, t2_eta  = take_pair("Lepton_eta",  l1_idx, l2_idx)
+  t1_phi, t2_phi  = take_pair("Lepton_phi",  l1_idx, l2_idx)
+  t1_mass, t2_mass = take_pair("Lepton_mass", l1_idx, l2_idx)
+  t1_dxy, t2_dxy  = take_pair("Tau_dxy",        t1_br_idx, t2_br_idx)
+  t1_dz,  t2_dz   = take_pair("Tau_dz",         t1_br_idx, t2_br_idx)
+  t1_chg, t2_chg  = take_pair("Tau_charge",     t1_br_idx, t2_br_idx)
+  t1_decayMode, t2_decayMode = take_pair("Tau_decayMode", t1_br_idx, t2_br_idx)
+  t1_PNetvJet, t2_PNetvJet = take_pair("Tau_rawPNetVSjet", t1_br_idx, t2_br_idx)
+  t1_PNetvMu,  t2_PNetvMu  = take_pair("Tau_rawPNetVSmu",  t1_br_idx, t2_br_idx)
+  t1_PNetvEle, t2_PNetvEle = take_pair("Tau_rawPNetVSe",   t1_br_idx, t2_br_idx)
+  vJet_branch, vMu_branch, vEle_branch = add_DeepTau_branches([], DeepTau_version)
+  t1_vJet, t2_vJet = take_pair(vJet_branch, t1_br_idx, t2_br_idx)
+  t1_vMu,  t2_vMu  = take_pair(vMu_branch,  t1_br_idx, t2_br_idx)
+  t1_vEle, t2_vEle = take_pair(vEle_branch, t1_br_idx, t2_br_idx)
+  MET_pt, MET_phi = event_dictionary["PuppiMET_pt"], event_dictionary["PuppiMET_phi"]
+
+  # jets, dummy values where there is no jet to check kinem function
+  nJet = event_dictionary["nCleanJet"]
+  jet_pt,  jet_offsets = flatten_jagged(event_dictionary["CleanJet_pt"])
+  jet_eta, _           = flatten_jagged(event_dictionary["CleanJet_eta"])
+  j1_pt, j2_pt   = np.full(nEvents_precut, -999.), np.full(nEvents_precut, -999.)
+  j1_eta, j2_eta = np.full(nEvents_precut, -999.), np.full(nEvents_precut, -999.)
+  one_jet = (nJet == 1)
+  j1_pt[one_jet] = jet_pt[jet_offsets[:-1][one_jet]] # j1_eta is left at -999 for one jet, like the loop
+  j1_jet_idx, j2_jet_idx, mjj, _, _ = highest_mjj_pair_vectorized(event_dictionary["CleanJet_pt"], event_dictionary["CleanJet_eta"],
+                                                                  event_dictionary["CleanJet_phi"], event_dictionary["CleanJet_mass"])
+  two_jets = (nJet >= 2)
+  j1_pt[two_jets]  = jet_pt[jet_offsets[:-1][two_jets] + j1_jet_idx[two_jets]]
+  j2_pt[two_jets]  = jet_pt[jet_offsets[:-1][two_jets] + j2_jet_idx[two_jets]]
+  j1_eta[two_jets] = jet_eta[jet_offsets[:-1][two_jets] + j1_jet_idx[two_jets]]
+  j2_eta[two_jets] = jet_eta[jet_offsets[:-1][two_jets] + j2_jet_idx[two_jets]]
+
+  j1_pass = (j1_pt > 50.) | ((j1_pt > 30) & (np.abs(j1_eta) < 2.5))
+  j2_pass = (j2_pt > 50.) | ((j2_pt > 30) & (np.abs(j2_eta) < 2.5))
+  passEventJetKinems = np.where(nJet == 0, True, np.where(nJet == 1, j1_pass, j1_pass & j2_pass))
+  kinem_values = { "t1_pt" : t1_pt, "t2_pt" : t2_pt, "t1_eta" : t1_eta, "t2_eta" : t2_eta,
+                   "j1_pt" : j1_pt, "j2_pt" : j2_pt, "mjj" : mjj }
+  # FS_trig_idx = 0 DiTau, 1 DiTau+Jet, 2 VBFRun3, 3 VBFSingleTau, -1 if none pass
+  _, trig_idx = pass_kinems_by_trigger_table(era, "ditau", event_dictionary, kinem_values, passEventJetKinems)
+  passKinems = (trig_idx >= 0)
+
+  # Medium v Jet, VLoose v Muon, VVVLoose v Ele
+  t1passDT = (t1_vMu >= 1) & (t1_vEle >= 2)
+  t2passDT = (t2_vMu >= 1) & (t2_vEle >= 2)
+  single_DM_encoder = np.full(12, -1)
+  single_DM_encoder[[0, 1, 10, 11]] = [0, 1, 2, 3]
+  encoded_t1_decayMode = single_DM_encoder[t1_decayMode.astype(int)]
+  encoded_t2_decayMode = single_DM_encoder[t2_decayMode.astype(int)]
+  encoded_pair_decayMode = encoded_t1_decayMode + 4*encoded_t2_decayMode # same as the 16 entry encoder in the loop
+
+  cut_map = { "Low" : [25, 50],  "Mid" : [50, 70],  "High" : [70, 10000]  }
+  subtau_req = np.ones(nEvents_precut, dtype=bool)
+  if (tau_pt_cut == "None"): pass # do nothing
+  else: subtau_req = (cut_map[tau_pt_cut][0] <= t2_pt) & (t2_pt <= cut_map[tau_pt_cut][1])
+
+  pass_cuts = np.flatnonzero(passKinems & t1passDT & t2passDT & subtau_req)
+  def passing(values): return values[pass_cuts]
+  t1_pt, t1_eta, t1_phi, t2_pt, t2_eta, t2_phi = map(passing, [t1_pt, t1_eta, t1_phi, t2_pt, t2_eta, t2_phi])
+  MET_pt, MET_phi = passing(MET_pt), passing(MET_phi)
+
+  # derived variables
+  mt_t1t2   = calculate_mt(t1_pt, t1_phi, t2_pt, t2_phi)
+  mt_t1_MET = calculate_mt(t1_pt, t1_phi, MET_pt, MET_phi)
+  mt_t2_MET = calculate_mt(t2_pt, t2_phi, MET_pt, MET_phi)
+  mt_TOT    = np.sqrt(mt_t1t2 + mt_t1_MET + mt_t2_MET)
+
+  try: # catch versioning differnece between numpy 1 and 2
+    dphi_t1t2  = np.acos(np.cos(t1_phi - t2_phi))
+    dphi_t1MET = np.acos(np.cos(t1_phi - MET_phi))
+    dphi_t2MET = np.acos(np.cos(t2_phi - MET_phi))
+  except AttributeError:
+    dphi_t1t2  = np.arccos(np.cos(t1_phi - t2_phi))
+    dphi_t1MET = np.arccos(np.cos(t1_phi - MET_phi))
+    dphi_t2MET = np.arccos(np.cos(t2_phi - MET_phi))
+
+  event_dictionary["pass_cuts"] = pass_cuts
+  event_dictionary["FS_t1_pt"]  = t1_pt
+  event_dictionary["FS_t1_eta"] = t1_eta
+  event_dictionary["FS_t1_phi"] = t1_phi
+  event_dictionary["FS_t1_dxy"] = np.abs(passing(t1_dxy))
+  event_dictionary["FS_t1_dz"]  = np.abs(passing(t1_dz))
+  event_dictionary["FS_t1_chg"] = passing(t1_chg)
+  event_dictionary["FS_t1_DM"]  = passing(encoded_t1_decayMode)
+  event_dictionary["FS_t1_mass"] = passing(t1_mass)
+  event_dictionary["FS_t1_rawPNetVSjet"] = passing(t1_PNetvJet)
+  event_dictionary["FS_t1_rawPNetVSmu"]  = passing(t1_PNetvMu)
+  event_dictionary["FS_t1_rawPNetVSe"]   = passing(t1_PNetvEle)
+  event_dictionary["FS_t1_DeepTauVSjet"] = passing(t1_vJet)
+  event_dictionary["FS_t1_DeepTauVSmu"]  = passing(t1_vMu)
+  event_dictionary["FS_t1_DeepTauVSe"]   = passing(t1_vEle)
+  event_dictionary["FS_t2_pt"]  = t2_pt
+  event_dictionary["FS_tau_pt"] = np.copy(t2_pt) # copy for fitting purposes
+  event_dictionary["FS_t2_eta"] = t2_eta
+  event_dictionary["FS_t2_phi"] = t2_phi
+  event_dictionary["FS_t2_dxy"] = np.abs(passing(t2_dxy))
+  event_dictionary["FS_t2_dz"]  = np.abs(passing(t2_dz))
+  event_dictionary["FS_t2_chg"] = passing(t2_chg)
+  event_dictionary["FS_t2_DM"]  = passing(encoded_t2_decayMode)
+  event_dictionary["FS_t2_mass"] = passing(t2_mass)
+  event_dictionary["FS_t2_rawPNetVSjet"] = passing(t2_PNetvJet)
+  event_dictionary["FS_t2_rawPNetVSmu"]  = passing(t2_PNetvMu)
+  event_dictionary["FS_t2_rawPNetVSe"]   = passing(t2_PNetvEle)
+  event_dictionary["FS_t2_DeepTauVSjet"] = passing(t2_vJet)
+  event_dictionary["FS_t2_DeepTauVSmu"]  = passing(t2_vMu)
+  event_dictionary["FS_t2_DeepTauVSe"]   = passing(t2_vEle)
+  event_dictionary["FS_trig_idx"]        = passing(trig_idx)
+  event_dictionary["FS_mt_t1t2"]         = mt_t1t2
+  event_dictionary["FS_mt_t1_MET"]       = mt_t1_MET
+  event_dictionary["FS_mt_t2_MET"]       = mt_t2_MET
+  event_dictionary["FS_mt_TOT"]          = mt_TOT
+  event_dictionary["FS_dphi_t1t2"]       = dphi_t1t2
+  add_derived_branch(event_dictionary, "FS_deta_t1t2", lambda eta1, eta2: np.abs(eta1 - eta2), "FS_t1_eta", "FS_t2_eta")
+  add_derived_branch(event_dictionary, "FS_dpt_t1t2",  np.subtract, "FS_t1_pt", "FS_t2_pt")
+  event_dictionary["FS_dphi_t1MET"]      = dphi_t1MET
+  event_dictionary["FS_dphi_t2MET"]      = dphi_t2MET
+  event_dictionary["FS_pair_DM"]         = passing(encoded_pair_decayMode)
+
+  nEvents_postcut = len(pass_cuts)
+  print(f"nEvents before and after ditau cuts = {nEvents_precut}, {nEvents_postcut}")
+  return event_dictionary
+
+
+def make_ditau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau=True, tau_pt_cut="None"):
   '''
   Use a minimal set of branches to define selection criteria and identify events which pass.
   A separate function uses the generated branch "pass_cuts" to remove the info from the
@@ -1,13 +1,86 @@
 import numpy as np
 
-from ROOT import TLorentzVector
-
 from calculate_functions import calculate_mt_emu 
+from calculate_functions import flatten_jagged, gather_from_jagged, count_in_jagged
 from branch_functions import add_trigger_branches
 
-def make_emu_cut(era, event_dictionary):
+def make_emu_cut(era, event_dictionary, use_loop=False):
+  '''
+  Works similarly to 'make_ditau_cut', the vectorized version is used unless 'use_loop' is True.
+  '''
+  if use_loop:
+    return make_emu_cut_loop(era, event_dictionary)
+  return make_emu_cut_vectorized(era, event_dictionary)
+
+
+def make_emu_cut_vectorized(era, event_dictionary):
+  '''
+  Array version of 'make_emu_cut_loop' producing the same branches, see 'make_ditau_cut_vectorized'.
+  Which of l1 and l2 is the electron is resolved with np.where over "Lepton_elIdx" and "Lepton_muIdx",
+  and b jets are counted with a segmented sum over "CleanJet_btagWP".
+  Events where neither lepton assignment works fail the selection.
+  '''
+  nEvents_precut = len(event_dictionary["Lepton_pt"])
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+
+  def take(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index)
+  el_idx_l1, el_idx_l2 = take("Lepton_elIdx", l1_idx), take("Lepton_elIdx", l2_idx)
+  mu_idx_l1, mu_idx_l2 = take("Lepton_muIdx", l1_idx), take("Lepton_muIdx", l2_idx)
+  el_is_l1 = (el_idx_l1 != -1) & (mu_idx_l2 != -1)
+  el_is_l2 = ~el_is_l1 & (el_idx_l2 != -1) & (mu_idx_l1 != -1)
+  if np.any(~(el_is_l1 | el_is_l2)): print(f"{np.sum(~(el_is_l1 | el_is_l2))} events without an e and a mu, should not print :)")
+  elFSLoc, elBranchLoc = np.where(el_is_l1, l1_idx, l2_idx), np.where(el_is_l1, el_idx_l1, el_idx_l2)
+  muLoc,   muBranchLoc = np.where(el_is_l1, l2_idx, l1_idx), np.where(el_is_l1, mu_idx_l2, mu_idx_l1)
+
+  muPtVal, muEtaVal = take("Lepton_pt", muLoc), take("Lepton_eta", muLoc)
+  elPtVal, elEtaVal = take("Lepton_pt", elFSLoc), take("Lepton_eta", elFSLoc)
+
+  crosstrg_1, crosstrg_2 = [event_dictionary[trigger].astype(bool)
+                            for trigger in add_trigger_branches([], era, final_state_mode="emu")]
+  #HLT_Mu23_TrkIsoVVL_Ele12_CaloIdL_TrackIdL_IsoVL_DZ
+  passCrossTrigger_1 = (crosstrg_1 & (muPtVal > 23.0) & (np.abs(muEtaVal) < 2.4)
+                                   & (elPtVal > 12.0) & (np.abs(elEtaVal) < 2.5))
+  #HLT_Mu8_TrkIsoVVL_Ele23_CaloIdL_TrackIdL_IsoVL_DZ
+  passCrossTrigger_2 = (crosstrg_2 & (muPtVal > 8.0) & (np.abs(muEtaVal) < 2.4)
+                                   & (elPtVal > 23.0) & (np.abs(elEtaVal) < 2.5))
+  dzeta = event_dictionary["HTT_DZeta"]
+  passDZeta = (dzeta > -30)
+
+  btag, btag_offsets = flatten_jagged(event_dictionary["CleanJet_btagWP"])
+  nbJet = count_in_jagged(btag > 0, btag_offsets)
+
+  pass_cuts = np.flatnonzero((passCrossTrigger_1 | passCrossTrigger_2) & passDZeta & (el_is_l1 | el_is_l2))
+  elFSLoc, elBranchLoc, muLoc, muBranchLoc = elFSLoc[pass_cuts], elBranchLoc[pass_cuts], muLoc[pass_cuts], muBranchLoc[pass_cuts]
+  def take_passing(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index, pass_cuts)
+
+  event_dictionary["pass_cuts"]      = pass_cuts
+  event_dictionary["FS_el_pt"]       = elPtVal[pass_cuts]
+  event_dictionary["FS_el_eta"]      = elEtaVal[pass_cuts]
+  event_dictionary["FS_el_phi"]      = take_passing("Lepton_phi", elFSLoc)
+  event_dictionary["FS_el_iso"]      = take_passing("Lepton_iso", elFSLoc)
+  event_dictionary["FS_el_dxy"]      = np.abs(take_passing("Electron_dxy", elBranchLoc))
+  event_dictionary["FS_el_dz"]       = np.abs(take_passing("Electron_dz", elBranchLoc))
+  event_dictionary["FS_el_chg"]      = take_passing("Electron_charge", elBranchLoc)
+  event_dictionary["FS_mu_pt"]       = muPtVal[pass_cuts]
+  event_dictionary["FS_mu_eta"]      = muEtaVal[pass_cuts]
+  event_dictionary["FS_mu_phi"]      = take_passing("Lepton_phi", muLoc)
+  event_dictionary["FS_mu_iso"]      = take_passing("Lepton_iso", muLoc)
+  event_dictionary["FS_mu_dxy"]      = np.abs(take_passing("Muon_dxy", muBranchLoc))
+  event_dictionary["FS_mu_dz"]       = np.abs(take_passing("Muon_dz", muBranchLoc))
+  event_dictionary["FS_mu_chg"]      = take_passing("Muon_charge", muBranchLoc)
+  event_dictionary["FS_nbJet"]       = nbJet[pass_cuts]
+  event_dictionary["FS_DZeta"]       = dzeta[pass_cuts]
+
+  nEvents_postcut = len(pass_cuts)
+  print(f"nEvents before and after emu cuts = {nEvents_precut}, {nEvents_postcut}")
+  return event_dictionary
+
+
+def make_emu_cut_loop(era, event_dictionary):
   '''
-  Works similarly to 'make_ditau_cut'.
+  Works similarly to 'make_ditau_cut_loop'.
   Notably, the mutau cuts are more complicated, but it is simple to 
   extend the existing methods as long as one can stomach the line breaks.
   '''
@@ -21,7 +94,7 @@ def make_emu_cut(era, event_dictionary):
                 "CleanJet_btagWP", 
                  ]
   
-  unpack_emu = add_trigger_branches(unpack_emu, final_state_mode="emu")
+  unpack_emu = add_trigger_branches(unpack_emu, era, final_state_mode="emu")
   unpack_emu = (event_dictionary.get(key) for key in unpack_emu)
   to_check = [range(len(event_dictionary["Lepton_pt"])), *unpack_emu] # "*" unpacks a tuple
   
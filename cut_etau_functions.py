@@ -1,11 +1,121 @@
 import numpy as np
 
 from calculate_functions import calculate_mt, calculate_acoplan, return_TLorentz_Jets
+from calculate_functions import flatten_jagged, gather_from_jagged, count_in_jagged, highest_mjj_pair_vectorized
 from branch_functions import add_trigger_branches, add_DeepTau_branches
+from triggers_dictionary import pass_kinems_by_trigger_table
+from event_table import add_derived_branch
 
-def make_etau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+def make_etau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None", use_loop=False):
   '''
-  Works similarly to 'make_ditau_cut'. 
+  Works similarly to 'make_ditau_cut', the vectorized version is used unless 'use_loop' is True.
+  '''
+  if use_loop:
+    return make_etau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+  return make_etau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+
+
+def make_etau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+  '''
+  Array version of 'make_etau_cut_loop' producing the same branches, see 'make_ditau_cut_vectorized'.
+  '''
+  nEvents_precut = len(event_dictionary["Lepton_pt"])
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+
+  # in ETau, electron is always lepton 1 in FS branches, tau is always lepton 2
+  def take(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index)
+  elBranchLoc  = take("Lepton_elIdx", l1_idx)
+  tauBranchLoc = take("Lepton_tauIdx", l2_idx)
+
+  elPt, elEta, elPhi, elIso = take("Lepton_pt", l1_idx), take("Lepton_eta", l1_idx), take("Lepton_phi", l1_idx), take("Lepton_iso", l1_idx)
+  tauPt, tauEta, tauPhi = take("Lepton_pt", l2_idx), take("Lepton_eta", l2_idx), take("Lepton_phi", l2_idx)
+  MET_pt, MET_phi = event_dictionary["PuppiMET_pt"], event_dictionary["PuppiMET_phi"]
+
+  # assign jet pts, dummy values where there is no jet to check kinem function
+  nJet = event_dictionary["nCleanJet"]
+  jet_pt, jet_offsets = flatten_jagged(event_dictionary["CleanJet_pt"])
+  j1_pt, j2_pt = np.full(nEvents_precut, -999.), np.full(nEvents_precut, -999.)
+  one_jet, two_jets = (nJet == 1), (nJet >= 2)
+  j1_pt[one_jet] = jet_pt[jet_offsets[:-1][one_jet]]
+  j1_jet_idx, j2_jet_idx, mjj, _, _ = highest_mjj_pair_vectorized(event_dictionary["CleanJet_pt"], event_dictionary["CleanJet_eta"],
+                                                                  event_dictionary["CleanJet_phi"], event_dictionary["CleanJet_mass"])
+  j1_pt[two_jets] = jet_pt[jet_offsets[:-1][two_jets] + j1_jet_idx[two_jets]]
+  j2_pt[two_jets] = jet_pt[jet_offsets[:-1][two_jets] + j2_jet_idx[two_jets]]
+  jet_reqs = np.where(nJet == 0, True, np.where(nJet == 1, (j1_pt > 30.), (j1_pt > 30.) & (j2_pt > 30.)))
+
+  kinem_values = { "el_pt" : elPt, "el_eta" : elEta, "tau_pt" : tauPt, "tau_eta" : tauEta,
+                   "j1_pt" : j1_pt, "j2_pt" : j2_pt, "mjj" : mjj }
+  # FS_trig_idx = 0 Ele, 1 ETau, 2 VBFSingleTau, 3 VBFSingleEle, -1 if none pass
+  _, trig_idx = pass_kinems_by_trigger_table(era, "etau", event_dictionary, kinem_values, jet_reqs)
+  passKinems = (trig_idx >= 0)
+
+  # Medium (5) v Jet, VLoose (1) v Muon, Tight (6) v Ele
+  _, vMu_branch, vEle_branch = add_DeepTau_branches([], DeepTau_version)
+  passTauDTLep = (take(vMu_branch, tauBranchLoc) >= 1) & (take(vEle_branch, tauBranchLoc) >= 6)
+
+  cut_map = { "Low" : [25, 50],  "Mid" : [50, 70],  "High" : [70, 10000]  }
+  subtau_req = np.ones(nEvents_precut, dtype=bool)
+  if (tau_pt_cut == "None"): pass # do nothing
+  else:
+    subtau_req = (cut_map[tau_pt_cut][0] <= tauPt) & (tauPt <= cut_map[tau_pt_cut][1])
+
+  pass_cuts = np.flatnonzero(passKinems & passTauDTLep & subtau_req & jet_reqs)
+  def passing(values): return values[pass_cuts]
+  elBranchLoc, tauBranchLoc, l2_idx = passing(elBranchLoc), passing(tauBranchLoc), passing(l2_idx)
+  elPt, elEta, elPhi, elIso = map(passing, [elPt, elEta, elPhi, elIso])
+  tauPt, tauEta, tauPhi = map(passing, [tauPt, tauEta, tauPhi])
+  MET_pt, MET_phi = passing(MET_pt), passing(MET_phi)
+  def take_passing(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index, pass_cuts)
+
+  single_DM_encoder = np.full(12, -1)
+  single_DM_encoder[[0, 1, 10, 11]] = [0, 1, 2, 3]
+  encoded_tau_decayMode = single_DM_encoder[take_passing("Tau_decayMode", tauBranchLoc).astype(int)]
+
+  btag, btag_offsets = flatten_jagged(event_dictionary["CleanJet_btagWP"])
+  nbJet = passing(count_in_jagged(btag > 1, btag_offsets))
+
+  try:
+    dphi_etau = np.acos(np.cos(elPhi - tauPhi))
+  except AttributeError:
+    dphi_etau = np.arccos(np.cos(elPhi - tauPhi))
+
+  event_dictionary["pass_cuts"]    = pass_cuts
+  event_dictionary["FS_el_pt"]     = elPt
+  event_dictionary["FS_el_eta"]    = elEta
+  event_dictionary["FS_el_phi"]    = elPhi
+  event_dictionary["FS_el_iso"]    = elIso
+  event_dictionary["FS_el_dxy"]    = np.abs(take_passing("Electron_dxy", elBranchLoc))
+  event_dictionary["FS_el_dz"]     = np.abs(take_passing("Electron_dz", elBranchLoc))
+  event_dictionary["FS_el_chg"]    = take_passing("Electron_charge", elBranchLoc)
+  event_dictionary["FS_el_mass"]   = take_passing("Electron_mass", elBranchLoc)
+  event_dictionary["FS_tau_pt"]    = tauPt
+  event_dictionary["FS_tau_eta"]   = tauEta
+  event_dictionary["FS_tau_phi"]   = tauPhi
+  event_dictionary["FS_tau_dxy"]   = np.abs(take_passing("Tau_dxy", tauBranchLoc))
+  event_dictionary["FS_tau_dz"]    = np.abs(take_passing("Tau_dz", tauBranchLoc))
+  event_dictionary["FS_tau_chg"]   = take_passing("Tau_charge", tauBranchLoc)
+  event_dictionary["FS_tau_mass"]  = take_passing("Lepton_mass", l2_idx)
+  event_dictionary["FS_tau_DM"]    = encoded_tau_decayMode
+  event_dictionary["FS_trig_idx"]  = passing(trig_idx)
+  event_dictionary["FS_mt"]        = calculate_mt(elPt, elPhi, MET_pt, MET_phi)
+  event_dictionary["FS_nbJet"]     = nbJet
+  event_dictionary["FS_acoplan"]   = calculate_acoplan(elPhi, tauPhi)
+  event_dictionary["FS_dphi_etau"] = dphi_etau
+  add_derived_branch(event_dictionary, "FS_deta_etau", lambda eta1, eta2: np.abs(eta1 - eta2), "FS_el_eta", "FS_tau_eta")
+  add_derived_branch(event_dictionary, "FS_dpt_etau",  np.subtract, "FS_el_pt", "FS_tau_pt")
+  event_dictionary["FS_tau_rawPNetVSjet"] = take_passing("Tau_rawPNetVSjet", tauBranchLoc)
+  event_dictionary["FS_tau_rawPNetVSmu"]  = take_passing("Tau_rawPNetVSmu", tauBranchLoc)
+  event_dictionary["FS_tau_rawPNetVSe"]   = take_passing("Tau_rawPNetVSe", tauBranchLoc)
+  nEvents_postcut = len(pass_cuts)
+  print(f"nEvents before and after etau cuts = {nEvents_precut}, {nEvents_postcut}")
+  return event_dictionary
+
+
+def make_etau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+  '''
+  Works similarly to 'make_ditau_cut_loop'. 
   '''
   nEvents_precut = len(event_dictionary["Lepton_pt"])
   unpack_etau = ["Lepton_pt", "Lepton_eta", "Lepton_phi", "Lepton_iso",
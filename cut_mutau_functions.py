@@ -1,11 +1,116 @@
 import numpy as np
 
 from calculate_functions import calculate_mt, calculate_acoplan, return_TLorentz_Jets
+from calculate_functions import flatten_jagged, gather_from_jagged, count_in_jagged, highest_mjj_pair_vectorized
 from branch_functions import add_trigger_branches, add_DeepTau_branches
+from triggers_dictionary import pass_kinems_by_trigger_table
+from event_table import add_derived_branch
 
-def make_mutau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+def make_mutau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None", use_loop=False):
   '''
-  Works similarly to 'make_ditau_cut'. 
+  Works similarly to 'make_ditau_cut', the vectorized version is used unless 'use_loop' is True.
+  '''
+  if use_loop:
+    return make_mutau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+  return make_mutau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
+
+
+def make_mutau_cut_vectorized(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+  '''
+  Array version of 'make_mutau_cut_loop' producing the same branches, see 'make_ditau_cut_vectorized'.
+  As in the loop, every event currently passes, the selection is left to the region cuts.
+  '''
+  nEvents_precut = len(event_dictionary["Lepton_pt"])
+  l1_idx, l2_idx = event_dictionary["l1_indices"], event_dictionary["l2_indices"]
+
+  # in MuTau, muon is always lepton 1 in FS branches, tau is always lepton 2
+  def take(branch, index):
+    return gather_from_jagged(event_dictionary[branch], index)
+  muBranchLoc  = take("Lepton_muIdx", l1_idx)
+  tauBranchLoc = take("Lepton_tauIdx", l2_idx)
+
+  muPt, muEta, muPhi, muIso = take("Lepton_pt", l1_idx), take("Lepton_eta", l1_idx), take("Lepton_phi", l1_idx), take("Lepton_iso", l1_idx)
+  muDxy, muDz = np.abs(take("Muon_dxy", muBranchLoc)), np.abs(take("Muon_dz", muBranchLoc))
+  muChg, muMass = take("Muon_charge", muBranchLoc), take("Muon_mass", muBranchLoc)
+
+  tauPt, tauEta, tauPhi = take("Lepton_pt", l2_idx), take("Lepton_eta", l2_idx), take("Lepton_phi", l2_idx)
+  tauDxy, tauDz = np.abs(take("Tau_dxy", tauBranchLoc)), np.abs(take("Tau_dz", tauBranchLoc))
+  tauChg, tauMass = take("Tau_charge", tauBranchLoc), take("Lepton_mass", l2_idx)
+
+  MET_pt, MET_phi, mt_branch = event_dictionary["PuppiMET_pt"], event_dictionary["PuppiMET_phi"], event_dictionary["HTT_mT_lmet"]
+  mt      = calculate_mt(muPt, muPhi, MET_pt, MET_phi)
+  mt_diff = mt - mt_branch
+  acoplan = calculate_acoplan(muPhi, tauPhi)
+
+  try:
+    dphi_mutau = np.acos(np.cos(muPhi - tauPhi))
+  except AttributeError:
+    dphi_mutau = np.arccos(np.cos(muPhi - tauPhi))
+
+  # assign jet pts, dummy values where there is no jet to check kinem function
+  nJet = event_dictionary["nCleanJet"]
+  jet_pt, jet_offsets = flatten_jagged(event_dictionary["CleanJet_pt"])
+  j1_pt, j2_pt = np.full(nEvents_precut, -999.), np.full(nEvents_precut, -999.)
+  one_jet, two_jets = (nJet == 1), (nJet >= 2)
+  j1_pt[one_jet] = jet_pt[jet_offsets[:-1][one_jet]]
+  j1_jet_idx, j2_jet_idx, mjj, _, _ = highest_mjj_pair_vectorized(event_dictionary["CleanJet_pt"], event_dictionary["CleanJet_eta"],
+                                                                  event_dictionary["CleanJet_phi"], event_dictionary["CleanJet_mass"])
+  j1_pt[two_jets] = jet_pt[jet_offsets[:-1][two_jets] + j1_jet_idx[two_jets]]
+  j2_pt[two_jets] = jet_pt[jet_offsets[:-1][two_jets] + j2_jet_idx[two_jets]]
+  jet_reqs = np.where(nJet == 0, True, np.where(nJet == 1, (j1_pt > 30.), (j1_pt > 30.) & (j2_pt > 30.)))
+
+  kinem_values = { "mu_pt" : muPt, "mu_eta" : muEta, "tau_pt" : tauPt, "tau_eta" : tauEta,
+                   "j1_pt" : j1_pt, "j2_pt" : j2_pt, "mjj" : mjj }
+  # FS_trig_idx = 0 Muon, 1 MuTau, 2 VBFSingleTau, 3 VBFSingleMu, -1 if none pass
+  _, trig_idx = pass_kinems_by_trigger_table(era, "mutau", event_dictionary, kinem_values, jet_reqs)
+  passKinems = (trig_idx >= 0)
+
+  single_DM_encoder = np.full(12, -1)
+  single_DM_encoder[[0, 1, 10, 11]] = [0, 1, 2, 3]
+  encoded_tau_decayMode = single_DM_encoder[take("Tau_decayMode", tauBranchLoc).astype(int)]
+
+  btag, btag_offsets = flatten_jagged(event_dictionary["CleanJet_btagWP"])
+  nbJet = count_in_jagged(btag > 1, btag_offsets)
+
+  pass_cuts = np.arange(nEvents_precut) # all events pass, see make_mutau_cut_loop
+  event_dictionary["pass_cuts"]     = pass_cuts
+  event_dictionary["FS_mu_pt"]      = muPt
+  event_dictionary["FS_mu_eta"]     = muEta
+  event_dictionary["FS_mu_phi"]     = muPhi
+  event_dictionary["FS_mu_iso"]     = muIso
+  event_dictionary["FS_mu_dxy"]     = muDxy
+  event_dictionary["FS_mu_dz"]      = muDz
+  event_dictionary["FS_mu_chg"]     = muChg
+  event_dictionary["FS_mu_mass"]    = muMass
+  event_dictionary["FS_tau_pt"]     = tauPt
+  event_dictionary["FS_tau_eta"]    = tauEta
+  event_dictionary["FS_tau_phi"]    = tauPhi
+  event_dictionary["FS_tau_dxy"]    = tauDxy
+  event_dictionary["FS_tau_dz"]     = tauDz
+  event_dictionary["FS_tau_chg"]    = tauChg
+  event_dictionary["FS_tau_mass"]   = tauMass
+  event_dictionary["FS_tau_DM"]     = encoded_tau_decayMode
+  event_dictionary["FS_trig_idx"]   = trig_idx
+  event_dictionary["FS_mt"]         = mt
+  event_dictionary["FS_mt_branch"]  = np.copy(mt_branch)
+  event_dictionary["FS_mt_diff"]    = mt_diff
+  event_dictionary["FS_nbJet"]      = nbJet
+  event_dictionary["FS_acoplan"]    = acoplan
+  event_dictionary["FS_dphi_mutau"] = dphi_mutau
+  add_derived_branch(event_dictionary, "FS_deta_mutau", lambda eta1, eta2: np.abs(eta1 - eta2), "FS_mu_eta", "FS_tau_eta")
+  add_derived_branch(event_dictionary, "FS_dpt_mutau",  np.subtract, "FS_mu_pt", "FS_tau_pt")
+  event_dictionary["FS_LeadTkPtOverTau"]  = take("Tau_leadTkPtOverTauPt", tauBranchLoc)
+  event_dictionary["FS_tau_rawPNetVSjet"] = take("Tau_rawPNetVSjet", tauBranchLoc)
+  event_dictionary["FS_tau_rawPNetVSmu"]  = take("Tau_rawPNetVSmu", tauBranchLoc)
+  event_dictionary["FS_tau_rawPNetVSe"]   = take("Tau_rawPNetVSe", tauBranchLoc)
+  nEvents_postcut = len(pass_cuts)
+  print(f"nEvents before and after mutau cuts = {nEvents_precut}, {nEvents_postcut}")
+  return event_dictionary
+
+
+def make_mutau_cut_loop(era, event_dictionary, DeepTau_version, skip_DeepTau=False, tau_pt_cut="None"):
+  '''
+  Works similarly to 'make_ditau_cut_loop'. 
   Notably, the mutau cuts are more complicated, but it is simple to 
   extend the existing methods as long as one can stomach the line breaks.
   '''
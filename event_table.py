@@ -0,0 +1,264 @@
+import numpy as np
+
+### README
+# this file contains the EventTable, the container holding the events of a process
+# from loading (load_process_from_file) through the cuts (apply_cut) to append_to_combined_processes.
+# It is used like the dictionary of branches returned by uproot with library="np", i.e.
+# event_dictionary["branch"] gives the values of the branch for all events passing the cuts so far.
+# Jagged branches can be held as a JaggedBranch (flat content + offsets) instead of an object array,
+# see 'load_process_from_file' with 'compact_jagged'.
+
+class JaggedBranch:
+  '''
+  Compact form of a jagged branch, which library="np" loads as an object array holding one small array
+  per event. The values of all events are stored in one contiguous array 'content', and the values
+  of event i are content[offsets[i]:offsets[i+1]].
+  It can be used like the object array for per-event access: len(), iterating, and branch[i] give
+  the values of each event (as views of 'content'), while indexing with a slice, indices, or a boolean mask
+  gives a new JaggedBranch of those events. Reading a contiguous range of events doesn't copy 'content'.
+  Use 'flatten_jagged' and 'gather_from_jagged' (calculate_functions.py) for array operations,
+  e.g. gather_from_jagged(event_dictionary["Lepton_pt"], l1_idx) instead of lep_pt[l1_idx] per event.
+  '''
+  def __init__(self, content, offsets):
+    self.content = content
+    self.offsets = offsets
+
+  @property
+  def counts(self):
+    return np.diff(self.offsets)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __iter__(self):
+    content, offsets = self.content, self.offsets
+    for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+      yield content[start:stop]
+
+  def __getitem__(self, events):
+    if isinstance(events, (int, np.integer)):
+      if events < 0: events += len(self)
+      return self.content[self.offsets[events]:self.offsets[events+1]]
+    if isinstance(events, slice):
+      start, stop, step = events.indices(len(self))
+      if step == 1:
+        stop = max(start, stop)
+        offsets = self.offsets[start:stop+1]
+        return JaggedBranch(self.content[offsets[0]:offsets[-1]], offsets - offsets[0])
+      events = np.arange(start, stop, step)
+    events = np.asarray(events)
+    if events.dtype == bool: events = np.flatnonzero(events)
+    starts, stops = self.offsets[:-1][events], self.offsets[1:][events]
+    offsets = np.zeros(len(events)+1, dtype=self.offsets.dtype)
+    np.cumsum(stops - starts, out=offsets[1:])
+    # position in 'content' of every kept value: start of its event + position within the event
+    content_index = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], stops - starts)
+    return JaggedBranch(self.content[content_index], offsets)
+
+  def to_object_array(self):
+    '''
+    Return the branch as loaded with library="np", an object array with one array per event.
+    '''
+    object_array = np.empty(len(self), dtype=object)
+    for event, values in enumerate(self): object_array[event] = values
+    return object_array
+
+  @staticmethod
+  def concatenate(jagged_branches):
+    '''
+    Join the events of several JaggedBranches, like np.concatenate for flat branches.
+    '''
+    offsets = [np.zeros(1, dtype=np.int64)]
+    for jagged_branch in jagged_branches:
+      offsets.append(jagged_branch.offsets[1:] - jagged_branch.offsets[0] + offsets[-1][-1])
+    return JaggedBranch(np.concatenate([jagged_branch.content[jagged_branch.offsets[0]:jagged_branch.offsets[-1]]
+                                        for jagged_branch in jagged_branches]),
+                        np.concatenate(offsets))
+
+
+def is_index_branch(branch):
+  '''
+  Index branches ("pass_cuts", "pass_gen_cuts", "pass_0j_cuts", ...) hold the indices of the events passing a cut,
+  not one entry per event, so they are never reduced by a selection.
+  '''
+  return branch.startswith("pass_") and branch.endswith("_cuts")
+
+
+class EventTable(dict):
+  '''
+  Dictionary of aligned branches with a shared number of events and a selection state.
+  Rejecting events ('select') only stores the passing indices, and the branches with one entry per event
+  are marked with the selection they belong to. A marked branch is reduced to the currently passing events
+  (with the indices of all later selections composed) the first time it is read, so branches that are never
+  read after a cut are never copied. Contiguous selections are stored as slices, and reading a branch through
+  them gives a numpy view of the loaded values instead of a copy.
+
+  Whether a branch has one entry per event is decided when it is written:
+    - index branches (see 'is_index_branch') are never reduced,
+    - a branch with one entry per current event is reduced by every later selection,
+    - any other branch is taken to be filled for the events passing the next selection (e.g. the "FS_" branches
+      of a final state cut). If its length matches the events after that selection it is reduced by the
+      selections after it, otherwise it is never reduced.
+  So branches added by a cut no longer need to be protected by hand.
+
+  'subset' makes a new table of some of the events which shares the loaded values, and 'register'
+  adds a branch computed from other branches when it is first read (see 'add_derived_branch').
+  Reading through get, items, values, pop, copying and pickling returns reduced branches as well.
+  '''
+  __slots__ = ("nEvents", "selections", "generations", "composed", "derived", "pending", "unaligned")
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.selections  = [] # passing events of each selection (slice or indices), relative to the events before it
+    self.generations = {} # branch : number of selections made when the branch was last reduced
+    self.composed    = {} # generation : passing events relative to that generation
+    self.derived     = {} # branch : (function, input branches)
+    self.pending     = set() # branches filled for the events passing the next selection
+    self.unaligned   = set() # branches that are never reduced
+    if "run" in self: self.nEvents = len(super().__getitem__("run"))
+    else:
+      lengths = [len(values) for values in super().values() if hasattr(values, "__len__")]
+      self.nEvents = max(set(lengths), key=lengths.count) if lengths else 0
+    for branch, values in super().items(): self.set_alignment(branch, values)
+
+  def set_alignment(self, branch, values):
+    if is_index_branch(branch) or not hasattr(values, "__len__"): self.unaligned.add(branch)
+    elif len(values) != self.nEvents: self.pending.add(branch)
+
+  def __len__(self):
+    return super().__len__() + len(self.derived)
+
+  def __contains__(self, branch):
+    return super().__contains__(branch) or (branch in self.derived)
+
+  def select(self, passing_indices):
+    '''
+    Keep only 'passing_indices' (sorted, unique) of the current events.
+    '''
+    if len(passing_indices) == self.nEvents: return # all events pass
+    passing_indices = np.asarray(passing_indices)
+    generation = len(self.selections)
+    for branch in super().__iter__():
+      if (branch not in self.generations) and (branch not in self.pending) and (branch not in self.unaligned):
+        self.generations[branch] = generation
+    self.composed = {}
+    self.nEvents  = len(passing_indices)
+    for branch in self.pending:
+      if len(super().__getitem__(branch)) != self.nEvents: self.unaligned.add(branch)
+    self.pending = set()
+    if (len(passing_indices) > 0) and (passing_indices[-1] - passing_indices[0] + 1) == len(passing_indices):
+      passing_indices = slice(int(passing_indices[0]), int(passing_indices[-1]) + 1)
+    self.selections.append(passing_indices)
+
+  def subset(self, passing_indices):
+    '''
+    Return a new EventTable of 'passing_indices' (sorted, unique) of the current events.
+    The loaded values are shared with this table, only the selection state is copied.
+    '''
+    new_table = EventTable()
+    dict.update(new_table, dict(super().items()))
+    new_table.nEvents     = self.nEvents
+    new_table.selections  = list(self.selections)
+    new_table.generations = dict(self.generations)
+    new_table.derived     = dict(self.derived)
+    new_table.pending     = set(self.pending)
+    new_table.unaligned   = set(self.unaligned)
+    new_table.select(passing_indices)
+    return new_table
+
+  def register(self, branch, function, *input_branches):
+    '''
+    Add 'branch' as function(*input_branches), computed from the reduced input branches
+    the first time it is read. Until then it takes no memory and isn't touched by selections.
+    '''
+    self.forget(branch)
+    super().pop(branch, None)
+    self.derived[branch] = (function, input_branches)
+
+  def composed_selection(self, generation):
+    if generation not in self.composed:
+      selection = self.selections[-1]
+      for earlier_selection in reversed(self.selections[generation:-1]):
+        if isinstance(earlier_selection, slice) and isinstance(selection, slice):
+          selection = slice(earlier_selection.start + selection.start, earlier_selection.start + selection.stop)
+        elif isinstance(earlier_selection, slice):
+          selection = selection + earlier_selection.start
+        else:
+          selection = earlier_selection[selection]
+      self.composed[generation] = selection
+    return self.composed[generation]
+
+  def __getitem__(self, branch):
+    if branch in self.derived:
+      function, input_branches = self.derived[branch]
+      values = function(*[self[input_branch] for input_branch in input_branches])
+      self[branch] = values
+      return values
+    values = super().__getitem__(branch)
+    generation = self.generations.pop(branch, None)
+    if generation == None: return values
+    selection = self.composed_selection(generation)
+    values = values[selection] if isinstance(values, (np.ndarray, JaggedBranch)) else np.take(values, selection)
+    super().__setitem__(branch, values)
+    return values
+
+  def forget(self, branch):
+    self.generations.pop(branch, None)
+    self.derived.pop(branch, None)
+    self.pending.discard(branch)
+    self.unaligned.discard(branch)
+
+  def __setitem__(self, branch, values):
+    self.forget(branch)
+    self.set_alignment(branch, values)
+    super().__setitem__(branch, values)
+
+  def __delitem__(self, branch):
+    in_derived = branch in self.derived
+    self.forget(branch)
+    if not in_derived: super().__delitem__(branch)
+
+  def __iter__(self):
+    # overriding __iter__ also makes dict(...) and {**...} read through __getitem__
+    yield from super().__iter__()
+    yield from list(self.derived)
+
+  def keys(self):
+    return list(self)
+
+  def get(self, branch, default=None):
+    return self[branch] if branch in self else default
+
+  def pop(self, branch, *default):
+    if branch not in self: return super().pop(branch, *default)
+    values = self[branch]
+    del self[branch]
+    return values
+
+  def items(self):
+    return [(branch, self[branch]) for branch in list(self)]
+
+  def values(self):
+    return [self[branch] for branch in list(self)]
+
+  def update(self, *args, **kwargs):
+    for branch, values in dict(*args, **kwargs).items():
+      self[branch] = values
+
+  def copy(self):
+    return EventTable(self.items())
+
+  def __reduce__(self):
+    return (EventTable, (dict(self.items()),))
+
+
+def add_derived_branch(event_dictionary, branch, function, *input_branches):
+  '''
+  Add 'branch' = function(*input_branches) to the events. An EventTable computes it lazily
+  on first read (see 'EventTable.register'), a plain dictionary right away.
+  '''
+  if isinstance(event_dictionary, EventTable):
+    event_dictionary.register(branch, function, *input_branches)
+  else:
+    event_dictionary[branch] = function(*[event_dictionary[input_branch] for input_branch in input_branches])
+  return event_dictionary
@@ -1,18 +1,25 @@
 import uproot
 import numpy as np
+from os import path, makedirs, listdir, rename
 
 from utility_functions import time_print, text_options, log_print
+from event_table import EventTable, JaggedBranch, is_index_branch
+from calculate_functions import flatten_jagged
 from MC_dictionary import MC_dictionary
 
 ### README ###
 # This file contains the main method to load data from root files
 # The wildcarding works for the 'concatenate' function of uproot, and might not in the future.
 # This file also contains methods relevant to sorting samples from files.
+# Loaded events can be cached on disk as one .npy file per branch, see 'set_cache_path'.
+# Events can be read in two phases, the cut first and the other branches only where needed, see 'read_with_pushdown'.
+# Jagged branches can be loaded as flat content + offsets instead of object arrays, see 'set_jagged_format'.
 
 
 def load_process_from_file(process, file_directory, file_map, log_file,
                            branches, good_events, final_state_mode, 
-                           data=False, testing=False, direct_input=None):
+                           data=False, testing=False, direct_input=None,
+                           cache_dir=None, cache_mode="bypass", pushdown=False, compact_jagged=False):
   '''
   This will make more sense if you read the documentation on uproot.concatenate first:
   https://uproot.readthedocs.io/en/latest/basic.html#reading-many-files-into-big-arrays
@@ -32,6 +39,14 @@ def load_process_from_file(process, file_directory, file_map, log_file,
   with other types of arrays (although the methods could be copied and rewritten). 
   Note: that a numpy array is generated for each loaded process, which corresponds
   to a set of files. 
+  The branches are returned in an EventTable (see event_table.py), which is used like this dictionary.
+  If 'cache_dir' is given and 'cache_mode' is "use", the output is cached there and reused
+  (memory-mapped) on the next run with the same files, branches, and 'good_events'.
+  "refresh" reloads with uproot and overwrites the cache, "bypass" ignores it.
+  If 'pushdown' is True, events are loaded with 'read_with_pushdown' instead of uproot.concatenate,
+  which gives the same output but skips baskets without any event passing 'good_events'.
+  If 'compact_jagged' is True, jagged branches are returned as JaggedBranches (one contiguous array
+  of values and the offsets of each event) instead of object arrays, see 'set_jagged_format'.
   '''
   if direct_input != None:
     # way to bypass filemapping and load files from different data directories
@@ -54,20 +69,366 @@ def load_process_from_file(process, file_directory, file_map, log_file,
   #  branches_only_in_signal = [""
   #  for missing_branch in branches_only_in_signal:
   #    branches = [branch for branch in branches if branch != missing_branch]
+  cache_path = None
+  if (cache_dir != None) and (cache_mode != "bypass"):
+    cache_path = set_cache_path(cache_dir, process, file_string, branches, good_events)
+  if (cache_path != None) and (cache_mode == "use") and path.isdir(cache_path):
+    log_print(f"Reading cached events from {cache_path}", log_file)
+    processed_events = load_from_cache(cache_path)
+  else:
+    try:
+      if pushdown:
+        processed_events = read_with_pushdown(file_string, branches, good_events)
+      else:
+        processed_events = uproot.concatenate([file_string], branches, cut=good_events,
+                                              library=("ak" if compact_jagged else "np"))
+      processed_events = set_jagged_format(processed_events, compact_jagged)
+    except FileNotFoundError:
+      log_print(text_options["yellow"] + "FILE NOT FOUND! " + text_options["reset"], log_file, end="")
+      log_print(f"continuing without loading {file_string}...", log_file)
+      return None
+    if (cache_path != None): save_to_cache(cache_path, processed_events)
+  process_list = {}
+  process_list[process] = {}
+  process_list[process]["info"] = EventTable(set_jagged_format(processed_events, compact_jagged))
+ 
+  return process_list
+
+
+def read_with_pushdown(file_string, branches, good_events):
+  '''
+  Two phase alternative to uproot.concatenate([file_string], branches, cut=good_events, library="np").
+  First only the branches used in 'good_events' are read to find the passing entries of each file.
+  Then 'branches' are read only for the entry ranges between common basket boundaries
+  ('common_entry_offsets') that contain passing entries, and the cut is applied to those ranges.
+  With tight selections most baskets are never decompressed.
+  Raises FileNotFoundError if no files match, like uproot.concatenate.
+  '''
+  from glob import glob
+  filename, tree_name = file_string.rsplit(":", 1)
+  input_files = glob(filename) # not sorted, to keep the file order of uproot.concatenate
+  if len(input_files) == 0: raise FileNotFoundError(filename)
+
+  kept_ranges = {branch : [] for branch in branches}
+  for input_file in input_files:
+    with uproot.open(input_file + ":" + tree_name) as tree:
+      # phase 1, evaluate the cut, reading only the branches it uses
+      pass_cut = tree.arrays(["pass_good_events"], aliases={"pass_good_events" : good_events},
+                             library="np")["pass_good_events"].astype(bool)
+      passing_entries = np.flatnonzero(pass_cut)
+
+      # phase 2, group passing entries by basket range and merge neighbouring ranges
+      offsets = np.asarray(tree.common_entry_offsets(filter_name=branches))
+      used_ranges = np.unique(np.searchsorted(offsets, passing_entries, side="right") - 1)
+      starts, stops = offsets[used_ranges], offsets[used_ranges+1]
+      if len(starts) == 0: starts, stops = np.array([0]), np.array([0]) # keep empty arrays with the right types
+      new_range = np.ones(len(starts), dtype=bool)
+      new_range[1:] = starts[1:] != stops[:-1]
+      starts, stops = starts[new_range], stops[np.append(new_range[1:], True)]
+
+      for entry_start, entry_stop in zip(starts, stops):
+        events = tree.arrays(branches, entry_start=entry_start, entry_stop=entry_stop, library="np")
+        in_range = pass_cut[entry_start:entry_stop]
+        for branch in branches:
+          kept_ranges[branch].append(events[branch][in_range])
+
+  return {branch : np.concatenate(ranges) for branch, ranges in kept_ranges.items()}
+
+
+def set_jagged_format(events, compact_jagged):
+  '''
+  Return the branches of 'events' in a dictionary with the jagged branches in the requested format.
+  With 'compact_jagged' they are JaggedBranches, otherwise object arrays like uproot gives with library="np".
+  'events' can be a dictionary of numpy arrays and JaggedBranches (from uproot with library="np"
+  or from the cache) or an awkward array (from uproot with library="ak"). Reading with library="ak"
+  gives the content and offsets of jagged branches directly, without making one array per event.
+  '''
+  if not isinstance(events, dict):
+    import awkward as ak
+    event_dictionary = {}
+    for branch in events.fields:
+      if events[branch].ndim == 1:
+        event_dictionary[branch] = ak.to_numpy(events[branch])
+        continue
+      offsets = np.zeros(len(events[branch])+1, dtype=np.int64)
+      np.cumsum(ak.to_numpy(ak.num(events[branch])), out=offsets[1:])
+      event_dictionary[branch] = JaggedBranch(ak.to_numpy(ak.flatten(events[branch])), offsets)
+    events = event_dictionary
+  for branch, values in events.items():
+    if compact_jagged and (not isinstance(values, JaggedBranch)) and (values.dtype == object):
+      events[branch] = JaggedBranch(*flatten_jagged(values))
+    elif (not compact_jagged) and isinstance(values, JaggedBranch):
+      events[branch] = values.to_object_array()
+  return events
+
+
+def concatenate_branches(chunks):
+  '''
+  np.concatenate for the values of a branch read in several chunks, which may be JaggedBranches.
+  '''
+  if isinstance(chunks[0], JaggedBranch): return JaggedBranch.concatenate(chunks)
+  return np.concatenate(chunks)
+
+
+def set_cache_path(cache_dir, process, file_string, branches, good_events):
+  '''
+  Return the directory where the events loaded from 'file_string' are cached.
+  The name hashes the path, modification time, and size of every input file matching
+  the wildcard together with the loaded branches and the 'good_events' cut, so any change
+  to the inputs or the selection gives a new cache entry.
+  Returns None if no input files are found (uproot will report that case).
+  '''
+  import hashlib
+  from glob import glob
+  input_files = sorted(glob(file_string.removesuffix(":Events")))
+  if len(input_files) == 0: return None
+  key = [[f, path.getmtime(f), path.getsize(f)] for f in input_files]
+  key = repr([key, sorted(branches), good_events]).encode()
+  return path.join(cache_dir, process + "_" + hashlib.sha1(key).hexdigest()[:16])
+
+
+def save_to_cache(cache_path, event_dictionary):
+  '''
+  Save each branch of 'event_dictionary' to its own .npy file in 'cache_path'.
+  JaggedBranches are saved as two files, "branch.content.npy" and "branch.offsets.npy".
+  Files are written to a temporary directory which is renamed when complete,
+  so an interrupted write never leaves a partial cache behind.
+  '''
+  import shutil
+  temp_path = cache_path + "_writing"
+  shutil.rmtree(temp_path, ignore_errors=True)
+  makedirs(temp_path)
+  for branch, values in event_dictionary.items():
+    if isinstance(values, JaggedBranch):
+      np.save(path.join(temp_path, branch + ".content.npy"), values.content)
+      np.save(path.join(temp_path, branch + ".offsets.npy"), values.offsets)
+      continue
+    np.save(path.join(temp_path, branch + ".npy"), values, allow_pickle=(values.dtype == object))
+  shutil.rmtree(cache_path, ignore_errors=True)
+  rename(temp_path, cache_path)
+
+
+def load_from_cache(cache_path):
+  '''
+  Load the branches saved by 'save_to_cache'. Flat branches are memory-mapped copy-on-write,
+  so they are only read from disk when used and can still be modified in memory.
+  Jagged branches saved as object arrays can't be memory-mapped and are read fully,
+  while the content of JaggedBranches is memory-mapped like a flat branch.
+  '''
+  event_dictionary = {}
+  for filename in sorted(listdir(cache_path)):
+    branch = filename.removesuffix(".npy")
+    if branch.endswith(".offsets"): continue
+    if branch.endswith(".content"):
+      branch = branch.removesuffix(".content")
+      event_dictionary[branch] = JaggedBranch(np.load(path.join(cache_path, filename), mmap_mode="c"),
+                                              np.load(path.join(cache_path, branch + ".offsets.npy")))
+      continue
+    try:
+      event_dictionary[branch] = np.load(path.join(cache_path, filename), mmap_mode="c")
+    except ValueError: # object arrays
+      event_dictionary[branch] = np.load(path.join(cache_path, filename), allow_pickle=True)
+  return event_dictionary
+
+
+def set_branches_to_keep(vars_to_plot):
+  '''
+  Return the branches that are still read after all cuts are applied, i.e. the ones used
+  by 'append_to_combined_processes' and the DY split. Anything else can be dropped
+  as soon as a chunk of events has been cut.
+  '''
+  branches_to_keep = ["run", "event_flavor",
+                      "Generator_weight", "Weight_TTbar_NNLO", "Weight_DY_Zpt",
+                      "TauSFweight", "MuSFweight", "ElSFweight", "BTagSFfull", "PUweight", "XSecMCweight",
+                      "FFweight", "FFweight_QCD", "FFweight_WJ", "FFweight_FractionQCD", "FF_weight",
+                      "Gen_H_pT", "Gen_pT_j1", "Gen_pT_l1", "Gen_nCleanJet",
+                      "pass_cuts", "pass_0j_cuts", "pass_1j_cuts", "pass_2j_cuts", "pass_3j_cuts",
+                      "pass_GTE1j_cuts", "pass_GTE2j_cuts"]
+  branches_to_keep += [var for var in vars_to_plot if var not in branches_to_keep]
+  return branches_to_keep
+
+
+def load_and_cut_process_in_chunks(process, file_directory, file_map, log_file,
+                                   branches, good_events, final_state_mode,
+                                   era, jet_mode, DeepTau_version, tau_pt_cut,
+                                   branches_to_keep=None, step_size="200 MB",
+                                   data=False, testing=False, direct_input=None, compact_jagged=False):
+  '''
+  Streaming version of 'load_process_from_file' followed by 'apply_HTT_FS_cuts_to_process'.
+  Instead of loading all files of a process at once with uproot.concatenate, uproot.iterate
+  is used to read 'step_size' worth of events at a time (either a number of entries or
+  a string like "200 MB", see the uproot documentation on iterate). Each chunk is cut
+  immediately and only the 'branches_to_keep' of the surviving events are stored,
+  so peak memory is one chunk plus the accumulated selected events.
+  Returns the same dictionary of cut events as 'apply_HTT_FS_cuts_to_process', or None.
+  Index branches like "pass_cuts" hold indices into the events of one chunk, they are used by the cuts
+  of that chunk and are not stored. Every stored branch has to be in every chunk that has passing events.
+  The on-disk cache of 'load_process_from_file' is not used here, since it holds all preselected events.
+  'compact_jagged' is the same as in 'load_process_from_file'.
+  '''
+  # avoid a circular import, cut_and_study_functions imports from this file
+  from cut_and_study_functions import apply_HTT_FS_cuts_to_process
+
+  if direct_input != None:
+    log_print(f"Loading {direct_input} in chunks of {step_size}", log_file, time=True)
+    file_string = direct_input + ".root:Events"
+  else:
+    log_print(f"Loading {file_map[process]} in chunks of {step_size}", log_file, time=True)
+    file_string = file_directory + "/" + file_map[process] + ".root:Events"
+  if data:
+    branches_not_in_data = ["Generator_weight", "NWEvents", "Tau_genPartFlav", "XSecMCweight",
+                            "Weight_DY_Zpt", "Weight_DY_Zpt_LO", "Weight_DY_Zpt_NLO",
+                            "TauSFweight", "MuSFweight", "ElSFweight", "BTagSFfull",
+                            "PUweight", "Weight_TTbar_NNLO", "Pileup_nPU"]
+    branches = [branch for branch in branches if branch not in branches_not_in_data]
+  if "WJets" not in process:
+    branches = [branch for branch in branches if not branch.startswith("StitchWeight_WJets")]
+
+  kept_chunks = {}
+  nChunks, nEvents_read = 0, 0
   try:
-    processed_events = uproot.concatenate([file_string], branches, cut=good_events, library="np")
+    for chunk in uproot.iterate([file_string], branches, cut=good_events, step_size=step_size,
+                                library=("ak" if compact_jagged else "np")):
+      chunk = set_jagged_format(chunk, compact_jagged)
+      nChunks += 1
+      nEvents_read += len(chunk["run"])
+      cut_chunk = apply_HTT_FS_cuts_to_process(era, process, {process: {"info": EventTable(chunk)}}, log_file,
+                                               final_state_mode, jet_mode, DeepTau_version, tau_pt_cut)
+      del chunk
+      if cut_chunk == None: continue
+      keys = cut_chunk.keys() if branches_to_keep == None else branches_to_keep
+      keys = [key for key in keys if (key in cut_chunk) and (not is_index_branch(key))]
+      if len(kept_chunks) == 0: kept_chunks = {key : [] for key in keys}
+      if set(keys) != set(kept_chunks):
+        raise ValueError(f"Branches differ between chunks of {file_string}: "
+                         f"{sorted(set(keys) ^ set(kept_chunks))}, chunk {nChunks}")
+      for key in keys:
+        kept_chunks[key].append(cut_chunk[key])
+      del cut_chunk
   except FileNotFoundError:
     log_print(text_options["yellow"] + "FILE NOT FOUND! " + text_options["reset"], log_file, end="")
     log_print(f"continuing without loading {file_string}...", log_file)
     return None
-  process_list = {}
-  process_list[process] = {}
-  process_list[process]["info"] = processed_events
- 
-  return process_list
+
+  if len(kept_chunks) == 0: return None
+  cut_events = EventTable({key : concatenate_branches(chunks) for key, chunks in kept_chunks.items()})
+  log_print(f"{nChunks} chunks, {nEvents_read} events read, {len(cut_events['run'])} events kept", log_file)
+  return cut_events
+
+
+def load_and_cut_file(job):
+  '''
+  Worker for 'map_over_files'. Loads a single file, applies 'apply_HTT_FS_cuts_to_process'
+  and splits DY by flavor, then reduces the events to 'branches_to_keep' so that only
+  the arrays needed for plotting are sent back to the main process.
+  'job' is a dictionary holding the arguments below (see 'make_file_jobs').
+  Returns a list of [process_name, cut_events] pairs ready for 'append_to_combined_processes',
+  or None if no events survive.
+  '''
+  # avoid a circular import, cut_and_study_functions imports from this file
+  from cut_and_study_functions import apply_HTT_FS_cuts_to_process, split_DY_by_flavor
+
+  process, final_state_mode, log_file = job["process"], job["final_state_mode"], job["log_file"]
+  this_file_map = {process: job["input_file"]}
+  if job["step_size"] != None:
+    cut_events = load_and_cut_process_in_chunks(process, job["file_directory"], this_file_map, log_file,
+                                                job["branches"], job["good_events"], final_state_mode,
+                                                job["era"], job["jet_mode"], job["DeepTau_version"], job["tau_pt_cut"],
+                                                step_size=job["step_size"], data=("Data" in process), testing=job["testing"],
+                                                compact_jagged=job["compact_jagged"])
+  else:
+    new_process_dictionary = load_process_from_file(process, job["file_directory"], this_file_map, log_file,
+                                                    job["branches"], job["good_events"], final_state_mode,
+                                                    data=("Data" in process), testing=job["testing"],
+                                                    cache_dir=job["cache_dir"], cache_mode=job["cache_mode"],
+                                                    pushdown=job["pushdown"], compact_jagged=job["compact_jagged"])
+    if new_process_dictionary == None: return None
+    cut_events = apply_HTT_FS_cuts_to_process(job["era"], process, new_process_dictionary, log_file, final_state_mode,
+                                              job["jet_mode"], job["DeepTau_version"], job["tau_pt_cut"])
+  if cut_events == None: return None
+
+  if ("DY" in process) and (final_state_mode != "dimuon"):
+    split_events = split_DY_by_flavor(process, cut_events)
+    if split_events == None: return None
+  else:
+    split_events = {process: cut_events}
+
+  branches_to_keep = job["branches_to_keep"]
+  return [[process_name, {key : events[key] for key in branches_to_keep if key in events}]
+          for process_name, events in split_events.items()]
+
+
+def load_and_cut_FF_file(job):
+  '''
+  Worker for 'map_over_files' in the FF region, like 'load_and_cut_file'. Loads a single file with the
+  FF region preselection ('good_events'), applies 'apply_FF_region_cuts_to_process' with the job's
+  'semilep_mode' and 'region', and reduces the events to 'branches_to_keep'.
+  Returns a list with one [process, cut_events] pair for 'append_to_combined_processes', or None.
+  '''
+  # avoid a circular import, cut_and_study_functions imports from this file
+  from cut_and_study_functions import apply_FF_region_cuts_to_process
+
+  process, final_state_mode = job["process"], job["final_state_mode"]
+  new_process_dictionary = load_process_from_file(process, job["file_directory"], {process: job["input_file"]},
+                                                  job["log_file"], job["branches"], job["good_events"], final_state_mode,
+                                                  data=("Data" in process), testing=job["testing"],
+                                                  cache_dir=job["cache_dir"], cache_mode=job["cache_mode"],
+                                                  pushdown=job["pushdown"], compact_jagged=job["compact_jagged"])
+  if new_process_dictionary == None: return None
+  cut_events = apply_FF_region_cuts_to_process(job["era"], process, new_process_dictionary[process]["info"],
+                                               final_state_mode, job["jet_mode"], job["semilep_mode"], job["region"],
+                                               job["DeepTau_version"], job["tau_pt_cut"])
+  if cut_events == None: return None
+
+  branches_to_keep = job["branches_to_keep"]
+  return [[process, {key : cut_events[key] for key in branches_to_keep if key in cut_events}]]
+
+
+def make_file_jobs(process, input_files, file_directory, log_file, branches, good_events,
+                   final_state_mode, era, jet_mode, DeepTau_version, tau_pt_cut, vars_to_plot,
+                   step_size=None, testing=False, n_workers=1, cache_dir=None, cache_mode="bypass",
+                   pushdown=False, compact_jagged=False, semilep_mode=None, region=None):
+  '''
+  Collect the arguments of 'load_and_cut_file' (or 'load_and_cut_FF_file', which also needs
+  'semilep_mode' and 'region') for each file of a process.
+  The log file can't be shared between processes, so it is only passed when running serially.
+  '''
+  branches_to_keep = set_branches_to_keep(vars_to_plot)
+  jobs = []
+  for input_file in input_files:
+    jobs.append({"process" : process, "input_file" : input_file, "file_directory" : file_directory,
+                 "log_file" : log_file if n_workers <= 1 else None,
+                 "branches" : branches, "good_events" : good_events, "final_state_mode" : final_state_mode,
+                 "era" : era, "jet_mode" : jet_mode, "DeepTau_version" : DeepTau_version, "tau_pt_cut" : tau_pt_cut,
+                 "branches_to_keep" : branches_to_keep, "step_size" : step_size, "testing" : testing,
+                 "cache_dir" : cache_dir, "cache_mode" : cache_mode, "pushdown" : pushdown,
+                 "compact_jagged" : compact_jagged, "semilep_mode" : semilep_mode, "region" : region})
+  return jobs
+
+
+def map_over_files(worker, jobs, n_workers=1):
+  '''
+  Run 'worker' on every entry of 'jobs' and yield the results in the same order as 'jobs',
+  so merging the output is independent of which file finishes first.
+  With n_workers > 1 the jobs are spread over a pool of processes, otherwise they run one by one.
+  'worker' must be defined at the top level of a module so that it can be sent to the pool.
+  '''
+  if n_workers <= 1:
+    for job in jobs:
+      yield worker(job)
+  else:
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+      for result in executor.map(worker, jobs):
+        yield result
 
 
 def sort_combined_processes(combined_processes_dictionary, fakes=False):
+  '''
+  Split the combined processes into data, backgrounds, and signals,
+  after finishing the merge of processes loaded one file at a time (see 'finalize_combined_processes').
+  '''
+  finalize_combined_processes(combined_processes_dictionary)
   data_dictionary, background_dictionary, signal_dictionary = {}, {}, {}
   for process in combined_processes_dictionary:
     newProcess = process + "Fakes" if fakes==True else process
@@ -80,6 +441,30 @@ def sort_combined_processes(combined_processes_dictionary, fakes=False):
   return data_dictionary, background_dictionary, signal_dictionary
 
 
+def finalize_combined_processes(combined_processes):
+  '''
+  Concatenate the arrays of the files merged one at a time into a process (see 'append_to_combined_processes')
+  with one concatenation per array, and remove the per-file arrays. Processes without merged files are unchanged.
+  '''
+  for process in combined_processes:
+    file_chunks = combined_processes[process].pop("FileChunks", None)
+    if file_chunks == None: continue
+    combined_processes[process].pop("WeightCache", None) # see 'get_process_weights'
+    for key1 in combined_processes[process]:
+      assert all([key1 in file_chunk for file_chunk in file_chunks])
+      if isinstance(combined_processes[process][key1], dict):
+        for key2 in combined_processes[process][key1]:
+          assert all([key2 in file_chunk[key1] for file_chunk in file_chunks])
+          combined_processes[process][key1][key2] = concatenate_branches([combined_processes[process][key1][key2]] +
+                                                                          [file_chunk[key1][key2] for file_chunk in file_chunks])
+      elif isinstance(combined_processes[process][key1], np.ndarray):
+        combined_processes[process][key1] = concatenate_branches([combined_processes[process][key1]] +
+                                                                  [file_chunk[key1] for file_chunk in file_chunks])
+      else:
+        print("I don't know what happened here ('finalize_combined_processes' in file_functions.py)")
+  return combined_processes
+
+
 def append_to_combined_processes(process, cut_events, vars_to_plot, combined_processes, one_file_at_a_time):
   orig_process = ""
   if process in combined_processes.keys():
@@ -134,17 +519,9 @@ def append_to_combined_processes(process, cut_events, vars_to_plot, combined_pro
       combined_processes[process]["Cuts"][cut] = cut_events[cut]
 
   if one_file_at_a_time and process.endswith("_alt") and orig_process!="":
-    for key1 in combined_processes[orig_process]:
-      assert key1 in combined_processes[process]
-      if isinstance(combined_processes[orig_process][key1], dict):
-        for key2 in combined_processes[orig_process][key1]:
-          assert key2 in combined_processes[process][key1]
-          combined_processes[orig_process][key1][key2] = np.append(combined_processes[orig_process][key1][key2], combined_processes[process][key1][key2])
-      elif isinstance(combined_processes[orig_process][key1], np.ndarray):
-        combined_processes[orig_process][key1] = np.append(combined_processes[orig_process][key1], combined_processes[process][key1])
-      else:
-        print("I don't know what happened here ('append_to_combined_processes' in file_functions.py)")
-    del combined_processes[process]
+    # keep the arrays of each file, they are concatenated once in 'finalize_combined_processes'
+    if "FileChunks" not in combined_processes[orig_process]: combined_processes[orig_process]["FileChunks"] = []
+    combined_processes[orig_process]["FileChunks"].append(combined_processes.pop(process))
 
   return combined_processes
 
@@ -0,0 +1,166 @@
+import numpy as np
+
+### README
+# this file contains Hist, the binned result of a variable for a process (or family of processes).
+# It replaces the {"BinnedEvents" : ..., "BinnedErrors" : ...} dictionaries and can still be read and
+# written like them: hist["BinnedEvents"] is the sum of weights and hist["BinnedErrors"] the sum of
+# squared weights of each bin (still squared errors, take the sqrt for plotting).
+
+class Hist:
+  '''
+  Array-backed histogram with bin 'edges', the sum of weights 'sumw', and the sum of squared weights 'sumw2'.
+  The arrays are used as given (not copied), and slicing, e.g. hist[2:5], gives a Hist of those bins
+  sharing the arrays. Hists with the same edges can be added and subtracted (squared weights always add up),
+  and multiplying or dividing by a number scales sumw by it and sumw2 by its square.
+  'rebin' merges bins, and 'save_hists'/'load_hists' store (dictionaries of) Hists in one npz file.
+  '''
+  __slots__ = ("edges", "sumw", "sumw2")
+  legacy_keys = {"BinnedEvents" : "sumw", "BinnedErrors" : "sumw2"}
+
+  def __init__(self, edges, sumw=None, sumw2=None):
+    self.edges = np.asarray(edges)
+    self.sumw  = np.zeros(len(self.edges)-1) if sumw is None else np.asarray(sumw)
+    self.sumw2 = np.zeros(len(self.edges)-1) if sumw2 is None else np.asarray(sumw2)
+
+  @property
+  def nBins(self):
+    return len(self.edges) - 1
+
+  @property
+  def errors(self):
+    return np.sqrt(self.sumw2)
+
+  def __len__(self):
+    return self.nBins
+
+  def __getitem__(self, key):
+    if isinstance(key, str): return getattr(self, self.legacy_keys[key])
+    if not isinstance(key, slice) or (key.step not in [None, 1]):
+      raise IndexError("Hist can only be indexed with 'BinnedEvents', 'BinnedErrors', or a slice of bins")
+    start, stop, _ = key.indices(self.nBins)
+    stop = max(start, stop)
+    return Hist(self.edges[start:stop+1], self.sumw[start:stop], self.sumw2[start:stop])
+
+  def __setitem__(self, key, values):
+    setattr(self, self.legacy_keys[key], values)
+
+  def __contains__(self, key):
+    return key in self.legacy_keys
+
+  def copy(self):
+    return Hist(self.edges, self.sumw.copy(), self.sumw2.copy())
+
+  def check_compatible(self, other):
+    if not isinstance(other, Hist):
+      raise TypeError(f"can only combine Hist with Hist, not {type(other).__name__}")
+    if (self.edges is not other.edges) and not np.array_equal(self.edges, other.edges):
+      raise ValueError(f"Hist edges don't match: {self.edges} and {other.edges}")
+
+  def __add__(self, other):
+    if isinstance(other, (int, float)) and (other == 0): return self.copy() # allows sum(hists)
+    self.check_compatible(other)
+    return Hist(self.edges, self.sumw + other.sumw, self.sumw2 + other.sumw2)
+
+  __radd__ = __add__
+
+  def __iadd__(self, other):
+    self.check_compatible(other)
+    self.sumw  += other.sumw
+    self.sumw2 += other.sumw2
+    return self
+
+  def __sub__(self, other):
+    self.check_compatible(other)
+    return Hist(self.edges, self.sumw - other.sumw, self.sumw2 + other.sumw2)
+
+  def __isub__(self, other):
+    self.check_compatible(other)
+    self.sumw  -= other.sumw
+    self.sumw2 += other.sumw2
+    return self
+
+  def __mul__(self, factor):
+    return Hist(self.edges, self.sumw * factor, self.sumw2 * (factor * factor))
+
+  __rmul__ = __mul__
+
+  def __truediv__(self, factor):
+    return Hist(self.edges, self.sumw / factor, self.sumw2 / (factor * factor))
+
+  def edge_positions(self, new_edges):
+    '''
+    Return the index in 'edges' of each of 'new_edges', which have to be increasing and line up with the edges.
+    Edges are matched up to floating point rounding, so that e.g. np.linspace edges made with a different
+    number of bins still line up.
+    '''
+    tolerance = 1e-9 * (self.edges[-1] - self.edges[0])
+    positions = np.clip(np.searchsorted(self.edges, new_edges), 1, self.nBins)
+    positions -= (new_edges - self.edges[positions-1]) < (self.edges[positions] - new_edges) # nearest edge
+    if (len(new_edges) < 2) or np.any(np.diff(positions) <= 0) or \
+       np.any(np.abs(self.edges[positions] - new_edges) > tolerance):
+      raise ValueError(f"can't rebin edges {self.edges} to {new_edges}")
+    return positions
+
+  def rebin(self, new_edges, flow=False):
+    '''
+    Merge bins into the bins of 'new_edges', which have to be a subset of the edges.
+    The bins are differences of the cumulative sums, so any number of binnings can be made from one
+    finely binned Hist. Without 'flow' the first and last edge have to be the same, with 'flow' the
+    new edges can cover a smaller range, and the bins outside it are added to the first and last bins
+    (like the underflow and overflow in 'fill_histogram').
+    '''
+    new_edges = np.asarray(new_edges, dtype=float)
+    positions = self.edge_positions(new_edges)
+    if flow: positions[0], positions[-1] = 0, self.nBins
+    elif (positions[0] != 0) or (positions[-1] != self.nBins):
+      raise ValueError(f"edges {new_edges} don't cover the range of {self.edges}, use flow=True to fold it in")
+    rebinned = []
+    for values in [self.sumw, self.sumw2]:
+      cumulative = np.zeros(self.nBins+1)
+      np.cumsum(values, out=cumulative[1:])
+      rebinned.append(np.diff(cumulative[positions]).astype(values.dtype))
+    return Hist(new_edges, *rebinned)
+
+  @staticmethod
+  def merge(hists):
+    '''
+    Add up a list of Hists (e.g. partial results of files or workers) into a new Hist.
+    '''
+    merged = hists[0].copy()
+    for hist in hists[1:]:
+      merged += hist
+    return merged
+
+  def __repr__(self):
+    return f"Hist(edges={self.edges}, sumw={self.sumw}, sumw2={self.sumw2})"
+
+
+def save_hists(filename, hists, arrays=None, prefix=""):
+  '''
+  Save a dictionary of Hists, or of dictionaries of Hists (any depth), to a single (uncompressed) npz file,
+  readable with 'load_hists'. The keys are joined with "/", so they shouldn't contain it themselves.
+  '''
+  top_level = arrays is None
+  if top_level: arrays = {}
+  for name, hist in hists.items():
+    if isinstance(hist, dict):
+      save_hists(filename, hist, arrays, prefix=f"{prefix}{name}/")
+      continue
+    arrays[f"{prefix}{name}/edges"] = hist.edges
+    arrays[f"{prefix}{name}/sumw"]  = hist.sumw
+    arrays[f"{prefix}{name}/sumw2"] = hist.sumw2
+  if top_level: np.savez(filename, **arrays)
+
+
+def load_hists(filename):
+  '''
+  Return the (nested) dictionary of Hists saved with 'save_hists'.
+  '''
+  hists = {}
+  with np.load(filename) as arrays:
+    for name in dict.fromkeys(key.rsplit("/", 1)[0] for key in arrays.files):
+      *parents, hist_name = name.split("/")
+      level = hists
+      for parent in parents: level = level.setdefault(parent, {})
+      level[hist_name] = Hist(arrays[f"{name}/edges"], arrays[f"{name}/sumw"], arrays[f"{name}/sumw2"])
+  return hists
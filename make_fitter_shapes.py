@@ -4,6 +4,8 @@ import numpy as np
 from plotting_functions import make_bins, get_binned_data, get_binned_backgrounds, get_binned_signals, get_summed_backgrounds
 from file_functions     import sort_combined_processes
 from FF_functions       import set_JetFakes_process
+from histogram          import Hist
+from event_table        import is_index_branch
 import copy
 
 def make_masks_per_bin(input_dictionary, var, binning):
@@ -41,34 +43,40 @@ def apply_single_cut(input_dict, cut):
     else:
       assert all([var in input_dict[process]["PlotEvents"] for var in vars_to_cut_on])
 
-    # Initialize lists
+    # Initialize lists, index branches like "pass_cuts" don't have one entry per event and are copied as they are
+    index_branches = {}
     for key in input_dict[process]:
+      if key == "WeightCache": continue # cached event weights of the uncut events, see 'get_process_weights'
       if isinstance(input_dict[process][key], dict):
         output_dict[process][key] = {}
         for branch in input_dict[process][key]:
-          output_dict[process][key][branch] = []
+          if is_index_branch(branch): index_branches[(key, branch)] = input_dict[process][key][branch]
+          else: output_dict[process][key][branch] = []
       else:
         output_dict[process][key] = []
 
     # Copy only events to new lists which pass cuts
-    for i in range(input_dict[process]["Cuts"]["pass_cuts"].size):
+    nEvents = len(input_dict[process]["PlotEvents"][vars_to_cut_on[0]])
+    for i in range(nEvents):
       for var in vars_to_cut_on:
         exec(f'{var} = {input_dict[process]["PlotEvents"][var][i]}')
       if not eval(cut): continue
-      for key in input_dict[process]:
+      for key in output_dict[process]:
         if isinstance(input_dict[process][key], dict):
-          for branch in input_dict[process][key]:
+          for branch in output_dict[process][key]:
             output_dict[process][key][branch].append(input_dict[process][key][branch][i])
         else:
           output_dict[process][key].append(input_dict[process][key][i])
 
     # Convert lists to numpy arrays
-    for key in input_dict[process]:
+    for key in output_dict[process]:
       if isinstance(input_dict[process][key], dict):
-        for branch in input_dict[process][key]:
+        for branch in output_dict[process][key]:
           output_dict[process][key][branch] = np.array(output_dict[process][key][branch])
       else:
         output_dict[process][key] = np.array(output_dict[process][key])
+    for (key, branch), values in index_branches.items():
+      output_dict[process][key][branch] = values
   return output_dict
 
 def save_fitter_shapes(plot_dir, era, final_state_mode, vars_to_plot, combined_process_dictionary, combined_process_dictionaryFakes, fakesLabel, testing, lumi):
@@ -222,14 +230,10 @@ def save_fitter_shapes(plot_dir, era, final_state_mode, vars_to_plot, combined_p
           h_signals_unrolled = get_binned_signals(final_state_mode, testing, signal_dictionary, var, xbins, lumi,
                                                   mask=unrolled_bins_signal, mask_n=ith_bin)
           # combine non ggH signals into xH
-          first_key = list(signal_dictionary)[0]
-          h_signals_unrolled["xH_TauTau"] = {}
-          h_signals_unrolled["xH_TauTau"]["BinnedEvents"] = np.zeros(len(h_signals_unrolled[first_key]["BinnedEvents"]))
-          h_signals_unrolled["xH_TauTau"]["BinnedErrors"] = np.zeros(len(h_signals_unrolled[first_key]["BinnedErrors"]))
+          h_signals_unrolled["xH_TauTau"] = Hist(xbins)
           for signal in signal_dictionary:
             if ("ggH" not in signal):
-              h_signals_unrolled["xH_TauTau"]["BinnedEvents"] += h_signals_unrolled[signal]["BinnedEvents"]
-              h_signals_unrolled["xH_TauTau"]["BinnedErrors"] += h_signals_unrolled[signal]["BinnedErrors"]
+              h_signals_unrolled["xH_TauTau"] += h_signals_unrolled[signal]
               del(h_signals_unrolled[signal])
  
           for process in h_signals_unrolled.keys():
@@ -240,14 +244,12 @@ def save_fitter_shapes(plot_dir, era, final_state_mode, vars_to_plot, combined_p
 
       h_dataFakes = get_binned_data(final_state_mode, testing, data_dictionaryFakes, var, xbins, lumi)
       h_backgroundsFakes = get_binned_backgrounds(final_state_mode, testing, background_dictionaryFakes, var, xbins, lumi)
-      h_summed_backgrounds = get_summed_backgrounds(h_backgroundsFakes)
+      h_summed_backgrounds = get_summed_backgrounds(h_backgroundsFakes, xbins)
       h_signalsFakes = get_binned_signals(final_state_mode, testing, signal_dictionaryFakes, var, xbins, lumi)
-      h_summed_signals = get_summed_backgrounds(h_signalsFakes)
+      h_summed_signals = get_summed_backgrounds(h_signalsFakes, xbins)
 
       jetFakes_background = h_dataFakes["Data"]["BinnedEvents"] - h_summed_backgrounds["Bkgd"]["BinnedEvents"] - (h_summed_signals["Bkgd"]["BinnedEvents"]/100)
-      h_JetFakes = {"JetFakes": {}}
-      h_JetFakes["JetFakes"]["BinnedEvents"] = jetFakes_background
-      h_JetFakes["JetFakes"]["BinnedErrors"] = np.nan_to_num(np.sqrt(jetFakes_background))
+      h_JetFakes = {"JetFakes": Hist(xbins, jetFakes_background, np.nan_to_num(np.sqrt(jetFakes_background)))}
      
       root_histograms = {}
       h_sum = dict(h_data)
@@ -261,9 +263,7 @@ def save_fitter_shapes(plot_dir, era, final_state_mode, vars_to_plot, combined_p
         try:
           h_sum[process]["BinnedEvents"]
         except KeyError:
-          h_sum[process] = {}
-          h_sum[process]["BinnedEvents"] = np.zeros(len(h_sum["Data"]["BinnedEvents"]))
-          h_sum[process]["BinnedErrors"] = np.zeros(len(h_sum["Data"]["BinnedErrors"]))
+          h_sum[process] = Hist(xbins)
 
       for process in h_sum:
         if process=="Data": process_name = "data_obs"
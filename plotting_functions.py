@@ -10,7 +10,8 @@ from binning_dictionary   import binning_dictionary, label_dictionary
 from triggers_dictionary  import triggers_dictionary
 
 from luminosity_dictionary import luminosities_with_normtag as luminosities
-from calculate_functions  import yields_for_CSV, calculate_underoverflow
+from calculate_functions  import yields_for_CSV, fill_histogram
+from histogram            import Hist
 
 
 def make_pie_chart(data_hist, MC_dictionary, use_data=False, use_fakes=False):
@@ -590,32 +591,73 @@ def adjust_scaling(final_state, process, scaling):
   return scaling * adjustment_factor
 
 
-def get_binned_info(final_state, testing, process_name, process_variable, xbins, process_weights, luminosity, mask={}, variable=""):
+def get_process_scaling(final_state, testing, process_name, luminosity):
   '''
-  Take in a list of events and produce a histogram (values binned in a numpy array).
   'scaling' is either set to 1 for data (no scaling) or retrieved from the MC_dictionary.
-  Underflows and overflows are included in the first and final bins of the output histogram by default.
-  Note: 'process_variable' is a list of events
   '''
   skip_scaling = ("Data" in process_name) or ("Fakes" in process_name)
   scaling = 1 if skip_scaling else set_MC_process_info(process_name, luminosity, scaling=True)[2] # used to get XSecMCweight
   # now does nothing, remove
   if testing == True: scaling = adjust_scaling(final_state, process_name, scaling)
+  return scaling
+
+
+MC_weight_components = ["Generator_weight", "PUweight", "TauSFweight", "MuSFweight", "ElSFweight",
+                        "BTagSFfull", "Weight_DY_Zpt", "Weight_TTbar_NNLO", "XSecMCweight"]
+FF_weight_components = ["FFweight_QCD", "FFweight_WJ", "FFweight_FractionQCD"]
+
+def get_process_weights(final_state, testing, process_dictionary, process, luminosity, nEvents):
+  '''
+  Return the full weight of every event of 'process' (the weights of its weighting scheme times its scaling),
+  as used for all of its histograms.
+  The weights are computed once and cached on the process entry under "WeightCache", keyed by weighting scheme.
+  They are recomputed only when one of the weight component arrays of the scheme is replaced
+  (e.g. when files are merged into the process) or the scaling changes.
+  '''
+  process_entry = process_dictionary[process]
+  if ("Data" in process) and ("Fakes" not in process):
+    scheme, components = "Data", [] # weights of one for data if not part of fakes estimate
+  elif ("Data" in process) and ("Fakes" in process):
+    scheme, components = "Data_FF", FF_weight_components
+  elif ("Data" not in process) and (("Fakes" in process) or (process == "myQCD")):
+    if all(component in process_entry for component in MC_weight_components + FF_weight_components):
+      scheme, components = "MC_FF", MC_weight_components + FF_weight_components
+    else: # V3 and lower, preserving old behavior
+      scheme, components = "FF_weight", ["FF_weight"]
+  else:
+    scheme, components = "MC", MC_weight_components
+  components = tuple(process_entry[component] for component in components)
+  scaling    = get_process_scaling(final_state, testing, process, luminosity)
+
+  weight_cache = process_entry.setdefault("WeightCache", {})
+  if scheme in weight_cache:
+    cached_components, cached_scaling, weights = weight_cache[scheme]
+    # the cache keeps the component arrays, so a replaced array is never mistaken for the cached one
+    if (len(weights) == nEvents) and (cached_scaling == scaling) and (len(cached_components) == len(components)) \
+       and all(cached is current for cached, current in zip(cached_components, components)):
+      return weights
+
+  if (scheme == "Data"):
+    process_weights = np.ones(nEvents)
+  elif (scheme == "Data_FF"):
+    # define process weights directly for Data
+    FF_weightQCD = process_entry["FFweight_QCD"]*process_entry["FFweight_FractionQCD"]
+    FF_weightWJ = process_entry["FFweight_WJ"]*(1-process_entry["FFweight_FractionQCD"])
+    process_weights = FF_weightQCD + FF_weightWJ
+  elif (scheme == "MC_FF"):
+    # for signal and MC, get process weights as an option in the set_MC_weights function
+    process_weights = get_MC_weights(process_dictionary, process, useFFweights=True)
+  elif (scheme == "FF_weight"):
+    process_weights = process_entry["FF_weight"]
+  else:
+    process_weights = get_MC_weights(process_dictionary, process)
   weights = scaling * process_weights
-  if (len(mask) != 0): 
-    process_variable = process_variable[mask]
-    weights = weights[mask]
-  underflow, overflow, underflow_error, overflow_error = calculate_underoverflow(process_variable, xbins, weights, variable)
-  binned_values, _    = np.histogram(process_variable, xbins, weights=weights)
-  binned_values[0]   += underflow
-  binned_values[-1]  += overflow
-  binned_weight_2, _  = np.histogram(process_variable, xbins, weights=weights*weights)
-  binned_weight_2[0]  += underflow_error
-  binned_weight_2[-1] += overflow_error
-  return binned_values, binned_weight_2
+  weight_cache[scheme] = (components, scaling, weights)
+  return weights
+
 
 def get_weight_stats(process_name, process_weights):
-  """ To be used in get_binned_info as a quick way to quantify process_weights """
+  """ To be used with get_process_weights as a quick way to quantify process_weights """
   from scipy import stats
   print(f"Average process weight for {process_name}")
   print(np.average(process_weights))
@@ -633,41 +675,30 @@ def get_binned_process(final_state, testing, process_dictionary, variable, xbins
     process_variable = process_dictionary[process]["PlotEvents"][variable]
     process_mask = mask[process][mask_n] if mask_n != 999 else []
     if len(process_variable) == 0: continue
-    if ("Data" in process) and ("Fakes" not in process):
-      process_weights = np.ones(np.shape(process_variable)) # weights of one for data if not part of fakes estimate
-    elif ("Data" in process) and ("Fakes" in process):
-      # define process weights directly for Data
-      FF_weightQCD = process_dictionary[process]["FFweight_QCD"]*process_dictionary[process]["FFweight_FractionQCD"]
-      FF_weightWJ = process_dictionary[process]["FFweight_WJ"]*(1-process_dictionary[process]["FFweight_FractionQCD"])
-      process_weights = FF_weightQCD + FF_weightWJ
-      #process_weights = get_MC_weights(process_dictionary, process, add_weights=FF_weight)
-    elif ("Data" not in process) and (("Fakes" in process) or (process == "myQCD")):
-      # for signal and MC, get process weights as an option in the set_MC_weights function
-      try:
-        process_weights = get_MC_weights(process_dictionary, process, useFFweights=True)
-      except KeyError: # V3 and lower, preserving old behavior
-        process_weights = process_dictionary[process]["FF_weight"]
-        #process_weights = get_MC_weights(process_dictionary, process)
-    else:
-      process_weights = get_MC_weights(process_dictionary, process)
-    h_processes[process] = {}
-    binned_values, binned_errors = get_binned_info(final_state, testing, process, process_variable,
-                                                   xbins_, process_weights, lumi_, process_mask, variable)
-    h_processes[process]["BinnedEvents"] = binned_values
-    h_processes[process]["BinnedErrors"] = binned_errors
+    # the weights (and scaling) of a process are the same for every variable, see 'get_process_weights'
+    weights = get_process_weights(final_state, testing, process_dictionary, process, lumi_, len(process_variable))
+    if (len(process_mask) != 0):
+      process_variable = process_variable[process_mask]
+      weights = weights[process_mask]
+    binned_values, binned_errors = fill_histogram(process_variable, xbins_, weights, variable)
+    h_processes[process] = Hist(xbins_, binned_values, binned_errors)
   return h_processes
 
 
 def get_binned_data(final_state, testing, data_dictionary, variable, xbins_, lumi_, mask={}, mask_n=999):
   h_data_by_dataset = get_binned_process(final_state, testing, data_dictionary, variable, xbins_, lumi_, mask, mask_n)
+  return combine_binned_data(h_data_by_dataset)
+
+
+def combine_binned_data(h_data_by_dataset):
+  '''
+  Add up the histograms of all datasets into a single "Data" histogram.
+  '''
   h_data = {}
-  h_data["Data"] = {}
   first_key = list(h_data_by_dataset)[0]
-  h_data["Data"]["BinnedEvents"] = np.zeros(len(h_data_by_dataset[first_key]["BinnedEvents"]))
-  h_data["Data"]["BinnedErrors"] = np.zeros(len(h_data_by_dataset[first_key]["BinnedErrors"]))
+  h_data["Data"] = Hist(h_data_by_dataset[first_key].edges) # float64 sums, like the plotted histograms
   for dataset in h_data_by_dataset:
-    h_data["Data"]["BinnedEvents"] += h_data_by_dataset[dataset]["BinnedEvents"]
-    h_data["Data"]["BinnedErrors"] += h_data_by_dataset[dataset]["BinnedErrors"] #still squared errors
+    h_data["Data"] += h_data_by_dataset[dataset] #still squared errors
   return h_data
 
 
@@ -691,6 +722,15 @@ def get_binned_backgrounds(final_state_mode, testing, background_dictionary, var
   h_MC_by_process = get_binned_process(final_state_mode, testing, background_dictionary, variable, xbins_, lumi_, mask, mask_n)
   if (skip_background_accumulation): return h_MC_by_process
 
+  MC_by_family   = set_MC_families(final_state_mode, presentation_mode, userMC)
+  family_routing = get_family_routing(h_MC_by_process, MC_by_family, presentation_mode)
+  return group_binned_by_family(h_MC_by_process, MC_by_family, family_routing)
+
+
+def set_MC_families(final_state_mode, presentation_mode=False, userMC=[]):
+  '''
+  Return the list of MC families the backgrounds are grouped in, always ending with "Other".
+  '''
   # Note: Re-ordering of backgrounds in the stacked histogram can be done here by rearranging the processes in these lists
   if presentation_mode:
     keep_separate = {
@@ -710,70 +750,93 @@ def get_binned_backgrounds(final_state_mode, testing, background_dictionary, var
   MC_by_family = keep_separate[final_state_mode]
   if userMC!=[]: MC_by_family = userMC
   if "Other" not in MC_by_family: MC_by_family.append("Other")
+  return MC_by_family
 
-  # initialize empty family entries here
-  first_key = list(h_MC_by_process)[0]
-  h_MC_by_family = {}
-  for family_name in MC_by_family:
-    h_MC_by_family[family_name] = {}
-    h_MC_by_family[family_name]["BinnedEvents"] = np.zeros(len(h_MC_by_process[first_key]["BinnedEvents"]))
-    h_MC_by_family[family_name]["BinnedErrors"] = np.zeros(len(h_MC_by_process[first_key]["BinnedErrors"]))
- 
-  background_is_processed = {}
-  for MC_process in h_MC_by_process:
-    background_is_processed[MC_process] = False
+
+def map_processes_to_families(MC_processes, MC_by_family, presentation_mode=False):
+  '''
+  Return a dictionary of the family of each MC process (None if it doesn't belong to any family).
+  A process goes to the first family whose name it contains, with diboson and HWW processes
+  going to "VV" and "HWW" when not in presentation mode, and to "Other" if no family name matches.
+  '''
+  family_map = {}
+  for MC_process in MC_processes:
+    family_map[MC_process] = None
     for family_name in MC_by_family:
       #print(family_name) # DEBUG
-      if   (not background_is_processed[MC_process]) and (family_name in MC_process):
-        h_MC_by_family[family_name]["BinnedEvents"] += h_MC_by_process[MC_process]["BinnedEvents"]
-        h_MC_by_family[family_name]["BinnedErrors"] += h_MC_by_process[MC_process]["BinnedErrors"]
-        background_is_processed[MC_process] = True
+      if   (family_map[MC_process] == None) and (family_name in MC_process):
+        family_map[MC_process] = family_name
       # allowing HWW to go into Other, if "HWW" is not a valid family name.
-      elif ( (not background_is_processed[MC_process]) and family_name=="HWW" 
+      elif ( (family_map[MC_process] == None) and family_name=="HWW" 
             and (np.any([hww_tag in MC_process for hww_tag in ["ggH_WW", "VBF_WW"]]))
             and (not presentation_mode) ): # special handling for HWW when not in presentation mode
-        h_MC_by_family["HWW"]["BinnedEvents"] += h_MC_by_process[MC_process]["BinnedEvents"]
-        h_MC_by_family["HWW"]["BinnedErrors"] += h_MC_by_process[MC_process]["BinnedErrors"]
-        background_is_processed[MC_process] = True
-      elif ( (not background_is_processed[MC_process]) 
+        family_map[MC_process] = "HWW"
+      elif ( (family_map[MC_process] == None) 
             and (np.any([diboson_tag in MC_process for diboson_tag in ["WW", "WZ", "ZZ"] if "_WW" not in MC_process]))
             and (not presentation_mode) ): # special handling for VV when not in presentation mode
-        h_MC_by_family["VV"]["BinnedEvents"] += h_MC_by_process[MC_process]["BinnedEvents"]
-        h_MC_by_family["VV"]["BinnedErrors"] += h_MC_by_process[MC_process]["BinnedErrors"]
-        background_is_processed[MC_process] = True
+        family_map[MC_process] = "VV"
       else: 
         pass
-        # background_is_processed[MC_process] == True OR 
+        # family_map[MC_process] is already set OR 
         # current family name doesn't match sample, but a later one does
         # for example, MC_process = DY0JNLO , but it has to go through families JetFakes, TT, ST, VV before DY
-    if (not background_is_processed[MC_process]) and (not np.any([family_name in MC_process for family_name in MC_by_family])):
-      h_MC_by_family["Other"]["BinnedEvents"] += h_MC_by_process[MC_process]["BinnedEvents"]
-      h_MC_by_family["Other"]["BinnedErrors"] += h_MC_by_process[MC_process]["BinnedErrors"] # TODO: add in quadrature
-      background_is_processed[MC_process] = True
-      #print(background_is_processed) # DEBUG
-  for process_key, is_processed in background_is_processed.items():
-    if (not is_processed): print(f"Warning! {process_key} wasn't processed! It's not part of the plot!")
-  for family_name in MC_by_family:
-    checksum = np.sum(h_MC_by_family[family_name]["BinnedEvents"])
-    if (checksum == 0): 
-      #print(f"MC family {family_name} has no events") # DEBUG
-      del h_MC_by_family[family_name]
+    if (family_map[MC_process] == None) and (not np.any([family_name in MC_process for family_name in MC_by_family])):
+      family_map[MC_process] = "Other"
+  return family_map
+
+
+family_routing_tables = {} # (MC processes, MC families, presentation_mode) : family index of each process
+
+def get_family_routing(MC_processes, MC_by_family, presentation_mode=False):
+  '''
+  Return the routing table of 'MC_processes', an integer array with the index in 'MC_by_family'
+  of the family of each process (-1 if it doesn't belong to any, see 'map_processes_to_families').
+  The table is only resolved once per run for a given list of processes and families.
+  '''
+  routing_key = (tuple(MC_processes), tuple(MC_by_family), presentation_mode)
+  if routing_key not in family_routing_tables:
+    family_map   = map_processes_to_families(MC_processes, MC_by_family, presentation_mode)
+    family_index = {family_name : i for i, family_name in enumerate(MC_by_family)}
+    # a family outside of MC_by_family (VV or HWW special handling) fails here, like it did when filling it
+    family_routing_tables[routing_key] = np.array([-1 if family_map[MC_process] == None else family_index[family_map[MC_process]]
+                                                   for MC_process in MC_processes], dtype=int)
+  return family_routing_tables[routing_key]
+
+
+def group_binned_by_family(h_MC_by_process, MC_by_family, family_routing):
+  '''
+  Add up the histograms of the MC processes by family, using the 'family_routing' of 'get_family_routing'.
+  The (process x bin) matrices of the histograms are summed into (family x bin) matrices in one reduction
+  (in the order of the processes, as when adding them one by one). Families without events are removed.
+  '''
+  MC_processes = list(h_MC_by_process)
+  edges = h_MC_by_process[MC_processes[0]].edges
+  for MC_process in [MC_process for MC_process, family in zip(MC_processes, family_routing) if family == -1]:
+    print(f"Warning! {MC_process} wasn't processed! It's not part of the plot!")
+  routed = family_routing >= 0
+  h_MC_by_family = {}
+  family_sums = {}
+  for binned in ["BinnedEvents", "BinnedErrors"]:
+    process_matrix = np.array([h_MC_by_process[MC_process][binned] for MC_process in MC_processes], dtype=float)
+    family_sums[binned] = np.zeros((len(MC_by_family), process_matrix.shape[1]))
+    np.add.at(family_sums[binned], family_routing[routed], process_matrix[routed]) # TODO: add errors in quadrature
+  for i, family_name in enumerate(MC_by_family):
+    checksum = np.sum(family_sums["BinnedEvents"][i])
+    if (checksum == 0): continue
+    h_MC_by_family[family_name] = Hist(edges, family_sums["BinnedEvents"][i], family_sums["BinnedErrors"][i])
 
   return h_MC_by_family
 
-def get_summed_backgrounds(h_backgrounds):
+def get_summed_backgrounds(h_backgrounds, xbins_):
   '''
   Return a dictionary of summed backgrounds
-  Expecting h_backgrounds to be split and binned already
+  Expecting h_backgrounds to be split and binned already (with 'xbins_', used for an empty Hist if there are none)
   '''
-  accumulated_values, accumulated_errors = 0, 0
-  for background in h_backgrounds:
-    accumulated_values += h_backgrounds[background]["BinnedEvents"]
-    accumulated_errors += h_backgrounds[background]["BinnedErrors"]
   h_summed_backgrounds = {}
-  h_summed_backgrounds["Bkgd"] = {}
-  h_summed_backgrounds["Bkgd"]["BinnedEvents"] = accumulated_values
-  h_summed_backgrounds["Bkgd"]["BinnedErrors"] = accumulated_errors #still squared errors
+  if (len(h_backgrounds) == 0):
+    h_summed_backgrounds["Bkgd"] = Hist(xbins_)
+  else:
+    h_summed_backgrounds["Bkgd"] = Hist.merge(list(h_backgrounds.values())) #still squared errors
   return h_summed_backgrounds
 
 
@@ -782,6 +845,112 @@ def get_binned_signals(final_state, testing, signal_dictionary, variable, xbins_
   return h_signals
 
 
+def get_binned_process_all_vars(final_state, testing, process_dictionary, vars_to_plot, xbins_by_var, lumi_):
+  '''
+  Version of 'get_binned_process' for all of 'vars_to_plot' at once, returning {var : h_processes}.
+  Each process is visited once: its weights are computed (see 'get_process_weights') and all of its
+  variables are binned with the 'xbins_by_var' edges before moving to the next process.
+  '''
+  h_processes_by_var = {var : {} for var in vars_to_plot}
+  for process in process_dictionary:
+    weights = None
+    for var in vars_to_plot:
+      process_variable = process_dictionary[process]["PlotEvents"][var]
+      if len(process_variable) == 0: continue
+      if (weights is None) or (len(weights) != len(process_variable)):
+        weights = get_process_weights(final_state, testing, process_dictionary, process, lumi_, len(process_variable))
+      binned_values, binned_errors = fill_histogram(process_variable, xbins_by_var[var], weights, var)
+      h_processes_by_var[var][process] = Hist(xbins_by_var[var], binned_values, binned_errors)
+  return h_processes_by_var
+
+
+def get_binned_all_vars(final_state_mode, testing, data_dictionary, background_dictionary, signal_dictionary,
+                        vars_to_plot, lumi_, presentation_mode=False, userMC=[]):
+  '''
+  Histogram engine filling every variable of 'vars_to_plot' for every process in one sweep.
+  The bins come from 'make_bins', and the family of each background process is found once
+  for all variables (see 'get_family_routing').
+  Returns {var : {"xbins" : bins, "Data" : h_data, "Backgrounds" : h_backgrounds, "Signals" : h_signals}},
+  the same histograms as 'get_binned_data', 'get_binned_backgrounds', and 'get_binned_signals' for each variable.
+  '''
+  xbins_by_var = {var : make_bins(var, final_state_mode) for var in vars_to_plot}
+  h_by_group = {}
+  h_by_group["Data"]        = get_binned_process_all_vars(final_state_mode, testing, data_dictionary, vars_to_plot, xbins_by_var, lumi_)
+  h_by_group["Backgrounds"] = get_binned_process_all_vars(final_state_mode, testing, background_dictionary, vars_to_plot, xbins_by_var, lumi_)
+  h_by_group["Signals"]     = get_binned_process_all_vars(final_state_mode, testing, signal_dictionary, vars_to_plot, xbins_by_var, lumi_)
+  return group_binned_all_vars(final_state_mode, h_by_group, vars_to_plot, xbins_by_var, presentation_mode, userMC)
+
+
+def group_binned_all_vars(final_state_mode, h_by_group, vars_to_plot, xbins_by_var, presentation_mode=False, userMC=[]):
+  '''
+  Combine the histograms of each process, h_by_group = {"Data"/"Backgrounds"/"Signals" : {var : h_processes}},
+  into the data histogram, the background families, and the signals of each variable, as returned by 'get_binned_all_vars'.
+  '''
+  MC_by_family = set_MC_families(final_state_mode, presentation_mode, userMC)
+  binned_by_var = {}
+  for var in vars_to_plot:
+    h_backgrounds = h_by_group["Backgrounds"][var]
+    binned_by_var[var] = {}
+    binned_by_var[var]["xbins"]       = xbins_by_var[var]
+    binned_by_var[var]["Data"]        = combine_binned_data(h_by_group["Data"][var])
+    family_routing = get_family_routing(h_backgrounds, MC_by_family, presentation_mode)
+    binned_by_var[var]["Backgrounds"] = group_binned_by_family(h_backgrounds, MC_by_family, family_routing)
+    binned_by_var[var]["Signals"]     = h_by_group["Signals"][var]
+  return binned_by_var
+
+
+fine_bin_subdivisions = 10
+
+def make_fine_bins(variable_name, subdivisions=fine_bin_subdivisions):
+  '''
+  High resolution bins of a variable for 'fill_fine_histograms': every edge of every binning of the variable
+  in binning_dictionary (all final states), with each bin between them split into 'subdivisions' equal bins.
+  Any of those binnings, or any other binning on the finer edges, can be made with Hist.rebin.
+  '''
+  binnings = [binning[variable_name] for binning in binning_dictionary.values() if variable_name in binning]
+  all_edges = np.unique(np.concatenate(binnings).astype(float))
+  # drop edges that only differ by rounding, e.g. from np.linspace with a different number of bins
+  tolerance = 1e-9 * (all_edges[-1] - all_edges[0])
+  all_edges = all_edges[np.concatenate(([True], np.diff(all_edges) > tolerance))]
+  fine_edges = [np.linspace(low, high, subdivisions+1)[:-1] for low, high in zip(all_edges[:-1], all_edges[1:])]
+  return np.concatenate(fine_edges + [all_edges[-1:]])
+
+
+def fill_fine_histograms(final_state_mode, testing, data_dictionary, background_dictionary, signal_dictionary,
+                         vars_to_plot, lumi_):
+  '''
+  Fill every variable of 'vars_to_plot' for every process once with the bins of 'make_fine_bins'.
+  Returns {"Data"/"Backgrounds"/"Signals" : {var : {process : Hist}}}, which can be saved with 'save_hists'
+  and turned into the plotted histograms of any aligned binning with 'get_binned_all_vars_from_fine',
+  instead of reprocessing the events for each binning.
+  '''
+  fine_xbins_by_var = {var : make_fine_bins(var) for var in vars_to_plot}
+  fine_hists = {}
+  fine_hists["Data"]        = get_binned_process_all_vars(final_state_mode, testing, data_dictionary, vars_to_plot, fine_xbins_by_var, lumi_)
+  fine_hists["Backgrounds"] = get_binned_process_all_vars(final_state_mode, testing, background_dictionary, vars_to_plot, fine_xbins_by_var, lumi_)
+  fine_hists["Signals"]     = get_binned_process_all_vars(final_state_mode, testing, signal_dictionary, vars_to_plot, fine_xbins_by_var, lumi_)
+  return fine_hists
+
+
+def get_binned_all_vars_from_fine(final_state_mode, fine_hists, vars_to_plot, xbins_by_var={},
+                                  presentation_mode=False, userMC=[]):
+  '''
+  Version of 'get_binned_all_vars' for the histograms of 'fill_fine_histograms' (or loaded with 'load_hists').
+  Each variable is rebinned to xbins_by_var[var], or 'make_bins' if it isn't given, with the events outside
+  of the bins added to the first and last bins. This gives the same histograms as filling the binning directly
+  (up to rounding), except for the under/overflow quirks of 'fill_histogram' when the range is smaller than the fine bins.
+  '''
+  xbins_by_var = {var : xbins_by_var[var] if var in xbins_by_var else make_bins(var, final_state_mode) for var in vars_to_plot}
+  h_by_group = {}
+  for group in ["Data", "Backgrounds", "Signals"]:
+    h_by_group[group] = {}
+    for var in vars_to_plot:
+      fine_h_processes = fine_hists[group].get(var, {})
+      h_by_group[group][var] = {process : fine_h_processes[process].rebin(xbins_by_var[var], flow=True)
+                                for process in fine_h_processes}
+  return group_binned_all_vars(final_state_mode, h_by_group, vars_to_plot, xbins_by_var, presentation_mode, userMC)
+
+
 def get_MC_weights(MC_dictionary, process, useFFweights=False):
   gen     = MC_dictionary[process]["Generator_weight"]
   PU      = MC_dictionary[process]["PUweight"]
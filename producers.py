@@ -6,7 +6,8 @@ from plotting_functions import set_vars_to_plot
 from utility_functions import log_print
 from file_map_dictionary import set_dataset_info
 from file_functions import load_process_from_file
-from cut_and_study_functions import apply_AR_cut
+from file_functions import map_over_files, concatenate_branches
+from cut_and_study_functions import apply_AR_cut_by_jet_mode
 import numpy as np
 import gc
 
@@ -18,22 +19,63 @@ def set_AR_region(final_state_mode, era, temp_version):
   return common_selection
 
 
+def load_and_cut_AR_file(job):
+  '''
+  Worker for 'map_over_files' in 'produce_FF_weights'. Loads the AR events of a single Data file,
+  applies 'apply_AR_cut_by_jet_mode' (which adds the FF weights), and returns only "FF_weight" and the
+  variables to plot of each jet mode, so that little is sent back to the main process.
+  The file is loaded and the AR region cut is applied once for all jet modes.
+  '''
+  dataset = job["dataset"]
+  this_file_map = {dataset: job["input_file"]} # Make a temporary filemap just for this file
+  AR_process_dictionary = load_process_from_file(dataset, job["file_directory"], this_file_map, job["log_file"],
+                                          job["branches"], job["AR_region"], job["final_state_mode"],
+                                          data=True, testing=job["testing"],
+                                          cache_dir=job["cache_dir"], cache_mode=job["cache_mode"],
+                                          pushdown=job["pushdown"], compact_jagged=job["compact_jagged"])
+  AR_events = AR_process_dictionary[dataset]["info"]
+  cut_events_AR_by_jet_mode = apply_AR_cut_by_jet_mode(job["era"], dataset, AR_events, job["final_state_mode"],
+                                                       job["jet_modes"], job["semilep_mode"],
+                                                       job["DeepTau_version"], job["tau_pt_cut"], FF_json=job["FF_json"])
+  results = {}
+  for jet_mode, cut_events_AR in cut_events_AR_by_jet_mode.items():
+    if cut_events_AR == None: continue
+    keep = ["FF_weight"] + [var for var in job["vars_to_plot"][jet_mode] if var in cut_events_AR]
+    results[jet_mode] = {key : cut_events_AR[key] for key in keep}
+  return results
+
+
 def produce_FF_weight(setup, fakesLabel, jet_mode, semilep_mode):
+    '''
+    FF weights and variables to plot of the AR Data events of a single jet mode, see 'produce_FF_weights'.
+    '''
+    jet_mode = jet_mode.removesuffix("_testing")
+    return produce_FF_weights(setup, fakesLabel, [jet_mode], semilep_mode)[jet_mode]
+
+
+def produce_FF_weights(setup, fakesLabel, jet_modes, semilep_mode):
+    '''
+    Load the AR Data events once and return a dictionary keyed by jet mode of FF dictionaries,
+    each holding the "FF_weight" and "PlotEvents" of the events of that jet mode.
+    '''
     # kinda weird, but okay
     testing, final_state_mode, _, era, lumi, tau_pt_cut = setup.state_info # don't reset jet_mode
     using_directory, _, log_file, _, file_map, one_file_at_a_time, temp_version = setup.file_info
     _, _, DeepTau_version, _, _, _, _ = setup.misc_info
+    n_workers = setup.io_info.n_workers if one_file_at_a_time else 1
     if one_file_at_a_time: import glob
 
-    jet_mode = jet_mode.removesuffix("_testing")
+    jet_modes = [jet_mode.removesuffix("_testing") for jet_mode in jet_modes]
     dataset, _ = set_dataset_info(final_state_mode)
     AR_region    = set_AR_region(final_state_mode, era, temp_version) # same role as "set_good_events"
-    vars_to_plot = set_vars_to_plot(final_state_mode, jet_mode)
+    vars_to_plot = {jet_mode : set_vars_to_plot(final_state_mode, jet_mode) for jet_mode in jet_modes}
     branches     = set_branches(final_state_mode, era, DeepTau_version, process=dataset, temp_version=temp_version)
 
-    FF_dictionary = {}
-    FF_dictionary[fakesLabel] = {}
-    FF_dictionary[fakesLabel]["PlotEvents"] = {}
+    FF_dictionaries = {}
+    for jet_mode in jet_modes:
+      FF_dictionaries[jet_mode] = {}
+      FF_dictionaries[jet_mode][fakesLabel] = {}
+      FF_dictionaries[jet_mode][fakesLabel]["PlotEvents"] = {}
  
     log_print(f"Processing {final_state_mode} AR region!", log_file, time=True)
     if not one_file_at_a_time:
@@ -43,27 +85,34 @@ def produce_FF_weight(setup, fakesLabel, jet_mode, semilep_mode):
       # Multiple entries per process, results from wildcard search
       input_files = glob.glob( using_directory + "/" + file_map[dataset] + ".root")
       input_files = sorted([f.replace(using_directory+"/","")[:-5] for f in input_files])
+    jobs = []
     for input_file in input_files:
-      this_file_map = {dataset: input_file} # Make a temporary filemap just for this loop
-      AR_process_dictionary = load_process_from_file(dataset, using_directory, this_file_map, log_file,
-                                              branches, AR_region, final_state_mode,
-                                              data=True, testing=testing)
-      AR_events = AR_process_dictionary[dataset]["info"]
-      cut_events_AR = apply_AR_cut(era, dataset, AR_events, final_state_mode, jet_mode, semilep_mode, DeepTau_version, tau_pt_cut)
-      if "FF_weight" not in FF_dictionary[fakesLabel]: # First file, or not doing one at a time
-        FF_dictionary[fakesLabel]["FF_weight"]  = cut_events_AR["FF_weight"]
-        for var in vars_to_plot:
+      jobs.append({"dataset" : dataset, "input_file" : input_file, "file_directory" : using_directory,
+                   "log_file" : log_file if n_workers <= 1 else None,
+                   "branches" : branches, "AR_region" : AR_region, "final_state_mode" : final_state_mode,
+                   "era" : era, "jet_modes" : jet_modes, "semilep_mode" : semilep_mode,
+                   "DeepTau_version" : DeepTau_version, "tau_pt_cut" : tau_pt_cut,
+                   "vars_to_plot" : vars_to_plot, "testing" : testing,
+                   "cache_dir" : setup.io_info.cache_dir, "cache_mode" : setup.io_info.cache_mode,
+                   "pushdown" : setup.io_info.pushdown, "compact_jagged" : setup.io_info.compact_jagged,
+                   "FF_json" : setup.io_info.FF_json})
+    for cut_events_AR_by_jet_mode in map_over_files(load_and_cut_AR_file, jobs, n_workers):
+      for jet_mode, cut_events_AR in cut_events_AR_by_jet_mode.items():
+        FF_dictionary = FF_dictionaries[jet_mode][fakesLabel]
+        # collect the arrays of each file, they are concatenated once after the last file
+        if "FF_weight" not in FF_dictionary: FF_dictionary["FF_weight"] = []
+        FF_dictionary["FF_weight"].append(cut_events_AR["FF_weight"])
+        for var in vars_to_plot[jet_mode]:
           if ("flav" in var) or ("Generator_weight" in var): continue
-          FF_dictionary[fakesLabel]["PlotEvents"][var] = cut_events_AR[var]
-      else:
-        FF_dictionary[fakesLabel]["FF_weight"]  = np.append(FF_dictionary[fakesLabel]["FF_weight"], cut_events_AR["FF_weight"])
-        for var in vars_to_plot:
-          if ("flav" in var): continue
-          FF_dictionary[fakesLabel]["PlotEvents"][var] = np.append(FF_dictionary[fakesLabel]["PlotEvents"][var], cut_events_AR[var])
-      del AR_process_dictionary
-      del AR_events
-      del cut_events_AR
+          if var not in FF_dictionary["PlotEvents"]: FF_dictionary["PlotEvents"][var] = []
+          FF_dictionary["PlotEvents"][var].append(cut_events_AR[var])
+      del cut_events_AR_by_jet_mode
       gc.collect()
 
-    return FF_dictionary
+    for jet_mode in jet_modes:
+      FF_dictionary = FF_dictionaries[jet_mode][fakesLabel]
+      if "FF_weight" in FF_dictionary: FF_dictionary["FF_weight"] = concatenate_branches(FF_dictionary["FF_weight"])
+      for var in FF_dictionary["PlotEvents"]:
+        FF_dictionary["PlotEvents"][var] = concatenate_branches(FF_dictionary["PlotEvents"][var])
 
+    return FF_dictionaries
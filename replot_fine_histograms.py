@@ -0,0 +1,89 @@
+# libraries
+import numpy as np
+import matplotlib.pyplot as plt
+
+### README
+# this file remakes the standard plots from the fine histograms saved by standard_plot.py with --fine_hists,
+# without loading or cutting any events. Run it with the same arguments as standard_plot.py, e.g.
+#   python3 standard_plot.py --final_state ditau --fine_hists ditau_fine.npz      (once, slow)
+#   python3 replot_fine_histograms.py --final_state ditau --fine_hists ditau_fine.npz   (seconds)
+# The bins come from binning_dictionary.py as usual, or from 'alternative_binnings' below for binning studies.
+# Any binning works as long as its edges are on the fine bins (see 'make_fine_bins' in plotting_functions.py).
+# The bin contents (sum of weights) are the same as from standard_plot.py without --fine_hists, to float precision.
+# The squared errors of the first and last bins can differ when the binning of a final state covers a smaller range
+# than the fine bins (e.g. etau FS_el_pt, etau FS_tau_pt, mutau FS_mu_dz): the events outside it are folded in with
+# their squared weights, while 'fill_histogram' adds the sum of weights of the overflow to the squared weights
+# and counts events at the last edge twice.
+
+from setup                 import setup_handler
+from luminosity_dictionary import luminosities_with_normtag as luminosities
+from plotting_functions    import get_binned_all_vars_from_fine, get_summed_backgrounds
+from plotting_functions    import setup_ratio_plot, make_ratio_plot, spruce_up_plot, spruce_up_legend
+from plotting_functions    import plot_data, plot_MC, plot_signal
+from binning_dictionary    import label_dictionary
+from histogram             import load_hists
+from utility_functions     import print_setup_info, log_print
+
+# e.g. "HTT_m_vis" : np.linspace(50, 290, 12+1)
+alternative_binnings = {}
+
+
+if __name__ == "__main__":
+  setup = setup_handler()
+  testing, final_state_mode, jet_mode, era, lumi, tau_pt_cut = setup.state_info
+  _, plot_dir, log_file, _, _, _, _ = setup.file_info
+  hide_plots, _, _, _, _, _, presentation_mode = setup.misc_info
+  fine_hists_file = setup.io_info.fine_hists
+  if fine_hists_file == None:
+    print("Give the file of fine histograms with --fine_hists, made by running standard_plot.py with the same option")
+    exit()
+
+  print_setup_info(setup)
+  fine_hists = load_hists(fine_hists_file)
+  vars_to_plot = list(fine_hists["SR"]["Data"])
+  log_print(f"Loaded fine histograms of {len(vars_to_plot)} variables from {fine_hists_file}", log_file, time=True)
+
+  binned_Fakes_by_var = get_binned_all_vars_from_fine(final_state_mode, fine_hists["JetFakes"], vars_to_plot,
+                                                      alternative_binnings)
+  binned_by_var = get_binned_all_vars_from_fine(final_state_mode, fine_hists["SR"], vars_to_plot,
+                                                alternative_binnings, presentation_mode=presentation_mode)
+
+  title_era = [key for key in luminosities.items() if key[1] == lumi][0][0]
+  title = f"{title_era}, {lumi:.2f}" + r"$fb^{-1}$"
+
+  for var in vars_to_plot:
+    xbins = binned_by_var[var]["xbins"]
+    hist_ax, hist_ratio = setup_ratio_plot()
+
+    # FF background = data - backgrounds - signals in the FF region, as in standard_plot.py
+    h_Fakes_signals = binned_Fakes_by_var[var]["Signals"]
+    h_JetFakes = binned_Fakes_by_var[var]["Data"]["Data"] - \
+                 get_summed_backgrounds(binned_Fakes_by_var[var]["Backgrounds"], binned_Fakes_by_var[var]["xbins"])["Bkgd"]
+    for signal in h_Fakes_signals:
+      if testing and ("VBF" not in signal): continue
+      h_JetFakes = h_JetFakes - (h_Fakes_signals[signal]/100)
+
+    h_data = binned_by_var[var]["Data"]
+    h_backgrounds = binned_by_var[var]["Backgrounds"]
+    h_summed_backgrounds = get_summed_backgrounds(h_backgrounds, xbins)
+    extra_hist = h_JetFakes["BinnedEvents"]
+    h_summed_backgrounds["Bkgd"]["BinnedEvents"] += extra_hist # adding JetFakes
+    h_signals = binned_by_var[var]["Signals"]
+
+    plot_data(   hist_ax, xbins, h_data,        lumi, presentation_mode)
+    plot_MC(     hist_ax, xbins, h_backgrounds, lumi, extra_hist, presentation_mode)
+    plot_signal( hist_ax, xbins, h_signals,     lumi, presentation_mode)
+
+    make_ratio_plot(hist_ratio, xbins,
+                    h_data["Data"]["BinnedEvents"], "Data", np.ones(np.shape(h_data)),
+                    h_summed_backgrounds["Bkgd"]["BinnedEvents"], "Data", np.ones(np.shape(h_summed_backgrounds)))
+
+    if ("dxy" in var) or ("dz" in var):  hist_ax.set_yscale('log')
+    spruce_up_plot(hist_ax, hist_ratio, label_dictionary[var], title, final_state_mode, jet_mode)
+    spruce_up_legend(hist_ax, final_state_mode)
+
+    plt.savefig(plot_dir + "/" + str(var) + ".png", dpi=200)
+
+  print(f"Plots are in {plot_dir}")
+  if hide_plots: pass
+  else: plt.show()
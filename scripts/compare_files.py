@@ -19,7 +19,7 @@ from file_map_dictionary import set_dataset_info
 from file_functions        import load_process_from_file, append_to_combined_processes, sort_combined_processes
 from FF_functions        import set_JetFakes_process
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, set_protected_branches
+from cut_and_study_functions import apply_cut
 
 # plotting
 from plotting_functions import get_midpoints, make_eta_phi_plot
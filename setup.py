@@ -27,6 +27,21 @@ class setup_handler:
 
     self.parser.add_argument('--one_process',    dest='one_process',    default=None,      action='store')
 
+    # loading options, do not change the physics output
+    self.parser.add_argument('--step_size',    dest='step_size',   default=None,        action='store')
+    self.parser.add_argument('--nworkers',     dest='n_workers',   default=1,           action='store', type=int,
+                             help="with --oneatatime, load and cut this many files in parallel (SR and FF region)")
+    self.parser.add_argument('--cache',        dest='cache_mode',  default="bypass",    action='store')
+    self.parser.add_argument('--cache_dir',    dest='cache_dir',   default="column_cache", action='store')
+    self.parser.add_argument('--single_read',  dest='single_read', default=False,       action='store_true',
+                             help="read each file once for the SR and the FF region, not with --step_size or --nworkers")
+    self.parser.add_argument('--pushdown',     dest='pushdown',    default=False,       action='store_true')
+    self.parser.add_argument('--compact_jagged', dest='compact_jagged', default=False,  action='store_true')
+    # FF evaluation, same FF weights to float precision
+    self.parser.add_argument('--FF_json',      dest='FF_json',     default=None,        action='store')
+    # histogram store, fine bins saved to this npz file for rebinning without reprocessing (see replot_fine_histograms.py)
+    self.parser.add_argument('--fine_hists',   dest='fine_hists',  default=None,        action='store')
+
     args = self.parser.parse_args()
     temp_version = args.temp_version # possible values are V1 and V2 # do not commit
 
@@ -72,7 +87,29 @@ class setup_handler:
     # comparison info (for file/process comparisons)
     one_process = args.one_process
 
+    # loading info
+    # step_size is None by default, load each process in one go. Otherwise stream events in chunks
+    # of this size [possible values are a number of entries "100000" or a memory size "200 MB"]
+    step_size = args.step_size
+    if (step_size != None) and (step_size.isdigit()): step_size = int(step_size)
+    n_workers = args.n_workers # default 1, with --oneatatime process that many files in parallel (SR and FF region)
+    cache_mode = args.cache_mode # default bypass (no cache) [possible values use, refresh (overwrite cache), bypass], caching is opt-in
+    cache_dir  = args.cache_dir  # default column_cache, where preselected events are stored between runs
+    if (cache_mode not in ["use", "refresh", "bypass"]):
+      print(f"Cache mode {cache_mode} not recognized, possible values are use, refresh, and bypass. Bypassing cache.")
+      cache_mode = "bypass"
+    single_read = args.single_read # default False, read each file once for both the SR and the FF region
+    if single_read and ((step_size != None) or (n_workers > 1)):
+      # the combined read loads whole files serially, so chunks and workers would be ignored
+      print("--single_read can't be combined with --step_size or --nworkers, use one or the other")
+      exit()
+    pushdown    = args.pushdown    # default False, read the cut branches first and the rest only where events pass
+    compact_jagged = args.compact_jagged # default False, hold jagged branches as flat content + offsets
+    FF_json     = args.FF_json     # default None, evaluate the FF weights from this correctionlib json (see correctionlib_FF.py)
+    fine_hists  = args.fine_hists  # default None, fill fine bins and save them to this npz file (see make_fine_bins)
+
     # set three named tuples to collect class information that can be accessed later
+    # and a fourth one for loading options, kept separate so the unpacking of the others is unchanged
     from collections import namedtuple
     state_info_template = namedtuple("State_info", "testing, final_state_mode, jet_mode, era, lumi, tau_pt_cut")
     self.state_info     = state_info_template(testing, final_state_mode, jet_mode, era, lumi, tau_pt_cut)
@@ -83,6 +120,10 @@ class setup_handler:
     misc_info_template  = namedtuple("Misc_info", "hide_plots, hide_yields, DeepTau_version, do_JetFakes, semilep_mode, one_process, presentation_mode")
     self.misc_info      = misc_info_template(hide_plots, hide_yields, DeepTau_version, do_JetFakes, semilep_mode, one_process, presentation_mode)
 
+    io_info_template    = namedtuple("IO_info", "step_size, n_workers, cache_mode, cache_dir, single_read, pushdown, compact_jagged, FF_json, fine_hists")
+    self.io_info        = io_info_template(step_size, n_workers, cache_mode, cache_dir, single_read, pushdown, compact_jagged, FF_json,
+                                           fine_hists)
+
   # end class init
 
   def set_infile_directory(self, era, final_state_mode, temp_version):
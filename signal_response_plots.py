@@ -6,7 +6,6 @@ import numpy as np
 import sys
 import matplotlib.pyplot as plt
 import gc
-import copy
 
 # explicitly import used functions from user files, grouped roughly by call order and relatedness
 # import statements for setup
@@ -17,9 +16,10 @@ from file_map_dictionary import set_dataset_info
 
 # import statements for data loading and processing
 from file_functions          import load_process_from_file, append_to_combined_processes, sort_combined_processes
+from file_functions          import make_file_jobs, map_over_files, load_and_cut_file
 from FF_functions            import set_JetFakes_process, FF_control_flow
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, set_protected_branches
+from cut_and_study_functions import partition_by_flavor, DY_flavor_suffixes
 
 # plotting
 from luminosity_dictionary import luminosities_with_normtag as luminosities
@@ -60,6 +60,9 @@ if __name__ == "__main__":
   testing, final_state_mode, jet_mode, era, lumi, tau_pt_cut = setup.state_info
   using_directory, plot_dir, log_file, use_NLO, file_map, one_file_at_a_time, temp_version = setup.file_info
   hide_plots, hide_yields, DeepTau_version, do_JetFakes, semilep_mode, _, presentation_mode = setup.misc_info
+  step_size, n_workers = setup.io_info.step_size, setup.io_info.n_workers
+  cache_dir, cache_mode = setup.io_info.cache_dir, setup.io_info.cache_mode
+  pushdown, compact_jagged = setup.io_info.pushdown, setup.io_info.compact_jagged
   if one_file_at_a_time: import glob
 
   print_setup_info(setup)
@@ -96,11 +99,27 @@ if __name__ == "__main__":
       input_files = glob.glob( using_directory + "/" + file_map[process] + ".root")
       input_files = sorted([f.replace(using_directory+"/","")[:-5] for f in input_files])
 
+    if one_file_at_a_time and (n_workers > 1):
+      # load, cut, and split each file on its own worker, then merge the results in file order
+      jobs = make_file_jobs(process, input_files, using_directory, log_file, branches, good_events,
+                            final_state_mode, era, jet_mode, DeepTau_version, tau_pt_cut, vars_to_plot,
+                            step_size=step_size, testing=testing, n_workers=n_workers,
+                            cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
+      for file_results in map_over_files(load_and_cut_file, jobs, n_workers):
+        if file_results == None: continue
+        for process_name, cut_events in file_results:
+          combined_process_dictionary = append_to_combined_processes(process_name, cut_events, vars_to_plot,
+                                                                     combined_process_dictionary, one_file_at_a_time)
+        del file_results
+        gc.collect()
+      continue
+
     for input_file in input_files:
       this_file_map = {process: input_file} # Make a temporary filemap just for this loop
       new_process_dictionary = load_process_from_file(process, using_directory, this_file_map, log_file,
                                                 branches, good_events, final_state_mode,
-                                                data=("Data" in process), testing=testing)
+                                                data=("Data" in process), testing=testing,
+                                                cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
       if new_process_dictionary == None: continue # skip process if empty
 
       cut_events = apply_HTT_FS_cuts_to_process(era, process, new_process_dictionary, log_file, final_state_mode, jet_mode,
@@ -109,37 +128,13 @@ if __name__ == "__main__":
       if cut_events == None: continue
 
       if ("DY" in process) and (final_state_mode != "dimuon"):
-        # def split_DY_by_gen, return combined_process_dictionary
-        event_flavor_arr = cut_events["event_flavor"]
-        pass_gen_flav, pass_lep_flav, pass_jet_flav = [], [], []
-        for i, event_flavor in enumerate(event_flavor_arr):
-          if event_flavor == "G": pass_gen_flav.append(i)
-          if event_flavor == "L": pass_lep_flav.append(i)
-          if event_flavor == "J": pass_jet_flav.append(i)
-    
-        protected_branches = set_protected_branches(final_state_mode="none", jet_mode="Inclusive")
-        background_gen_deepcopy = copy.deepcopy(cut_events)
-        background_gen_deepcopy["pass_flavor_cut"] = np.array(pass_gen_flav)
-        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_gen_deepcopy == None: continue
-
-        background_lep_deepcopy = copy.deepcopy(cut_events)
-        background_lep_deepcopy["pass_flavor_cut"] = np.array(pass_lep_flav)
-        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_lep_deepcopy == None: continue
-
-        background_jet_deepcopy = copy.deepcopy(cut_events)
-        background_jet_deepcopy["pass_flavor_cut"] = np.array(pass_jet_flav)
-        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_jet_deepcopy == None: continue
+        split_events = partition_by_flavor(cut_events)
+        if split_events == None: continue
 
         if ("NLO" in process): process += "temp"
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYGen"), background_gen_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYLep"), background_lep_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process.replace("temp","DYJet"), background_jet_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
+        for flavor, events in split_events.items():
+          combined_process_dictionary = append_to_combined_processes(process.replace("temp",DY_flavor_suffixes[flavor]), events,
+                                               vars_to_plot, combined_process_dictionary, one_file_at_a_time)
       else:
         combined_process_dictionary = append_to_combined_processes(process, cut_events, vars_to_plot, 
                                                                    combined_process_dictionary, one_file_at_a_time)
@@ -6,7 +6,6 @@ import numpy as np
 import sys
 import matplotlib.pyplot as plt
 import gc
-import copy
 
 # explicitly import used functions from user files, grouped roughly by call order and relatedness
 # import statements for setup
@@ -17,14 +16,19 @@ from file_map_dictionary import set_dataset_info
 
 # import statements for data loading and processing
 from file_functions          import load_process_from_file, append_to_combined_processes, sort_combined_processes
+from file_functions          import load_and_cut_process_in_chunks, set_branches_to_keep
+from file_functions          import make_file_jobs, map_over_files, load_and_cut_file, load_and_cut_FF_file
 from FF_functions            import set_JetFakes_process, FF_control_flow
 from cut_and_study_functions import apply_HTT_FS_cuts_to_process
-from cut_and_study_functions import apply_cut, set_protected_branches
+from cut_and_study_functions import split_DY_by_flavor
+from cut_and_study_functions import select_SR_events, apply_FF_region_cuts_to_process
 
 # plotting
 from luminosity_dictionary import luminosities_with_normtag as luminosities
 from plotting_functions    import get_midpoints, make_eta_phi_plot
 from plotting_functions    import get_binned_data, get_binned_backgrounds, get_binned_signals, get_summed_backgrounds
+from plotting_functions    import get_binned_all_vars, fill_fine_histograms, get_binned_all_vars_from_fine
+from histogram             import save_hists
 from plotting_functions    import setup_ratio_plot, make_ratio_plot, spruce_up_plot, spruce_up_legend
 from plotting_functions    import spruce_up_single_plot, add_text
 from plotting_functions    import plot_data, plot_MC, plot_signal, make_bins, make_pie_chart, make_two_dimensional_plot
@@ -67,6 +71,11 @@ if __name__ == "__main__":
   testing, final_state_mode, jet_mode, era, lumi, tau_pt_cut = setup.state_info
   using_directory, plot_dir, log_file, use_NLO, file_map, one_file_at_a_time, temp_version = setup.file_info
   hide_plots, hide_yields, DeepTau_version, do_JetFakes, semilep_mode, _, presentation_mode = setup.misc_info
+  step_size, n_workers = setup.io_info.step_size, setup.io_info.n_workers
+  cache_dir, cache_mode = setup.io_info.cache_dir, setup.io_info.cache_mode
+  pushdown, compact_jagged = setup.io_info.pushdown, setup.io_info.compact_jagged
+  single_read = setup.io_info.single_read
+  fine_hists_file = setup.io_info.fine_hists
   if one_file_at_a_time: import glob
 
   print_setup_info(setup)
@@ -78,8 +87,15 @@ if __name__ == "__main__":
 
   _, reject_datasets = set_dataset_info(final_state_mode)
 
+  # lazily including the whole updated FF method here because I couldn't figure out the proper
+  # way to include it in a separate file
+  region = "AR_star" # AR_star for DiTau (which is ARPF + ARFP + ARFF), and AR for mutau/etau
+  if (final_state_mode == "mutau") or (final_state_mode == "etau"): region = "AR"
+  non_SR_region = ("AR" in region) or ("DR" in region) or ("aiso" in region) or ("combined" in region)
+  FF_good_events = set_good_events(final_state_mode, era, non_SR_region)
+
   # make and apply cuts to any loaded events, store in new dictionaries for plotting
-  combined_process_dictionary = {}
+  combined_process_dictionary, combined_process_dictionaryFakes = {}, {}
   for process in file_map: 
 
     # being reset each run, but they're literally strings so who cares
@@ -99,52 +115,71 @@ if __name__ == "__main__":
       input_files = glob.glob( using_directory + "/" + file_map[process] + ".root")
       input_files = sorted([f.replace(using_directory+"/","")[:-5] for f in input_files])
 
+    if one_file_at_a_time and (n_workers > 1): # --single_read with --nworkers is rejected in setup.py
+      # load, cut, and split each file on its own worker, then merge the results in file order
+      jobs = make_file_jobs(process, input_files, using_directory, log_file, branches, good_events,
+                            final_state_mode, era, jet_mode, DeepTau_version, tau_pt_cut, vars_to_plot,
+                            step_size=step_size, testing=testing, n_workers=n_workers,
+                            cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
+      for file_results in map_over_files(load_and_cut_file, jobs, n_workers):
+        if file_results == None: continue
+        for process_name, cut_events in file_results:
+          combined_process_dictionary = append_to_combined_processes(process_name, cut_events, vars_to_plot,
+                                                                     combined_process_dictionary, one_file_at_a_time)
+        del file_results
+        gc.collect()
+      continue
+
     for input_file in input_files:
       this_file_map = {process: input_file} # Make a temporary filemap just for this loop
-      new_process_dictionary = load_process_from_file(process, using_directory, this_file_map, log_file,
-                                                branches, good_events, final_state_mode,
-                                                data=("Data" in process), testing=testing)
-      if new_process_dictionary == None: continue # skip process if empty
+      new_process_dictionary = None
+      if single_read:
+        # read once with the looser FF region preselection, which includes all SR events,
+        # process the FF region right away and split the SR events off in memory
+        new_process_dictionary = load_process_from_file(process, using_directory, this_file_map, log_file,
+                                                  branches + ["HTT_SRevent"], FF_good_events, final_state_mode,
+                                                  data=("Data" in process), testing=testing,
+                                                  cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
+        if new_process_dictionary == None: continue # skip process if empty
+        loose_events = new_process_dictionary[process]["info"]
+        new_process_dictionary[process]["info"] = select_SR_events(loose_events)
+
+        FF_cut_events = apply_FF_region_cuts_to_process(era, process, loose_events, final_state_mode, jet_mode,
+                                                        semilep_mode, region, DeepTau_version, tau_pt_cut)
+        if FF_cut_events != None:
+          combined_process_dictionaryFakes = append_to_combined_processes(process, FF_cut_events, vars_to_plot,
+                                                                 combined_process_dictionaryFakes, one_file_at_a_time)
+        del loose_events, FF_cut_events
+
+        cut_events = apply_HTT_FS_cuts_to_process(era, process, new_process_dictionary, log_file, final_state_mode, jet_mode,
+                                                  DeepTau_version, tau_pt_cut)
+      elif step_size != None:
+        # stream the files in chunks, cutting each chunk before reading the next
+        cut_events = load_and_cut_process_in_chunks(process, using_directory, this_file_map, log_file,
+                                                    branches, good_events, final_state_mode,
+                                                    era, jet_mode, DeepTau_version, tau_pt_cut,
+                                                    branches_to_keep=set_branches_to_keep(vars_to_plot),
+                                                    step_size=step_size, data=("Data" in process), testing=testing,
+                                                    compact_jagged=compact_jagged)
+      else:
+        new_process_dictionary = load_process_from_file(process, using_directory, this_file_map, log_file,
+                                                  branches, good_events, final_state_mode,
+                                                  data=("Data" in process), testing=testing,
+                                                  cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
+        if new_process_dictionary == None: continue # skip process if empty
 
-      cut_events = apply_HTT_FS_cuts_to_process(era, process, new_process_dictionary, log_file, final_state_mode, jet_mode,
-                                                DeepTau_version, tau_pt_cut)
+        cut_events = apply_HTT_FS_cuts_to_process(era, process, new_process_dictionary, log_file, final_state_mode, jet_mode,
+                                                  DeepTau_version, tau_pt_cut)
 
       if cut_events == None: continue
 
       if ("DY" in process) and (final_state_mode != "dimuon"):
-        # def split_DY_by_gen, return combined_process_dictionary
-        event_flavor_arr = cut_events["event_flavor"]
-        pass_gen_flav, pass_lep_flav, pass_jet_flav = [], [], []
-        for i, event_flavor in enumerate(event_flavor_arr):
-          if event_flavor == "G": pass_gen_flav.append(i)
-          if event_flavor == "L": pass_lep_flav.append(i)
-          if event_flavor == "J": pass_jet_flav.append(i)
-    
-        protected_branches = set_protected_branches(final_state_mode="none", jet_mode="Inclusive")
-        background_gen_deepcopy = copy.deepcopy(cut_events)
-        background_gen_deepcopy["pass_flavor_cut"] = np.array(pass_gen_flav)
-        background_gen_deepcopy = apply_cut(background_gen_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_gen_deepcopy == None: continue
-
-        background_lep_deepcopy = copy.deepcopy(cut_events)
-        background_lep_deepcopy["pass_flavor_cut"] = np.array(pass_lep_flav)
-        background_lep_deepcopy = apply_cut(background_lep_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_lep_deepcopy == None: continue
-
-        background_jet_deepcopy = copy.deepcopy(cut_events)
-        background_jet_deepcopy["pass_flavor_cut"] = np.array(pass_jet_flav)
-        background_jet_deepcopy = apply_cut(background_jet_deepcopy, "pass_flavor_cut", protected_branches)
-        if background_jet_deepcopy == None: continue
-
-        combined_process_dictionary = append_to_combined_processes(process+"DYGen", background_gen_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process+"DYLep", background_lep_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        combined_process_dictionary = append_to_combined_processes(process+"DYJet", background_jet_deepcopy, 
-                                             vars_to_plot, combined_process_dictionary, one_file_at_a_time)
-        del background_gen_deepcopy
-        del background_lep_deepcopy
-        del background_jet_deepcopy
+        split_events = split_DY_by_flavor(process, cut_events)
+        if split_events == None: continue
+        for process_name, events in split_events.items():
+          combined_process_dictionary = append_to_combined_processes(process_name, events,
+                                               vars_to_plot, combined_process_dictionary, one_file_at_a_time)
+        del split_events
       else:
         combined_process_dictionary = append_to_combined_processes(process, cut_events, vars_to_plot, 
                                                                    combined_process_dictionary, one_file_at_a_time)
@@ -170,16 +205,10 @@ if __name__ == "__main__":
   # JetFakes QCD with WJ from MC
   # no JetFakes with WJ from MC - for debug
 
-  # lazily including the whole updated FF method here because I couldn't figure out the proper
-  # way to include it in a separate file
-  region = "AR_star" # AR_star for DiTau (which is ARPF + ARFP + ARFF), and AR for mutau/etau
-  if (final_state_mode == "mutau") or (final_state_mode == "etau"): region = "AR"
-  non_SR_region = ("AR" in region) or ("DR" in region) or ("aiso" in region) or ("combined" in region)
-  good_events  = set_good_events(final_state_mode, era, non_SR_region)
-
   # make and apply cuts to any loaded events, store in new dictionaries for plotting
-  combined_process_dictionaryFakes = {}
+  # (skipped if the FF region was already processed in the first loop with single_read)
   for process in file_map: 
+    if single_read: break
 
     branches     = set_branches(final_state_mode, era, DeepTau_version, process, temp_version=temp_version)
 
@@ -192,59 +221,33 @@ if __name__ == "__main__":
       input_files = glob.glob( using_directory + "/" + file_map[process] + ".root")
       input_files = sorted([f.replace(using_directory+"/","")[:-5] for f in input_files])
 
+    if one_file_at_a_time and (n_workers > 1):
+      # load and cut each file of the FF region on its own worker, then merge the results in file order
+      jobs = make_file_jobs(process, input_files, using_directory, log_file, branches, FF_good_events,
+                            final_state_mode, era, jet_mode, DeepTau_version, tau_pt_cut, vars_to_plot,
+                            testing=testing, n_workers=n_workers, cache_dir=cache_dir, cache_mode=cache_mode,
+                            pushdown=pushdown, compact_jagged=compact_jagged, semilep_mode=semilep_mode, region=region)
+      for file_results in map_over_files(load_and_cut_FF_file, jobs, n_workers):
+        if file_results == None: continue
+        for process_name, cut_events in file_results:
+          combined_process_dictionaryFakes = append_to_combined_processes(process_name, cut_events, vars_to_plot,
+                                                                 combined_process_dictionaryFakes, one_file_at_a_time)
+        del file_results
+        gc.collect()
+      continue
+
     for input_file in input_files:
       this_file_map = {process: input_file}
       new_process_dictionary = load_process_from_file(process, using_directory, this_file_map, log_file,
-                                            branches, good_events, final_state_mode,
-                                            data=("Data" in process), testing=testing)
+                                            branches, FF_good_events, final_state_mode,
+                                            data=("Data" in process), testing=testing,
+                                            cache_dir=cache_dir, cache_mode=cache_mode, pushdown=pushdown, compact_jagged=compact_jagged)
+      if new_process_dictionary == None: continue
       event_dictionary = new_process_dictionary[process]["info"]
-      if (event_dictionary == None): continue
-
-      protected_branches = ["None"]
-      from cut_and_study_functions import append_lepton_indices, append_flavor_indices
-      event_dictionary = append_lepton_indices(event_dictionary)
-      if ("Data" not in process):
-        protected_branches = ["FS_t1_flav", "FS_t2_flav", "pass_gen_cuts", "event_flavor"]
-        from file_functions import load_and_store_NWEvents
-        load_and_store_NWEvents(process, event_dictionary)
-        # Remove fakes from MC if they come from TT or WJ samples.
-        # We do this because we assume their jetFakes are not well-modeled
-        # and so we replace them with the JetFakes estimate from Data.
-        # For other MC, we use the fakes from MC, meaning those should be subtracted from Data
-        # during the estimate.
-        keep_fakes = False if (("TT" in process) or ("WJ" in process)) else True
-        event_dictionary = append_flavor_indices(event_dictionary, final_state_mode, keep_fakes=keep_fakes)
-        event_dictionary = apply_cut(event_dictionary, "pass_gen_cuts", protected_branches)
-        if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-
-      event_dictionary = FF_control_flow(final_state_mode, semilep_mode, region, event_dictionary, DeepTau_version)
-      event_dictionary = apply_cut(event_dictionary, "pass_"+region+"_cuts", protected_branches)
-
-      if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-      from cut_and_study_functions import apply_jet_cut
-      event_dictionary   = apply_jet_cut(event_dictionary, jet_mode)
-      if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-
-      skip_DeepTau = True
-      if (final_state_mode == "ditau"):
-        from cut_ditau_functions import make_ditau_cut
-        event_dictionary   = make_ditau_cut(era, event_dictionary, DeepTau_version, skip_DeepTau, tau_pt_cut)
-        if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-
-      if (final_state_mode == "mutau"):
-        from cut_mutau_functions import make_mutau_cut
-        event_dictionary   = make_mutau_cut(era, event_dictionary, DeepTau_version)
-        if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-
-      if (final_state_mode == "etau"):
-        from cut_etau_functions import make_etau_cut
-        event_dictionary   = make_etau_cut(era, event_dictionary, DeepTau_version)
-        if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-
-      protected_branches = set_protected_branches(final_state_mode=final_state_mode, jet_mode="none")
-      event_dictionary   = apply_cut(event_dictionary, "pass_cuts", protected_branches)
-      if (event_dictionary==None or len(event_dictionary["run"])==0): continue
-      # then skip DY splitting stuff because we subtract MC from Data later where the MC is all combined anyways
+
+      event_dictionary = apply_FF_region_cuts_to_process(era, process, event_dictionary, final_state_mode, jet_mode,
+                                                         semilep_mode, region, DeepTau_version, tau_pt_cut)
+      if event_dictionary == None: continue
 
       combined_process_dictionaryFakes = append_to_combined_processes(process, event_dictionary, vars_to_plot, 
                                                              combined_process_dictionaryFakes, one_file_at_a_time)
@@ -260,32 +263,38 @@ if __name__ == "__main__":
   # TODO: if mutau or etau give handling for two binned processes, JetFakes_QCD and JetFakes_WJ
 
   binned_JetFakes_var_dictionary = {}
+  log_print(f"Binning {len(vars_to_plot)} variables for {fakesLabel}", log_file, time=True)
+  if fine_hists_file != None:
+    # fill fine bins once, the plotted bins (and any other aligned binning, see replot_fine_histograms.py) are made from them
+    fine_hists = {}
+    fine_hists["JetFakes"] = fill_fine_histograms(final_state_mode, testing, data_dictionaryFakes, background_dictionaryFakes,
+                                                  signal_dictionaryFakes, vars_to_plot, lumi)
+    binned_Fakes_by_var = get_binned_all_vars_from_fine(final_state_mode, fine_hists["JetFakes"], vars_to_plot)
+  else:
+    binned_Fakes_by_var = get_binned_all_vars(final_state_mode, testing, data_dictionaryFakes, background_dictionaryFakes,
+                                              signal_dictionaryFakes, vars_to_plot, lumi)
   for var in vars_to_plot:
-    log_print(f"Plotting {var}", log_file, time=True)
-    xbins = make_bins(var, final_state_mode)
-
-    h_data               = get_binned_data(final_state_mode, testing, data_dictionaryFakes, var, xbins, lumi)
-    h_backgrounds        = get_binned_backgrounds(final_state_mode, testing, background_dictionaryFakes, var, xbins, lumi)
-    h_summed_backgrounds = get_summed_backgrounds(h_backgrounds)
-    h_signals            = get_binned_signals(final_state_mode, testing, signal_dictionaryFakes, var, xbins, lumi) 
+    h_data               = binned_Fakes_by_var[var]["Data"]
+    h_backgrounds        = binned_Fakes_by_var[var]["Backgrounds"]
+    h_summed_backgrounds = get_summed_backgrounds(h_backgrounds, binned_Fakes_by_var[var]["xbins"])
+    h_signals            = binned_Fakes_by_var[var]["Signals"]
 
     # FF background = h_data(already mult. by FF) - h_summed_backgrounds(ditto) - h_signals(ditto)
+    # Hist arithmetic, the squared errors of all terms add up
     if testing:
-      jetFakes_background = h_data["Data"]["BinnedEvents"] - \
-                            h_summed_backgrounds["Bkgd"]["BinnedEvents"] - \
-                            (h_signals["VBF_TauTauFakes"]["BinnedEvents"]/100)
+      jetFakes_background = h_data["Data"] - \
+                            h_summed_backgrounds["Bkgd"] - \
+                            (h_signals["VBF_TauTauFakes"]/100)
     else:
-      jetFakes_background = h_data["Data"]["BinnedEvents"] - \
-                            h_summed_backgrounds["Bkgd"]["BinnedEvents"] - \
-                            (h_signals["ggH_TauTauFakes"]["BinnedEvents"]/100) - \
-                            (h_signals["VBF_TauTauFakes"]["BinnedEvents"]/100) - \
-                            (h_signals["WmH_TauTauFakes"]["BinnedEvents"]/100) - \
-                            (h_signals["WpH_TauTauFakes"]["BinnedEvents"]/100) - \
-                            (h_signals["ZH_TauTauFakes"]["BinnedEvents"]/100)
-
-    binned_JetFakes_var_dictionary[var] = {}
-    binned_JetFakes_var_dictionary[var]["BinnedEvents"] = jetFakes_background
-    binned_JetFakes_var_dictionary[var]["BinnedErrors"] = {}
+      jetFakes_background = h_data["Data"] - \
+                            h_summed_backgrounds["Bkgd"] - \
+                            (h_signals["ggH_TauTauFakes"]/100) - \
+                            (h_signals["VBF_TauTauFakes"]/100) - \
+                            (h_signals["WmH_TauTauFakes"]/100) - \
+                            (h_signals["WpH_TauTauFakes"]/100) - \
+                            (h_signals["ZH_TauTauFakes"]/100)
+
+    binned_JetFakes_var_dictionary[var] = jetFakes_background
 
   log_print("Processing finished!", log_file, time=True)
 
@@ -353,7 +362,7 @@ if __name__ == "__main__":
                                         mask=unrolled_bins_data, mask_n=ith_bin)
           h_backgrounds_ur = get_binned_backgrounds(final_state_mode, testing, background_dictionary, rolled_var, xbins, lumi,
                                         mask=unrolled_bins_background, mask_n=ith_bin)
-          h_summed_backgrounds_ur = get_summed_backgrounds(h_backgrounds_ur)
+          h_summed_backgrounds_ur = get_summed_backgrounds(h_backgrounds_ur, xbins)
           # ADD THE MANUAL FF WEIGHTS!
           h_signals_ur = get_binned_signals(final_state_mode, testing, signal_dictionary, rolled_var, xbins, lumi,
                                         mask=unrolled_bins_signal, mask_n=ith_bin)
@@ -399,19 +408,28 @@ if __name__ == "__main__":
                     + str(unrolled_var) + ".png", dpi=200)
  
 
+  if fine_hists_file != None:
+    fine_hists["SR"] = fill_fine_histograms(final_state_mode, testing, data_dictionary, background_dictionary,
+                                            signal_dictionary, vars_to_plot, lumi)
+    save_hists(fine_hists_file, fine_hists)
+    log_print(f"Fine histograms saved to {fine_hists_file}", log_file, time=True)
+    binned_by_var = get_binned_all_vars_from_fine(final_state_mode, fine_hists["SR"], vars_to_plot,
+                                                  presentation_mode=presentation_mode)
+  else:
+    binned_by_var = get_binned_all_vars(final_state_mode, testing, data_dictionary, background_dictionary,
+                                        signal_dictionary, vars_to_plot, lumi, presentation_mode)
   for var in vars_to_plot:
     if DEBUG: log_print(f"Plotting {var}", log_file, time=True)
 
-    xbins = make_bins(var, final_state_mode)
+    xbins = binned_by_var[var]["xbins"]
     hist_ax, hist_ratio = setup_ratio_plot()
 
-    h_data = get_binned_data(final_state_mode, testing, data_dictionary, var, xbins, lumi)
-    h_backgrounds = get_binned_backgrounds(final_state_mode, testing, background_dictionary, var, xbins, lumi,
-                                           presentation_mode)
-    h_summed_backgrounds = get_summed_backgrounds(h_backgrounds)
+    h_data = binned_by_var[var]["Data"]
+    h_backgrounds = binned_by_var[var]["Backgrounds"]
+    h_summed_backgrounds = get_summed_backgrounds(h_backgrounds, xbins)
     extra_hist = binned_JetFakes_var_dictionary[var]["BinnedEvents"]
     h_summed_backgrounds["Bkgd"]["BinnedEvents"] += extra_hist # adding JetFakes
-    h_signals = get_binned_signals(final_state_mode, testing, signal_dictionary, var, xbins, lumi) 
+    h_signals = binned_by_var[var]["Signals"]
 
     # plot everything :)
     plot_data(   hist_ax, xbins, h_data,        lumi, presentation_mode)
@@ -2,6 +2,8 @@
 # This is a mapping of final_state_mode to HLT triggers included in branches "Trigger_[final_state_mode]"
 # Very similar in design to "TriggerList.py" in NanoTauAnalysis.
 
+import numpy as np
+
 triggers_dictionary = {
   "2022" : {
     "ditau" : [
@@ -56,6 +58,147 @@ triggers_dictionary = {
 }
 
 
+def get_trigger_era(era):
+  '''
+  Return the key of 'triggers_dictionary' used for a given era, e.g. "2022" for "2022 EE".
+  Eras without their own entry use the triggers of 2023.
+  '''
+  return next((era_year for era_year in triggers_dictionary if era_year in era), "2023")
+
+
+# Offline kinematic requirements of each trigger, used to fill "FS_trig_idx".
+# For each final state, "common" cuts are applied for all triggers and "rules" are listed
+# in the order of "FS_trig_idx", which is also the priority order if an event passes more than one.
+# Each rule has
+#   "trigger" : HLT branch, treated as never firing in eras where it is not in 'triggers_dictionary'
+#   "eras"    : keys of 'triggers_dictionary' where the rule is used, it never passes otherwise
+#   "veto"    : HLT branches that must not fire, to keep trigger coverage exclusive
+#   "cuts"    : variable : (lower, upper) bounds, both exclusive, None for no bound
+# variables ending in "_eta" are compared as absolute values.
+# Adding a trigger or era is done here and in 'triggers_dictionary'.
+trigger_kinems_dictionary = {
+  "ditau" : {
+    "common" : {},
+    "rules"  : [
+      { "trigger" : "HLT_DoubleMediumDeepTauPFTauHPS35_L2NN_eta2p1", # DiTau
+        "eras"    : ["2022", "2023"],
+        "veto"    : [],
+        "cuts"    : { "t1_pt" : (40, None), "t2_pt" : (40, None), "t1_eta" : (None, 2.1), "t2_eta" : (None, 2.1) },
+      },
+      { "trigger" : "HLT_DoubleMediumDeepTauPFTauHPS30_L2NN_eta2p1_PFJet60", # DiTau+Jet
+        "eras"    : ["2022", "2023"],
+        "veto"    : ["HLT_DoubleMediumDeepTauPFTauHPS35_L2NN_eta2p1"],
+        "cuts"    : { "t1_pt" : (35, None), "t2_pt" : (35, None), "t1_eta" : (None, 2.1), "t2_eta" : (None, 2.1),
+                      "j1_pt" : (65, None) },
+      },
+      { "trigger" : "HLT_DoublePFJets40_Mass500_MediumDeepTauPFTauHPS45_L2NN_MediumDeepTauPFTauHPS20_eta2p1", # VBFRun3
+        "eras"    : ["2022"],
+        "veto"    : ["HLT_DoubleMediumDeepTauPFTauHPS35_L2NN_eta2p1", "HLT_DoubleMediumDeepTauPFTauHPS30_L2NN_eta2p1_PFJet60"],
+        "cuts"    : { "t1_pt" : (50, None), "t2_pt" : (25, None), "t1_eta" : (None, 2.1), "t2_eta" : (None, 2.1),
+                      "j1_pt" : (45, None), "j2_pt" : (45, None), "mjj" : (600, None) },
+      },
+      { "trigger" : "HLT_VBF_DiPFJet45_Mjj500_Detajj2p5_MediumDeepTauPFTauHPS45_L2NN_eta2p1", # VBFSingleTau
+        "eras"    : ["2023"],
+        "veto"    : ["HLT_DoubleMediumDeepTauPFTauHPS35_L2NN_eta2p1", "HLT_DoubleMediumDeepTauPFTauHPS30_L2NN_eta2p1_PFJet60"],
+        "cuts"    : { "t1_pt" : (50, None), "t1_eta" : (None, 2.1),
+                      "j1_pt" : (50, None), "j2_pt" : (50, None), "mjj" : (600, None) },
+      },
+    ],
+  },
+  "mutau" : {
+    "common" : { "mu_pt" : (10, None), "mu_eta" : (None, 2.4), "tau_pt" : (25, None), "tau_eta" : (None, 2.5) },
+    "rules"  : [
+      { "trigger" : "HLT_IsoMu24", # Muon
+        "eras"    : ["2022", "2023"],
+        "veto"    : [],
+        "cuts"    : { "mu_pt" : (25, None) },
+      },
+      { "trigger" : "HLT_IsoMu20_eta2p1_LooseDeepTauPFTauHPS27_eta2p1_CrossL1", # MuTau
+        "eras"    : ["2022", "2023"],
+        "veto"    : [],
+        "cuts"    : { "mu_pt" : (21, 25), "mu_eta" : (None, 2.1), "tau_pt" : (32, None), "tau_eta" : (None, 2.1) },
+      },
+      { "trigger" : "HLT_VBF_DiPFJet45_Mjj500_Detajj2p5_MediumDeepTauPFTauHPS45_L2NN_eta2p1", # VBFSingleTau
+        "eras"    : [], # not used
+        "veto"    : [],
+        "cuts"    : { "tau_pt" : (45, None), "tau_eta" : (None, 2.1),
+                      "j1_pt" : (45, None), "j2_pt" : (45, None), "mjj" : (500, None) },
+      },
+      { "trigger" : "HLT_VBF_DiPFJet90_40_Mjj600_Detajj2p5_Mu3_TrkIsoVVL", # VBFSingleMu
+        "eras"    : ["2023"],
+        "veto"    : [],
+        "cuts"    : { "j1_pt" : (90, None), "j2_pt" : (40, None), "mjj" : (600, None) },
+      },
+    ],
+  },
+  "etau" : {
+    "common" : { "el_pt" : (10, None), "el_eta" : (None, 2.5), "tau_pt" : (25, None), "tau_eta" : (None, 2.5) },
+    "rules"  : [
+      { "trigger" : "HLT_Ele30_WPTight_Gsf", # Ele
+        "eras"    : ["2022", "2023"],
+        "veto"    : [],
+        "cuts"    : { "el_pt" : (31, None) },
+      },
+      { "trigger" : "HLT_Ele24_eta2p1_WPTight_Gsf_LooseDeepTauPFTauHPS30_eta2p1_CrossL1", # ETau
+        "eras"    : ["2022", "2023"],
+        "veto"    : [],
+        "cuts"    : { "el_pt" : (25, 31), "el_eta" : (None, 2.1), "tau_pt" : (35, None), "tau_eta" : (None, 2.1) },
+      },
+      { "trigger" : "HLT_VBF_DiPFJet45_Mjj500_Detajj2p5_MediumDeepTauPFTauHPS45_L2NN_eta2p1", # VBFSingleTau
+        "eras"    : [], # not used
+        "veto"    : [],
+        "cuts"    : { "tau_pt" : (45, None), "tau_eta" : (None, 2.1),
+                      "j1_pt" : (45, None), "j2_pt" : (45, None), "mjj" : (500, None) },
+      },
+      { "trigger" : "HLT_VBF_DiPFJet45_Mjj500_Detajj2p5_Ele17_eta2p1_WPTight_Gsf", # VBFSingleEle
+        "eras"    : ["2023"],
+        "veto"    : [],
+        "cuts"    : { "el_pt" : (18, None), "el_eta" : (None, 2.1),
+                      "j1_pt" : (50, None), "j2_pt" : (50, None), "mjj" : (550, None) },
+      },
+    ],
+  },
+}
+
+
+def pass_kinems_by_trigger_table(era, final_state_mode, event_dictionary, kinem_values, event_mask=None):
+  '''
+  Evaluate the rules of 'trigger_kinems_dictionary' for all events at once.
+  'kinem_values' maps the variables used in the rules to arrays over events (dummy values
+  are fine where an object is missing), and 'event_mask' holds requirements common to all
+  triggers that are not simple thresholds, e.g. the jet kinematics of the final state.
+  Returns a boolean array of shape (nRules, nEvents) and "FS_trig_idx",
+  the index of the first passing rule or -1 if no rule passes.
+  '''
+  era_year   = get_trigger_era(era)
+  era_trigs  = triggers_dictionary[era_year][final_state_mode]
+  FS_kinems  = trigger_kinems_dictionary[final_state_mode]
+  nEvents    = len(next(iter(kinem_values.values())))
+  def fired(trigger):
+    if trigger not in era_trigs: return np.zeros(nEvents, dtype=bool)
+    return event_dictionary[trigger].astype(bool)
+  def pass_cuts(cuts):
+    passing = np.ones(nEvents, dtype=bool)
+    for variable, (lower, upper) in cuts.items():
+      values = np.abs(kinem_values[variable]) if variable.endswith("_eta") else kinem_values[variable]
+      if lower != None: passing &= (values > lower)
+      if upper != None: passing &= (values < upper)
+    return passing
+
+  pass_common = pass_cuts(FS_kinems["common"])
+  if event_mask is not None: pass_common &= event_mask
+  trig_results = np.zeros((len(FS_kinems["rules"]), nEvents), dtype=bool)
+  for i_rule, rule in enumerate(FS_kinems["rules"]):
+    if era_year not in rule["eras"]: continue
+    trig_results[i_rule] = fired(rule["trigger"]) & pass_common & pass_cuts(rule["cuts"])
+    for vetoed_trigger in rule["veto"]:
+      trig_results[i_rule] &= ~fired(vetoed_trigger)
+
+  passKinems = np.any(trig_results, axis=0)
+  trig_idx   = np.where(passKinems, np.argmax(trig_results, axis=0), -1)
+  return trig_results, trig_idx
+
+
 def study_triggers():
   '''
   Template function for returning ORs/ANDs of HLT triggers in an organized way.
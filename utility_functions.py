@@ -97,6 +97,12 @@ def print_setup_info(setup):
   log_print(f"NLO samples (DY/WJ)={use_NLO} \t DeepTauVersion={DeepTau_version}", log_file)
   log_print(f"Include JetFakes={do_JetFakes} \t \t FF semileptonic mode={semilep_mode}", log_file)
   log_print(f"Tau pT Cut = {tau_pt_cut}", log_file)
+  if hasattr(setup, "io_info"):
+    log_print(f"One file at a time={one_file_at_a_time} \t Step size={setup.io_info.step_size} \t Workers={setup.io_info.n_workers}", log_file)
+    log_print(f"Cache mode={setup.io_info.cache_mode} \t Cache directory={setup.io_info.cache_dir}", log_file)
+    log_print(f"Single read for SR and FF region={setup.io_info.single_read} \t Pushdown reads={setup.io_info.pushdown}", log_file)
+    log_print(f"Compact jagged branches={setup.io_info.compact_jagged} \t FF json={setup.io_info.FF_json}", log_file)
+    log_print(f"Fine histograms={setup.io_info.fine_hists}", log_file)
   log_print(spacer*screen_width, log_file)
 
 
@@ -115,3 +121,25 @@ def print_processing_info(good_events, branches, vars_to_plot, log_file):
   log_print(spacer*screen_width, log_file)
 
 
+def compare_event_dictionaries(reference, other, branches=None, log_file=None):
+  '''
+  Compare the branches of two event dictionaries event by event, e.g. the output of a
+  loop and a vectorized version of a cut function run on copies of the same events.
+  Floating point branches are compared with np.allclose, everything else exactly.
+  Prints the branches that differ and returns them in a list.
+  '''
+  if branches == None: branches = [branch for branch in reference if branch in other]
+  different_branches = []
+  for branch in branches:
+    ref_values, other_values = np.asarray(reference[branch]), np.asarray(other[branch])
+    if (ref_values.shape != other_values.shape):
+      same = False
+    elif (ref_values.dtype.kind == "f") or (other_values.dtype.kind == "f"):
+      same = np.allclose(ref_values, other_values, rtol=1e-5, atol=1e-6, equal_nan=True)
+    else:
+      same = np.array_equal(ref_values, other_values)
+    if not same:
+      different_branches.append(branch)
+      log_print(f"{branch} differs: {ref_values[:5]} ... vs {other_values[:5]} ...", log_file)
+  log_print(f"{len(branches)-len(different_branches)} of {len(branches)} branches agree", log_file)
+  return different_branches